@@ -2,6 +2,8 @@ import os
 
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -36,6 +38,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'myflo.sharding.shard_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,12 +66,150 @@ WSGI_APPLICATION = 'mycalender.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# MYFLO_SQLITE_PROFILE picks how SQLite is run:
+# - 'basic' (the default): Django's defaults
+# - 'production': WAL journal and tuned pragmas on every connection,
+#   connections reused across requests, write transactions taking the
+#   write lock up front (a deferred one that upgrades late can only fail,
+#   busy_timeout can't help it), and a second, query-only connection for
+#   views marked read_only_view (see myflo.routers)
+# MYFLO_SQLITE_PATH moves the database file.
+#
+# SQLite records journal_mode=WAL in the database file itself, so the
+# 'production' profile needs a database of its own in MYFLO_SQLITE_PATH
+# and never runs against the checked-in db.sqlite3.
+
+SQLITE_PATH = os.environ.get('MYFLO_SQLITE_PATH') or BASE_DIR / 'db.sqlite3'
+SQLITE_PROFILE = os.environ.get('MYFLO_SQLITE_PROFILE', 'basic')
+
+if SQLITE_PROFILE not in ('basic', 'production'):
+    raise ImproperlyConfigured("MYFLO_SQLITE_PROFILE must be 'basic' or 'production'")
+if SQLITE_PROFILE == 'production' and not os.environ.get('MYFLO_SQLITE_PATH'):
+    raise ImproperlyConfigured(
+        "The 'production' SQLite profile switches its database to WAL; set MYFLO_SQLITE_PATH."
+    )
+
+SQLITE_PRAGMAS = [
+    # Readers and the writer no longer block each other
+    'PRAGMA journal_mode=WAL',
+    # Safe with WAL: a power cut can lose the last commits, not corrupt
+    'PRAGMA synchronous=NORMAL',
+    # 64 MiB page cache and 256 MiB memory map per connection
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    # Wait up to 5 s for the write lock instead of failing at once
+    'PRAGMA busy_timeout=5000',
+]
+
+if SQLITE_PROFILE == 'basic':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': SQLITE_PATH,
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': SQLITE_PATH,
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': '; '.join(SQLITE_PRAGMAS),
+                'transaction_mode': 'IMMEDIATE',
+            },
+        },
+        'read': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': SQLITE_PATH,
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': '; '.join(SQLITE_PRAGMAS + ['PRAGMA query_only=1']),
+            },
+            'TEST': {
+                'MIRROR': 'default',
+            },
+        },
+    }
+
+# MYFLO_SHARDS=N spreads the users' rows over N more database files
+# next to the main one, shard_0 ... shard_N-1 (see myflo.sharding). The
+# main database keeps accounts, sessions and users created before
+# sharding was turned on; rebalance_shards moves those.
+
+MYFLO_SHARDS = [f'shard_{index}' for index in range(int(os.environ.get('MYFLO_SHARDS') or 0))]
+
+# The first two shard databases are declared even without sharding, so
+# the sharding tests can turn it on with
+# override_settings(MYFLO_SHARDS=MYFLO_TEST_SHARDS) under any test runner.
+# Django only opens a database something is routed to, so an unused one
+# never creates its file.
+MYFLO_TEST_SHARDS = ['shard_0', 'shard_1']
+
+for alias in dict.fromkeys(MYFLO_SHARDS + MYFLO_TEST_SHARDS):
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        NAME=Path(SQLITE_PATH).with_name(f'{Path(SQLITE_PATH).stem}-{alias}.sqlite3'),
+    )
+
+DATABASE_ROUTERS = ['myflo.sharding.ShardRouter', 'myflo.routers.ReadConnectionRouter']
+
+
+# Cache
+# MYFLO_CACHE_URL (redis://... or memcached://host:port) shares the cache
+# between processes. Cached pages, catalogs and statistics are invalidated
+# by bumping version counters kept in the cache, so only a shared cache
+# lets a save in one process (or a management command) reach the others.
+# Without one each process has its own local-memory cache, and its version
+# counters expire after MYFLO_CACHE_VERSION_TIMEOUT seconds instead: other
+# processes see a change within that time.
+# Every user keeps a few version counters plus cached fragments and bundles,
+# so the local-memory default of 300 entries would start evicting sessions.
+
+MYFLO_CACHE_URL = os.environ.get('MYFLO_CACHE_URL', '')
+
+if MYFLO_CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': MYFLO_CACHE_URL,
+        }
+    }
+elif MYFLO_CACHE_URL.startswith('memcached://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': MYFLO_CACHE_URL.removeprefix('memcached://'),
+        }
+    }
+elif MYFLO_CACHE_URL:
+    raise ImproperlyConfigured('MYFLO_CACHE_URL must start with redis://, rediss:// or memcached://')
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        }
+    }
+
+MYFLO_SHARED_CACHE = bool(MYFLO_CACHE_URL)
+MYFLO_CACHE_VERSION_TIMEOUT = None if MYFLO_SHARED_CACHE else 30
+
+
+# Sessions
+# With a shared cache, session reads are served from it so warm page loads
+# don't hit the database just to authenticate the request. A per-process
+# cache would keep serving a session that was logged out in another
+# process, so without one sessions are read from the database.
+
+if MYFLO_SHARED_CACHE:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 
 
 # Password validation
@@ -115,3 +256,39 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Notification delivery
+# Backend used by the dispatch_notifications worker. EmailBackend sends
+# through EMAIL_BACKEND; FileBackend appends JSON lines to
+# MYFLO_NOTIFICATION_FILE instead.
+
+MYFLO_NOTIFICATION_BACKEND = 'myflo.dispatch.EmailBackend'
+MYFLO_NOTIFICATION_FILE = os.path.join(BASE_DIR, 'notifications.ndjson')
+
+
+# Research export
+# Key of the pseudonyms in research exports, from the environment. Research
+# exports are refused until it is set; SECRET_KEY is never used instead.
+# Keep it stable and private: changing it gives every user a new pseudonym.
+
+MYFLO_RESEARCH_PSEUDONYM_KEY = os.environ.get('MYFLO_RESEARCH_PSEUDONYM_KEY', '')
+
+
+# Sync API
+# Sync pages stop this many seconds behind the clock, so rows written by
+# transactions still in flight are picked up by the next sync. Tombstones
+# of deleted rows are pruned after MYFLO_SYNC_TOMBSTONE_DAYS; older cursors
+# must sync from scratch.
+
+MYFLO_SYNC_SETTLE_SECONDS = 5
+MYFLO_SYNC_TOMBSTONE_DAYS = 90
+
+
+# Async views
+# Serve the dashboard, calendar, analytics and notification pages from
+# myflo.async_views; only worth it under ASGI. With SQLite every async ORM
+# call is still a hop to a thread, so measure with benchmark_async_views
+# before turning it on.
+
+MYFLO_ASYNC_VIEWS = os.environ.get('MYFLO_ASYNC_VIEWS') == '1'
@@ -1,16 +1,128 @@
+from collections import Counter
+
 from django.contrib import admin
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.http import QueryDict
 from django.utils.html import format_html
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.safestring import mark_safe
+from .calendar_grid import invalidate_calendar
+from .cycle_phases import invalidate_cycle_phases
+from .dashboard import invalidate_dashboard
+from .sharding import (
+    current_shard, data_aliases, is_sharded, shard_for_user, shard_of_id, sharding_enabled, use_shard
+)
+from .symptoms import adjust_symptom_usage, touch_daily_logs
 from .models import (
     UserProfile, CycleProfile, Period, DailyLog, Symptom, DailySymptom,
     ContraceptiveType, ContraceptiveUse, Prediction, Notification,
-    HealthProvider, Appointment, CycleInsight, Settings
+    HealthProvider, Appointment, CycleInsight, Settings, ReminderSchedule
 )
 
 
+def update_and_invalidate(queryset, calendar=False, **fields):
+    """
+    Bulk update queryset and drop the cached pages of every affected user;
+    update() sends no signals, so the usual invalidation never runs.
+    """
+    user_ids = set(queryset.values_list('user_id', flat=True))
+    queryset.update(**fields)
+    for user_id in user_ids:
+        invalidate_dashboard(user_id)
+        if calendar:
+            invalidate_calendar(user_id)
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Picks the database the list shows; applied by ShardedAdminMixin"""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in data_aliases()]
+
+    def queryset(self, request, queryset):
+        return queryset
+
+    def choices(self, changelist):
+        # No "All": a list shows one database at a time
+        selected = self.value() or DEFAULT_DB_ALIAS
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == selected,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+
+class ShardedAdminMixin:
+    """
+    Admin of rows spread over the shards (see myflo.sharding). Lists show
+    one database at a time, picked with the shard filter; a row is edited
+    on the database its id belongs to, and a new one on its user's.
+    """
+
+    def request_shard(self, request, object_id=None):
+        if object_id is not None and str(object_id).isdigit():
+            return shard_of_id(object_id) if is_sharded(self.model) else shard_for_user(object_id)
+        if request.method == 'POST':
+            if str(request.POST.get('user', '')).isdigit():
+                return shard_for_user(request.POST['user'])
+            if str(request.POST.get('daily_log', '')).isdigit():
+                return shard_of_id(request.POST['daily_log'])
+        params = request.GET
+        if '_changelist_filters' in params:
+            params = QueryDict(params['_changelist_filters'])
+        alias = params.get(ShardListFilter.parameter_name)
+        return alias if alias in data_aliases() else DEFAULT_DB_ALIAS
+
+    def on_shard(self, alias, view, *args, **kwargs):
+        if not sharding_enabled():
+            return view(*args, **kwargs)
+        with use_shard(alias):
+            response = view(*args, **kwargs)
+            # Templates read querysets too; render them on the same shard
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if sharding_enabled():
+            return (ShardListFilter, *list_filter)
+        return list_filter
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if sharding_enabled() and current_shard():
+            queryset = queryset.using(current_shard())
+        return queryset
+
+    def changelist_view(self, request, extra_context=None):
+        return self.on_shard(self.request_shard(request), super().changelist_view, request, extra_context)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        return self.on_shard(
+            self.request_shard(request, object_id),
+            super().changeform_view, request, object_id, form_url, extra_context
+        )
+
+    def delete_view(self, request, object_id, extra_context=None):
+        return self.on_shard(
+            self.request_shard(request, object_id), super().delete_view, request, object_id, extra_context
+        )
+
+    def history_view(self, request, object_id, extra_context=None):
+        return self.on_shard(
+            self.request_shard(request, object_id), super().history_view, request, object_id, extra_context
+        )
+
+
 # Inline admin classes
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
@@ -53,11 +165,12 @@ class DailySymptomInline(admin.TabularInline):
 
 
 # Extended User Admin
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ShardedAdminMixin, BaseUserAdmin):
     inlines = (UserProfileInline, CycleProfileInline, SettingsInline)
     list_display = ('username', 'email', 'first_name', 'last_name', 
                    'is_staff', 'get_profile_info', 'date_joined')
     list_filter = BaseUserAdmin.list_filter + ('userprofile__privacy_level',)
+    list_select_related = ('userprofile',)
     
     def get_profile_info(self, obj):
         try:
@@ -74,8 +187,9 @@ admin.site.register(User, UserAdmin)
 
 
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'date_of_birth', 'privacy_level', 'notifications_enabled', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('privacy_level', 'notifications_enabled', 'created_at')
     search_fields = ('user__username', 'user__email', 'phone_number')
     readonly_fields = ('created_at', 'updated_at')
@@ -97,9 +211,10 @@ class UserProfileAdmin(admin.ModelAdmin):
 
 
 @admin.register(CycleProfile)
-class CycleProfileAdmin(admin.ModelAdmin):
+class CycleProfileAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'average_cycle_length', 'average_period_length', 
                    'is_irregular', 'last_updated')
+    list_select_related = ('user',)
     list_filter = ('is_irregular', 'average_cycle_length', 'last_updated')
     search_fields = ('user__username', 'user__email')
     readonly_fields = ('last_updated',)
@@ -118,9 +233,10 @@ class CycleProfileAdmin(admin.ModelAdmin):
 
 
 @admin.register(Period)
-class PeriodAdmin(admin.ModelAdmin):
+class PeriodAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'start_date', 'end_date', 'flow_intensity', 
                    'get_duration', 'cycle_day')
+    list_select_related = ('user',)
     list_filter = ('flow_intensity', 'start_date', 'created_at')
     search_fields = ('user__username', 'user__email')
     date_hierarchy = 'start_date'
@@ -146,9 +262,10 @@ class PeriodAdmin(admin.ModelAdmin):
 
 
 @admin.register(DailyLog)
-class DailyLogAdmin(admin.ModelAdmin):
+class DailyLogAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'date', 'flow', 'mood', 'energy_level', 
                    'pain_level', 'get_symptoms_count')
+    list_select_related = ('user',)
     list_filter = ('flow', 'mood', 'date', 'energy_level', 'pain_level')
     search_fields = ('user__username', 'user__email')
     date_hierarchy = 'date'
@@ -173,13 +290,26 @@ class DailyLogAdmin(admin.ModelAdmin):
         })
     )
     
+    def get_queryset(self, request):
+        # Correlated subquery: counted only for the rows on the page, through
+        # the (daily_log, symptom) index
+        symptoms_count = DailySymptom.objects.filter(
+            daily_log=OuterRef('pk')
+        ).order_by().values('daily_log').annotate(count=Count('*')).values('count')
+        return super().get_queryset(request).annotate(
+            symptoms_count=Coalesce(Subquery(symptoms_count, output_field=IntegerField()), 0)
+        )
+    
     def get_symptoms_count(self, obj):
-        count = obj.symptoms.count()
+        count = getattr(obj, 'symptoms_count', None)
+        if count is None:
+            count = obj.symptoms.count()
         if count > 0:
             url = reverse('admin:myflo_dailysymptom_changelist') + f'?daily_log__id={obj.id}'
             return format_html('<a href="{}">{} symptoms</a>', url, count)
         return "No symptoms"
     get_symptoms_count.short_description = "Symptoms"
+    get_symptoms_count.admin_order_field = 'symptoms_count'
 
 
 @admin.register(Symptom)
@@ -190,14 +320,17 @@ class SymptomAdmin(admin.ModelAdmin):
     ordering = ('category', 'name')
     
     def get_usage_count(self, obj):
-        count = obj.dailysymptom_set.count()
-        return f"{count} uses"
+        # Denormalized: counting a symptom's uses over every log is too
+        # costly to do per row, so usage_count is maintained on write
+        return f"{obj.usage_count} uses"
     get_usage_count.short_description = "Usage Count"
+    get_usage_count.admin_order_field = 'usage_count'
 
 
 @admin.register(DailySymptom)
-class DailySymptomAdmin(admin.ModelAdmin):
+class DailySymptomAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('get_user', 'get_date', 'symptom', 'severity')
+    list_select_related = ('daily_log__user', 'symptom')
     list_filter = ('symptom', 'severity', 'daily_log__date')
     search_fields = ('daily_log__user__username', 'symptom__name')
     autocomplete_fields = ['symptom']
@@ -209,6 +342,16 @@ class DailySymptomAdmin(admin.ModelAdmin):
     def get_date(self, obj):
         return obj.daily_log.date
     get_date.short_description = "Date"
+    
+    def delete_queryset(self, request, queryset):
+        # Queryset deletes skip the per-row usage counter signal
+        rows = list(queryset.values_list('symptom_id', 'daily_log__user_id', 'daily_log_id'))
+        usage = Counter(symptom_id for symptom_id, _, _ in rows)
+        super().delete_queryset(request, queryset)
+        adjust_symptom_usage({symptom_id: -count for symptom_id, count in usage.items()})
+        touch_daily_logs({daily_log_id for _, _, daily_log_id in rows})
+        for user_id in {user_id for _, user_id, _ in rows}:
+            invalidate_cycle_phases(user_id)
 
 
 @admin.register(ContraceptiveType)
@@ -220,8 +363,9 @@ class ContraceptiveTypeAdmin(admin.ModelAdmin):
 
 
 @admin.register(ContraceptiveUse)
-class ContraceptiveUseAdmin(admin.ModelAdmin):
+class ContraceptiveUseAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'contraceptive_type', 'date_taken', 'reason', 'dosage')
+    list_select_related = ('user', 'contraceptive_type')
     list_filter = ('contraceptive_type', 'reason', 'date_taken')
     search_fields = ('user__username', 'contraceptive_type__name')
     date_hierarchy = 'date_taken'
@@ -243,9 +387,10 @@ class ContraceptiveUseAdmin(admin.ModelAdmin):
 
 
 @admin.register(Prediction)
-class PredictionAdmin(admin.ModelAdmin):
+class PredictionAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'prediction_type', 'predicted_date', 
                    'confidence_level', 'is_active', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('prediction_type', 'confidence_level', 'is_active', 'predicted_date')
     search_fields = ('user__username', 'user__email')
     date_hierarchy = 'predicted_date'
@@ -254,37 +399,43 @@ class PredictionAdmin(admin.ModelAdmin):
     actions = ['mark_as_inactive', 'mark_as_active']
     
     def mark_as_inactive(self, request, queryset):
-        queryset.update(is_active=False)
+        update_and_invalidate(queryset, calendar=True, is_active=False, updated_at=timezone.now())
     mark_as_inactive.short_description = "Mark selected predictions as inactive"
     
     def mark_as_active(self, request, queryset):
-        queryset.update(is_active=True)
+        update_and_invalidate(queryset, calendar=True, is_active=True, updated_at=timezone.now())
     mark_as_active.short_description = "Mark selected predictions as active"
 
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'notification_type', 'title', 'scheduled_date', 
                    'is_sent', 'is_read')
+    list_select_related = ('user',)
     list_filter = ('notification_type', 'is_sent', 'is_read', 'scheduled_date')
     search_fields = ('user__username', 'title', 'message')
     date_hierarchy = 'scheduled_date'
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'sent_at', 'delivery_attempts', 'last_error')
     
     actions = ['mark_as_sent', 'mark_as_read']
     
     def mark_as_sent(self, request, queryset):
-        queryset.update(is_sent=True)
+        # Also releases any dispatch lease so workers stop retrying them
+        now = timezone.now()
+        queryset.update(
+            is_sent=True, sent_at=now, updated_at=now, claimed_by='', claimed_until=None
+        )
     mark_as_sent.short_description = "Mark selected notifications as sent"
     
     def mark_as_read(self, request, queryset):
-        queryset.update(is_read=True)
+        update_and_invalidate(queryset, is_read=True, updated_at=timezone.now())
     mark_as_read.short_description = "Mark selected notifications as read"
 
 
 @admin.register(HealthProvider)
-class HealthProviderAdmin(admin.ModelAdmin):
+class HealthProviderAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'user', 'specialty', 'phone', 'is_primary')
+    list_select_related = ('user',)
     list_filter = ('specialty', 'is_primary')
     search_fields = ('name', 'user__username', 'specialty', 'phone', 'email')
     
@@ -302,9 +453,10 @@ class HealthProviderAdmin(admin.ModelAdmin):
 
 
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'get_provider_name', 'appointment_date', 
                    'appointment_type', 'is_completed')
+    list_select_related = ('user', 'health_provider')
     list_filter = ('appointment_type', 'is_completed', 'appointment_date')
     search_fields = ('user__username', 'health_provider__name', 'notes')
     date_hierarchy = 'appointment_date'
@@ -335,9 +487,10 @@ class AppointmentAdmin(admin.ModelAdmin):
 
 
 @admin.register(CycleInsight)
-class CycleInsightAdmin(admin.ModelAdmin):
+class CycleInsightAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'insight_type', 'title', 'data_period_start', 
                    'data_period_end', 'is_dismissed', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('insight_type', 'is_dismissed', 'created_at')
     search_fields = ('user__username', 'title', 'description')
     date_hierarchy = 'created_at'
@@ -361,14 +514,15 @@ class CycleInsightAdmin(admin.ModelAdmin):
     actions = ['mark_as_dismissed']
     
     def mark_as_dismissed(self, request, queryset):
-        queryset.update(is_dismissed=True)
+        update_and_invalidate(queryset, is_dismissed=True)
     mark_as_dismissed.short_description = "Mark selected insights as dismissed"
 
 
 @admin.register(Settings)
-class SettingsAdmin(admin.ModelAdmin):
+class SettingsAdmin(ShardedAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'period_reminder_days', 'ovulation_reminder_enabled', 
                    'date_format', 'share_data_for_research')
+    list_select_related = ('user',)
     list_filter = ('ovulation_reminder_enabled', 'date_format', 'temperature_unit',
                   'share_data_for_research', 'allow_data_export')
     search_fields = ('user__username', 'user__email')
@@ -395,6 +549,16 @@ class SettingsAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(ReminderSchedule)
+class ReminderScheduleAdmin(ShardedAdminMixin, admin.ModelAdmin):
+    # Derived from Settings and UserProfile; edit those instead
+    list_display = ('user', 'kind', 'local_time', 'timezone', 'next_fire_at')
+    list_select_related = ('user',)
+    list_filter = ('kind',)
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'kind', 'local_time', 'timezone', 'next_fire_at')
+
+
 # Custom admin site configuration
 admin.site.site_header = "Menstrual Cycle Tracking Admin"
 admin.site.site_title = "Cycle Tracker Admin"
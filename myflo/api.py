@@ -0,0 +1,231 @@
+import hashlib
+import json
+from collections import defaultdict
+from datetime import date
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max, Q
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET
+
+from . import catalogs
+from .models import CycleProfile, Period, DailyLog, DailySymptom, Prediction, Notification, Appointment
+from .routers import read_only_view
+
+
+API_VERSION = 1
+
+
+class ApiResource:
+    """
+    A read-only collection of the requesting user's rows.
+
+    validators() returns the aggregates that change whenever the
+    serialized collection does: they are all the ETag is computed from, so
+    a conditional GET costs one aggregate query over the user's index.
+    """
+
+    def __init__(self, name, model, ordering, fields, date_field, validators,
+                 default_filter=None):
+        self.name = name
+        self.model = model
+        self.ordering = ordering
+        self.fields = fields
+        self.date_field = date_field
+        self.validator_aggregates = validators
+        self.default_filter = default_filter or Q()
+
+    def queryset(self, user, filters):
+        rows = self.model.objects.filter(self.default_filter, user=user)
+        if 'from' in filters:
+            rows = rows.filter(**{f'{self.date_field}__gte': filters['from']})
+        if 'to' in filters:
+            rows = rows.filter(**{f'{self.date_field}__lte': filters['to']})
+        return rows
+
+    def validators(self, user, filters):
+        return self.queryset(user, filters).aggregate(**self.validator_aggregates)
+
+
+def with_symptom_names(rows):
+    """Attach each daily log's symptoms, for all rows in one query"""
+    symptoms = catalogs.symptoms.by_id()
+    by_log = defaultdict(list)
+    for daily_log_id, symptom_id, severity in DailySymptom.objects.filter(
+        daily_log_id__in=[row['id'] for row in rows]
+    ).values_list('daily_log_id', 'symptom_id', 'severity'):
+        symptom = symptoms.get(symptom_id)
+        by_log[daily_log_id].append({
+            'symptom': symptom.name if symptom else str(symptom_id),
+            'severity': severity,
+        })
+    for row in rows:
+        row['symptoms'] = by_log.get(row['id'], [])
+
+
+class PredictionResource(ApiResource):
+    def queryset(self, user, filters):
+        # Upcoming predictions unless ?from= asks for older ones
+        if 'from' not in filters:
+            filters = {**filters, 'from': date.today()}
+        return super().queryset(user, filters)
+
+    def validators(self, user, filters):
+        # Predictions are rewritten in place; the fingerprint stored with
+        # them changes whenever they do
+        aggregates = super().validators(user, filters)
+        aggregates['fingerprint'] = CycleProfile.objects.filter(user=user).values_list(
+            'predictions_fingerprint', flat=True
+        ).first()
+        return aggregates
+
+
+API_RESOURCES = {resource.name: resource for resource in [
+    ApiResource(
+        'periods', Period, ['-start_date'],
+        ['id', 'start_date', 'end_date', 'flow_intensity', 'cycle_day', 'notes',
+         'created_at', 'updated_at'],
+        'start_date',
+        {'count': Count('id'), 'updated_at': Max('updated_at')},
+    ),
+    ApiResource(
+        'daily_logs', DailyLog, ['-date'],
+        ['id', 'date', 'flow', 'mood', 'energy_level', 'pain_level', 'sleep_hours',
+         'exercise_minutes', 'water_intake_glasses', 'notes', 'symptoms',
+         'created_at', 'updated_at'],
+        'date',
+        {'count': Count('id'), 'updated_at': Max('updated_at')},
+    ),
+    PredictionResource(
+        'predictions', Prediction, ['predicted_date'],
+        ['id', 'prediction_type', 'predicted_date', 'confidence_level', 'created_at'],
+        'predicted_date',
+        {'count': Count('id'), 'created_at': Max('created_at')},
+        default_filter=Q(is_active=True),
+    ),
+    ApiResource(
+        'notifications', Notification, ['-created_at', '-id'],
+        ['id', 'notification_type', 'title', 'message', 'scheduled_date', 'is_sent',
+         'is_read', 'created_at', 'sent_at'],
+        'created_at__date',
+        {
+            'count': Count('id'), 'updated_at': Max('updated_at'),
+            # Marking read or sent is a bulk update, which skips auto_now
+            'read': Count('id', filter=Q(is_read=True)),
+            'sent': Count('id', filter=Q(is_sent=True)),
+        },
+    ),
+    ApiResource(
+        'appointments', Appointment, ['appointment_date'],
+        ['id', 'health_provider', 'appointment_date', 'appointment_type', 'notes',
+         'is_completed', 'created_at'],
+        'appointment_date__date',
+        {
+            'count': Count('id'), 'updated_at': Max('updated_at'),
+            'completed': Count('id', filter=Q(is_completed=True)),
+        },
+    ),
+]}
+
+
+def api_error(message, status):
+    return JsonResponse({'version': API_VERSION, 'error': message}, status=status)
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 instead of redirecting"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return api_error('Authentication required.', 401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def requested_fields(request, resource):
+    """Fields named by ?fields=a,b (all by default); ValueError on unknown ones"""
+    value = request.GET.get('fields')
+    if not value:
+        return resource.fields
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in resource.fields]
+    if unknown or not fields:
+        raise ValueError(
+            f"Unknown field(s) {', '.join(unknown) or '(none given)'}; "
+            f"choose from {', '.join(resource.fields)}."
+        )
+    # Keep the resource's field order so equal projections share an ETag
+    return [field for field in resource.fields if field in fields]
+
+
+def requested_filters(request):
+    filters = {}
+    for name in ('from', 'to'):
+        if request.GET.get(name):
+            try:
+                filters[name] = date.fromisoformat(request.GET[name])
+            except ValueError:
+                raise ValueError(f'{name} must be a YYYY-MM-DD date.')
+    return filters
+
+
+def collection_etag(resource, fields, filters, validators):
+    """Strong ETag of a collection representation, without reading its rows"""
+    state = json.dumps(
+        [API_VERSION, resource.name, fields, filters, validators],
+        cls=DjangoJSONEncoder, sort_keys=True
+    )
+    return '"%s"' % hashlib.md5(state.encode(), usedforsecurity=False).hexdigest()
+
+
+def serialize(resource, user, fields, filters):
+    columns = [field for field in fields if field != 'symptoms']
+    with_symptoms = 'symptoms' in fields
+    if with_symptoms and 'id' not in columns:
+        columns.append('id')
+    rows = list(
+        resource.queryset(user, filters).order_by(*resource.ordering).values(*columns)
+    )
+    if with_symptoms:
+        with_symptom_names(rows)
+        if 'id' not in fields:
+            for row in rows:
+                del row['id']
+    return rows
+
+
+@read_only_view
+@require_GET
+@api_login_required
+def collection_view(request, resource_name):
+    """
+    GET /api/v1/<resource>/ with optional ?fields=, ?from= and ?to=.
+
+    Answers If-None-Match with 304 after one aggregate query, before any
+    row is read or serialized. There is no Last-Modified: the newest
+    timestamp misses deletions, which only the ETag's count catches.
+    """
+    resource = API_RESOURCES[resource_name]
+    try:
+        fields = requested_fields(request, resource)
+        filters = requested_filters(request)
+    except ValueError as exc:
+        return api_error(str(exc), 400)
+
+    validators = resource.validators(request.user, filters)
+    etag = collection_etag(resource, fields, filters, validators)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({
+            'version': API_VERSION,
+            'count': validators['count'],
+            'results': serialize(resource, request.user, fields, filters),
+        })
+    response['ETag'] = etag
+    # Private, but always revalidated
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Cookie'
+    return response
@@ -0,0 +1,26 @@
+import asyncio
+
+from django.db.models import QuerySet
+
+
+async def alist(queryset):
+    """Evaluate a queryset from async code"""
+    return [row async for row in queryset]
+
+
+async def gather_queries(**queries):
+    """
+    Run independent queries from async code and return their results by
+    name. Querysets are read as lists; anything else, e.g. queryset.afirst(),
+    is awaited as is.
+
+    Django 5.2's async ORM still hands each query to the request's database
+    thread, so queries of one request take turns there; the event loop
+    serves other requests while they run.
+    """
+    names = list(queries)
+    results = await asyncio.gather(*(
+        alist(query) if isinstance(query, QuerySet) else query
+        for query in queries.values()
+    ))
+    return dict(zip(names, results))
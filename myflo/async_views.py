@@ -0,0 +1,88 @@
+"""
+Async versions of the read-heavy pages, served instead of the views in
+views.py when MYFLO_ASYNC_VIEWS is on.
+
+Their independent queries are awaited together through the async ORM;
+template rendering, which may still read lazily, runs on the request's
+sync thread.
+"""
+import asyncio
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse
+from django.shortcuts import render
+
+from .calendar_grid import arender_month_fragment
+from .cycle_phases import aget_cycle_phases
+from .cycle_stats import aget_cycle_stats
+from .dashboard import aget_dashboard_bundle
+from .models import Notification
+from .pagination import akeyset_page
+from .routers import read_only_view
+from .views import (
+    NOTIFICATION_PAGE_KEYS, NOTIFICATIONS_PER_PAGE, analytics_context, calendar_context,
+    requested_month
+)
+
+
+async def request_user(request):
+    # Resolved once here, so templates reading request.user don't look it up again
+    request.user = await request.auser()
+    return request.user
+
+
+async def arender(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@read_only_view
+@login_required
+async def dashboard_view(request):
+    user = await request_user(request)
+    today = date.today()
+
+    context = dict(await aget_dashboard_bundle(user, today=today))
+    context['today'] = today
+    return await arender(request, 'dashboard.html', context)
+
+
+@read_only_view
+@login_required
+async def calendar_view(request):
+    user = await request_user(request)
+    year, month = requested_month(request)
+
+    calendar_grid_html = await arender_month_fragment(user, year, month)
+    return await arender(request, 'calendar.html', calendar_context(year, month, calendar_grid_html))
+
+
+@read_only_view
+@login_required
+async def calendar_grid_view(request):
+    user = await request_user(request)
+    year, month = requested_month(request)
+
+    return HttpResponse(await arender_month_fragment(user, year, month))
+
+
+@read_only_view
+@login_required
+async def analytics_view(request):
+    user = await request_user(request)
+
+    stats, phases = await asyncio.gather(aget_cycle_stats(user), aget_cycle_phases(user))
+    return await arender(request, 'analytics.html', analytics_context(stats, phases))
+
+
+@read_only_view
+@login_required
+async def notifications_view(request):
+    user = await request_user(request)
+
+    notifications = await akeyset_page(
+        Notification.objects.filter(user=user), NOTIFICATION_PAGE_KEYS, request,
+        NOTIFICATIONS_PER_PAGE
+    )
+    return await arender(request, 'notifications.html', {'notifications': notifications})
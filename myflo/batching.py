@@ -0,0 +1,15 @@
+def user_id_chunks(user_ids, chunk_size):
+    """
+    Yield (first, last) bounds covering chunk_size user ids each.
+
+    user_ids is a values_list of user ids ordered by id; it is streamed, so
+    only one chunk of ids is held in memory at a time.
+    """
+    chunk = []
+    for user_id in user_ids.iterator(chunk_size=10000):
+        chunk.append(user_id)
+        if len(chunk) == chunk_size:
+            yield chunk[0], chunk[-1]
+            chunk = []
+    if chunk:
+        yield chunk[0], chunk[-1]
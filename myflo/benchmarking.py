@@ -0,0 +1,31 @@
+from .cache import bump_user_version
+from .calendar_grid import CALENDAR_CACHE_NAMESPACE
+from .cycle_phases import CYCLE_PHASES_CACHE_NAMESPACE
+from .cycle_stats import CYCLE_STATS_CACHE_NAMESPACE
+from .dashboard import DASHBOARD_CACHE_NAMESPACE
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list; None when it's empty"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def latency_summary(seconds, elapsed):
+    """Count, rate and p50/p99 in milliseconds of operation durations in seconds"""
+    latencies = sorted(value * 1000 for value in seconds)
+    return {
+        'count': len(latencies),
+        'per_second': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.5),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+
+
+def invalidate_read_caches(user_id):
+    # Every page is rebuilt from the database on the next request
+    for namespace in (DASHBOARD_CACHE_NAMESPACE, CALENDAR_CACHE_NAMESPACE,
+                      CYCLE_STATS_CACHE_NAMESPACE, CYCLE_PHASES_CACHE_NAMESPACE):
+        bump_user_version(namespace, user_id)
@@ -0,0 +1,66 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _fresh_version():
+    # Seeded from the clock so an evicted counter never restarts at a value
+    # that older cache entries were stored under.
+    return int(time.time() * 1000)
+
+
+def version_timeout():
+    # A local-memory cache is per process: its counters expire so that
+    # bumps made elsewhere are picked up within the timeout
+    return settings.MYFLO_CACHE_VERSION_TIMEOUT
+
+
+def get_version(key):
+    """
+    Current value of a version counter. Bumps reach every process at once
+    with a shared cache (MYFLO_CACHE_URL), otherwise within
+    MYFLO_CACHE_VERSION_TIMEOUT seconds.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _fresh_version(), version_timeout())
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key):
+    """get_version for async code"""
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _fresh_version(), version_timeout())
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(key):
+    """Advance a version counter, invalidating everything stored under it"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _fresh_version()
+        cache.set(key, version, version_timeout())
+        return version
+
+
+def user_version_key(namespace, user_id):
+    return f'myflo:{namespace}:version:{user_id}'
+
+
+def get_user_version(namespace, user_id):
+    """Current cache version of a user's data in namespace"""
+    return get_version(user_version_key(namespace, user_id))
+
+
+async def aget_user_version(namespace, user_id):
+    return await aget_version(user_version_key(namespace, user_id))
+
+
+def bump_user_version(namespace, user_id):
+    """Invalidate every entry cached under a user's current version"""
+    return bump_version(user_version_key(namespace, user_id))
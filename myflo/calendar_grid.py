@@ -0,0 +1,215 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from calendar import monthrange
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.template.loader import render_to_string
+
+from .async_queries import gather_queries
+from .cache import aget_user_version, get_user_version, bump_user_version
+from .models import Period, DailyLog, Prediction
+
+
+# An ongoing period (no end_date) is drawn from its start up to today, but
+# never for longer than the longest period length a profile allows.
+OPEN_PERIOD_MAX_DAYS = 10
+
+SPAN_KINDS = ('week', 'month', 'quarter', 'year')
+
+CALENDAR_CACHE_NAMESPACE = 'calendar'
+CALENDAR_FRAGMENT_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def week_span(anchor):
+    """Sunday-to-Saturday week containing anchor"""
+    first_day = anchor - timedelta(days=(anchor.weekday() + 1) % 7)
+    return first_day, first_day + timedelta(days=6)
+
+
+def month_span(year, month):
+    """First and last day of a calendar month"""
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+def quarter_span(anchor):
+    """First and last day of the quarter containing anchor"""
+    first_month = 3 * ((anchor.month - 1) // 3) + 1
+    first_day, _ = month_span(anchor.year, first_month)
+    _, last_day = month_span(anchor.year, first_month + 2)
+    return first_day, last_day
+
+
+def year_span(anchor):
+    """First and last day of the year containing anchor"""
+    return date(anchor.year, 1, 1), date(anchor.year, 12, 31)
+
+
+def span_for(kind, anchor):
+    """Resolve a span kind ('week', 'month', 'quarter', 'year') around anchor"""
+    if kind == 'week':
+        return week_span(anchor)
+    if kind == 'month':
+        return month_span(anchor.year, anchor.month)
+    if kind == 'quarter':
+        return quarter_span(anchor)
+    if kind == 'year':
+        return year_span(anchor)
+    raise ValueError(f'Unknown calendar span: {kind!r}')
+
+
+def period_last_day(period, today=None):
+    """Last day a period covers, inferring one for ongoing periods"""
+    if period.end_date:
+        return period.end_date
+    today = today or date.today()
+    cap = period.start_date + timedelta(days=OPEN_PERIOD_MAX_DAYS - 1)
+    return max(period.start_date, min(today, cap))
+
+
+def bucket_periods(periods, first_day, last_day, today=None):
+    """Map each date in [first_day, last_day] to the periods covering it"""
+    buckets = defaultdict(list)
+    for period in periods:
+        current = max(period.start_date, first_day)
+        end = min(period_last_day(period, today), last_day)
+        while current <= end:
+            buckets[current].append(period)
+            current += timedelta(days=1)
+    return buckets
+
+
+def calendar_queries(user, first_day, last_day):
+    """The user's periods, daily logs and predictions in [first_day, last_day]"""
+    return {
+        'periods': Period.objects.filter(
+            Q(end_date__gte=first_day) |
+            Q(end_date__isnull=True,
+              start_date__gte=first_day - timedelta(days=OPEN_PERIOD_MAX_DAYS - 1)),
+            user=user,
+            start_date__lte=last_day,
+        ),
+        'daily_logs': DailyLog.objects.filter(
+            user=user,
+            date__range=[first_day, last_day]
+        ),
+        'predictions': Prediction.objects.filter(
+            user=user,
+            is_active=True,
+            predicted_date__range=[first_day, last_day]
+        ),
+    }
+
+
+def calendar_days(periods, daily_logs, predictions, first_day, last_day, today):
+    periods_by_date = bucket_periods(periods, first_day, last_day, today)
+    logs_by_date = {log.date: log for log in daily_logs}
+    predictions_by_date = defaultdict(list)
+    for prediction in predictions:
+        predictions_by_date[prediction.predicted_date].append(prediction)
+
+    calendar_data = []
+    current_date = first_day
+    while current_date <= last_day:
+        calendar_data.append({
+            'date': current_date,
+            'is_today': current_date == today,
+            'periods': periods_by_date.get(current_date, []),
+            'daily_log': logs_by_date.get(current_date),
+            'predictions': predictions_by_date.get(current_date, []),
+        })
+        current_date += timedelta(days=1)
+    return calendar_data
+
+
+def build_calendar_grid(user, first_day, last_day, today=None):
+    """
+    Build one entry per day in [first_day, last_day] for a user's calendar.
+
+    Periods, daily logs and predictions are each fetched once for the span
+    and bucketed by date, so the cost depends on the span and the rows in
+    it rather than on the user's whole history.
+    """
+    today = today or date.today()
+    rows = calendar_queries(user, first_day, last_day)
+    return calendar_days(**rows, first_day=first_day, last_day=last_day, today=today)
+
+
+async def abuild_calendar_grid(user, first_day, last_day, today=None):
+    """build_calendar_grid for async code, with the three queries awaited together"""
+    today = today or date.today()
+    rows = await gather_queries(**calendar_queries(user, first_day, last_day))
+    return calendar_days(**rows, first_day=first_day, last_day=last_day, today=today)
+
+
+def months_between(first_day, last_day):
+    """(year, month) pairs touched by the range [first_day, last_day]"""
+    months = []
+    year, month = first_day.year, first_day.month
+    while (year, month) <= (last_day.year, last_day.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def calendar_fragment_key(user_id, year, month, today=None, version=None):
+    """
+    Cache key for a user's rendered month grid.
+
+    The key carries the user's calendar data version, so bumping it drops
+    every cached month at once. Months that are not yet over also carry
+    today's date, because "today" and ongoing periods move daily.
+    """
+    today = today or date.today()
+    if version is None:
+        version = get_user_version(CALENDAR_CACHE_NAMESPACE, user_id)
+    key = f'myflo:calendar:{user_id}:{year}-{month:02d}:{version}'
+    if month_span(year, month)[1] >= today:
+        key += f':{today.isoformat()}'
+    return key
+
+
+def render_month_fragment(user, year, month, today=None):
+    """Rendered month grid for a user, served from cache when possible"""
+    today = today or date.today()
+    key = calendar_fragment_key(user.pk, year, month, today)
+    html = cache.get(key)
+    if html is None:
+        first_day, last_day = month_span(year, month)
+        html = render_to_string('calendar_grid.html', {
+            'calendar_data': build_calendar_grid(user, first_day, last_day, today),
+            'current_month': first_day,
+        })
+        cache.set(key, html, CALENDAR_FRAGMENT_TIMEOUT)
+    return html
+
+
+async def arender_month_fragment(user, year, month, today=None):
+    """render_month_fragment for async views"""
+    today = today or date.today()
+    version = await aget_user_version(CALENDAR_CACHE_NAMESPACE, user.pk)
+    key = calendar_fragment_key(user.pk, year, month, today, version)
+    html = await cache.aget(key)
+    if html is None:
+        first_day, last_day = month_span(year, month)
+        # The rows are all loaded, so rendering never touches the database
+        html = render_to_string('calendar_grid.html', {
+            'calendar_data': await abuild_calendar_grid(user, first_day, last_day, today),
+            'current_month': first_day,
+        })
+        await cache.aset(key, html, CALENDAR_FRAGMENT_TIMEOUT)
+    return html
+
+
+def invalidate_calendar_months(user_id, first_day, last_day, today=None):
+    """Drop the cached fragments of the months overlapping a date range"""
+    today = today or date.today()
+    cache.delete_many([
+        calendar_fragment_key(user_id, year, month, today)
+        for year, month in months_between(first_day, last_day)
+    ])
+
+
+def invalidate_calendar(user_id):
+    """Drop every cached month for a user, e.g. after a bulk update"""
+    bump_user_version(CALENDAR_CACHE_NAMESPACE, user_id)
@@ -0,0 +1,93 @@
+import threading
+
+from .cache import get_version, bump_version
+from .models import Symptom, ContraceptiveType
+
+
+class ReferenceCatalog:
+    """
+    Process-local copy of a small, admin-managed reference table.
+
+    Rows are loaded once, ordered and grouped by category, and served from
+    memory until the catalog's version changes. The version lives in the
+    Django cache: with a shared cache an admin save in one process
+    invalidates every other process's copy on its next access; with the
+    per-process default, other processes reload within
+    MYFLO_CACHE_VERSION_TIMEOUT seconds (see myflo.cache.get_version).
+    """
+
+    def __init__(self, model, ordering=('category', 'name')):
+        self.model = model
+        self.ordering = ordering
+        self.version_key = f'myflo:catalog:{model._meta.label_lower}:version'
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._version = None
+        self._rows = None
+
+    def _data(self):
+        version = get_version(self.version_key)
+        data = self._rows
+        if data is not None and self._version == version:
+            self.hits += 1
+            return data
+        with self._lock:
+            if self._rows is None or self._version != version:
+                self.misses += 1
+                rows = list(self.model.objects.order_by(*self.ordering))
+                groups = {}
+                for row in rows:
+                    groups.setdefault(row.category, []).append(row)
+                self._rows = {
+                    'rows': rows,
+                    'by_id': {row.pk: row for row in rows},
+                    'groups': list(groups.items()),
+                }
+                self._version = version
+            else:
+                self.hits += 1
+            return self._rows
+
+    def all(self):
+        """Every row, in catalog order"""
+        return self._data()['rows']
+
+    def get(self, pk):
+        """Row by primary key, or None"""
+        return self._data()['by_id'].get(pk)
+
+    def by_id(self):
+        """{pk: row} for every row"""
+        return self._data()['by_id']
+
+    def grouped(self):
+        """[(category, [rows])] in catalog order"""
+        return self._data()['groups']
+
+    def invalidate(self):
+        """Drop this process's copy, and with a shared cache every other process's"""
+        bump_version(self.version_key)
+        with self._lock:
+            self._rows = None
+            self._version = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'version': self._version,
+            'size': len(self._rows['rows']) if self._rows else 0,
+        }
+
+
+symptoms = ReferenceCatalog(Symptom)
+contraceptive_types = ReferenceCatalog(ContraceptiveType)
+
+
+def catalog_stats():
+    """Hit/miss counters of every reference catalog in this process"""
+    return {
+        'symptoms': symptoms.stats(),
+        'contraceptive_types': contraceptive_types.stats(),
+    }
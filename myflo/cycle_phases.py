@@ -0,0 +1,292 @@
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Count, DateField, F, Func, IntegerField, Sum
+
+from . import catalogs
+from .cache import aget_user_version, get_user_version, bump_user_version
+from .cycle_stats import DaysBetween
+from .models import CycleProfile, Period, DailyLog, DailySymptom
+from .predictions import DEFAULT_CYCLE_LENGTH, OVULATION_LEAD_DAYS
+
+
+CYCLE_PHASES_CACHE_NAMESPACE = 'cycle_phases'
+CYCLE_PHASES_TIMEOUT = 60 * 60 * 24 * 7
+
+PHASES = [
+    ('menstrual', 'Menstrual'),
+    ('follicular', 'Follicular'),
+    ('ovulatory', 'Ovulatory'),
+    ('luteal', 'Luteal'),
+    # Too long after the last period start to place in a cycle
+    ('unknown', 'Unknown'),
+]
+MENSTRUAL, FOLLICULAR, OVULATORY, LUTEAL, UNKNOWN = range(len(PHASES))
+
+# Days on either side of the expected ovulation day counted as ovulatory
+OVULATORY_MARGIN_DAYS = 1
+
+# The longest cycle a profile allows. A later day most likely follows a
+# period that was never logged, so its phase and cycle day are unknown
+MAX_CYCLE_DAY = 45
+
+DEFAULT_PERIOD_LENGTH = 5
+SEVERITIES = 5
+
+
+def cycle_position(np, log_days, starts, ends, cycle_lengths):
+    """
+    Cycle day (1-based) and phase index of each day number in log_days,
+    anchored on the most recent period start at or before it.
+
+    starts, ends and cycle_lengths describe the user's periods sorted by
+    start. Days before the first period get cycle day 0 and phase -1;
+    days more than MAX_CYCLE_DAY days after the last start get UNKNOWN.
+    """
+    anchor = np.searchsorted(starts, log_days, side='right') - 1
+    known = anchor >= 0
+    anchor = np.where(known, anchor, 0)
+
+    cycle_day = log_days - starts[anchor] + 1
+    ovulation_day = cycle_lengths[anchor] - OVULATION_LEAD_DAYS
+    phase = np.where(cycle_day < ovulation_day - OVULATORY_MARGIN_DAYS, FOLLICULAR, LUTEAL)
+    phase = np.where(
+        np.abs(cycle_day - ovulation_day) <= OVULATORY_MARGIN_DAYS, OVULATORY, phase
+    )
+    phase = np.where(log_days <= ends[anchor], MENSTRUAL, phase)
+    phase = np.where(cycle_day > MAX_CYCLE_DAY, UNKNOWN, phase)
+    return np.where(known, cycle_day, 0), np.where(known, phase, -1)
+
+
+def period_arrays(np, user):
+    """Sorted start and end day numbers and cycle lengths of a user's periods"""
+    rows = list(Period.objects.filter(user=user).order_by('start_date').values_list(
+        'start_date', 'end_date'
+    ))
+    profile = CycleProfile.objects.filter(user=user).values_list(
+        'average_cycle_length', 'average_period_length'
+    ).first() or (DEFAULT_CYCLE_LENGTH, DEFAULT_PERIOD_LENGTH)
+
+    starts = np.array([start.toordinal() for start, _ in rows], dtype=np.int64)
+    ends = np.array([
+        end.toordinal() if end else start.toordinal() + profile[1] - 1
+        for start, end in rows
+    ], dtype=np.int64)
+    # The ongoing cycle is assumed to run for the profile's average length
+    cycle_lengths = np.append(np.diff(starts), profile[0])[:len(starts)]
+    return starts, ends, cycle_lengths
+
+
+class DateRuns(Func):
+    """
+    Value of the last run starting on or before a date expression, runs
+    being (first date, value) pairs sorted by date; dates before the
+    first run get its value too. The runs are bisected with nested CASEs,
+    so a row takes a few comparisons however many runs there are.
+    """
+
+    def __init__(self, expression, runs, output_field):
+        super().__init__(expression, output_field=output_field)
+        self.runs = runs
+
+    def as_sql(self, compiler, connection, **extra_context):
+        date_sql, date_params = compiler.compile(self.source_expressions[0])
+        first_dates = [connection.ops.adapt_datefield_value(day) for day, _ in self.runs]
+        values = [self.output_field.get_db_prep_value(value, connection) for _, value in self.runs]
+        sql, params = [], []
+
+        def bisect(low, high):
+            if high - low == 1:
+                sql.append('%s')
+                params.append(values[low])
+                return
+            middle = (low + high) // 2
+            sql.append(f'CASE WHEN {date_sql} >= %s THEN ')
+            params.extend([*date_params, first_dates[middle]])
+            bisect(middle, high)
+            sql.append(' ELSE ')
+            bisect(low, middle)
+            sql.append(' END')
+
+        bisect(0, len(self.runs))
+        return ''.join(sql), params
+
+
+def phase_runs(np, starts, ends, cycle_lengths):
+    """
+    (first date, phase index) of each run of days in one phase, from the
+    first period start on, as placed by cycle_position; a handful per cycle
+    """
+    # Through the first day past the longest cycle after the last start
+    days = np.arange(starts[0], starts[-1] + MAX_CYCLE_DAY + 1)
+    _, day_phase = cycle_position(np, days, starts, ends, cycle_lengths)
+    run_starts = np.flatnonzero(np.diff(day_phase, prepend=-1))
+    return [
+        (date.fromordinal(day), phase)
+        for day, phase in zip(days[run_starts].tolist(), day_phase[run_starts].tolist())
+    ]
+
+
+def mean_by(np, buckets, sums, counts, size):
+    """Mean per bucket of grouped sums and counts, None where a bucket has no values"""
+    counts = np.bincount(buckets, weights=counts, minlength=size)
+    sums = np.bincount(buckets, weights=sums, minlength=size)
+    return [
+        round(float(total) / count, 1) if count else None
+        for total, count in zip(sums, counts)
+    ]
+
+
+def compute_cycle_phases(user):
+    """
+    Mood counts, mean energy and pain, and symptom severity histograms for
+    a user, bucketed by cycle phase and by cycle day.
+
+    The database places each log in its cycle and groups the logs by
+    phase, cycle day and mood, and the symptoms by phase, symptom and
+    severity. NumPy only folds those groups, so the rows brought into
+    Python don't grow with the years of logs.
+    Returns None when NumPy is not installed.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+
+    starts, ends, cycle_lengths = period_arrays(np, user)
+    mood_codes = [code for code, _ in DailyLog.MOOD_CHOICES]
+    mood_labels = dict(DailyLog.MOOD_CHOICES)
+    mood_index = {code: index for index, code in enumerate(mood_codes)}
+    summary = {'logged_days': 0, 'phases': [], 'cycle_days': [], 'symptoms': []}
+    if not len(starts):
+        return summary
+
+    first_start = date.fromordinal(int(starts[0]))
+    runs = phase_runs(np, starts, ends, cycle_lengths)
+    cycle_starts = [(start, start) for start in map(date.fromordinal, starts.tolist())]
+    groups = (
+        DailyLog.objects.filter(user=user, date__gte=first_start)
+        .annotate(
+            phase=DateRuns(F('date'), runs, output_field=IntegerField()),
+            days_in=DaysBetween(
+                'date', DateRuns(F('date'), cycle_starts, output_field=DateField())
+            ),
+        )
+        .values_list('phase', 'days_in', 'mood')
+        .annotate(
+            logs=Count('pk'),
+            energy_sum=Sum('energy_level'), energy_count=Count('energy_level'),
+            pain_sum=Sum('pain_level'), pain_count=Count('pain_level'),
+        )
+    )
+    columns = np.array([
+        (phase_index, elapsed, mood_index.get(mood, -1), *(total or 0 for total in totals))
+        for phase_index, elapsed, mood, *totals in groups
+    ], dtype=np.int64).reshape(-1, 8)
+    phase, elapsed, moods, logs, energy_sum, energy_count, pain_sum, pain_count = columns.T
+    # Unknown days go to an extra, unreported bucket
+    day_bucket = np.minimum(elapsed, MAX_CYCLE_DAY)
+    has_mood = moods >= 0
+
+    mood_counts = np.bincount(
+        phase[has_mood] * len(mood_codes) + moods[has_mood], weights=logs[has_mood],
+        minlength=len(PHASES) * len(mood_codes)
+    ).astype(np.int64).reshape(len(PHASES), len(mood_codes))
+    phase_days = np.bincount(phase, weights=logs, minlength=len(PHASES)).astype(np.int64)
+    phase_energy = mean_by(np, phase, energy_sum, energy_count, len(PHASES))
+    phase_pain = mean_by(np, phase, pain_sum, pain_count, len(PHASES))
+    for index, (code, label) in enumerate(PHASES):
+        summary['phases'].append({
+            'phase': code,
+            'label': label,
+            'days': int(phase_days[index]),
+            # Most frequent first
+            'moods': [
+                {'mood': mood_codes[mood], 'label': mood_labels[mood_codes[mood]],
+                 'count': int(mood_counts[index][mood])}
+                for mood in np.argsort(-mood_counts[index], kind='stable')
+                if mood_counts[index][mood]
+            ],
+            'avg_energy': phase_energy[index],
+            'avg_pain': phase_pain[index],
+        })
+
+    day_buckets = MAX_CYCLE_DAY + 1
+    day_counts = np.bincount(day_bucket, weights=logs, minlength=day_buckets).astype(np.int64)
+    day_moods = np.bincount(
+        day_bucket[has_mood] * len(mood_codes) + moods[has_mood], weights=logs[has_mood],
+        minlength=day_buckets * len(mood_codes)
+    ).reshape(day_buckets, len(mood_codes))
+    day_energy = mean_by(np, day_bucket, energy_sum, energy_count, day_buckets)
+    day_pain = mean_by(np, day_bucket, pain_sum, pain_count, day_buckets)
+    for index in np.flatnonzero(day_counts[:MAX_CYCLE_DAY]):
+        summary['cycle_days'].append({
+            'day': int(index) + 1,
+            'logs': int(day_counts[index]),
+            'top_mood': mood_codes[day_moods[index].argmax()] if day_moods[index].any() else None,
+            'avg_energy': day_energy[index],
+            'avg_pain': day_pain[index],
+        })
+    summary['logged_days'] = int(day_counts.sum())
+
+    symptom_groups = list(
+        DailySymptom.objects.filter(daily_log__user=user, daily_log__date__gte=first_start)
+        .annotate(phase=DateRuns(F('daily_log__date'), runs, output_field=IntegerField()))
+        .values_list('symptom_id', 'phase', 'severity')
+        .annotate(count=Count('pk'))
+    )
+    if symptom_groups:
+        symptom_id_of, phase, severity, counts = np.array(symptom_groups, dtype=np.int64).T
+        symptom_ids, symptom_index = np.unique(symptom_id_of, return_inverse=True)
+        histograms = np.bincount(
+            (symptom_index * len(PHASES) + phase) * SEVERITIES + severity - 1,
+            weights=counts, minlength=len(symptom_ids) * len(PHASES) * SEVERITIES
+        ).astype(np.int64).reshape(len(symptom_ids), len(PHASES), SEVERITIES)
+        symptoms = catalogs.symptoms.by_id()
+        for index in np.argsort(-histograms.sum(axis=(1, 2)), kind='stable'):
+            symptom_id = int(symptom_ids[index])
+            summary['symptoms'].append({
+                'id': symptom_id,
+                'name': symptoms[symptom_id].name if symptom_id in symptoms else '',
+                'total': int(histograms[index].sum()),
+                # One [mild .. severe] count list per phase, in PHASES order
+                'severity_by_phase': histograms[index].tolist(),
+            })
+    return summary
+
+
+def cycle_phases_key(user_id, version=None):
+    if version is None:
+        version = get_user_version(CYCLE_PHASES_CACHE_NAMESPACE, user_id)
+    return f'myflo:cycle_phases:{user_id}:{version}'
+
+
+def get_cycle_phases(user):
+    """Cycle phase summary for a user, cached until their logs or periods change"""
+    key = cycle_phases_key(user.pk)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_cycle_phases(user)
+        if summary is None:
+            return None
+        cache.set(key, summary, CYCLE_PHASES_TIMEOUT)
+    return summary
+
+
+async def aget_cycle_phases(user):
+    """get_cycle_phases for async views"""
+    version = await aget_user_version(CYCLE_PHASES_CACHE_NAMESPACE, user.pk)
+    key = cycle_phases_key(user.pk, version)
+    summary = await cache.aget(key)
+    if summary is None:
+        # Grouping the whole history in the database: keep it off the event loop
+        summary = await sync_to_async(compute_cycle_phases)(user)
+        if summary is None:
+            return None
+        await cache.aset(key, summary, CYCLE_PHASES_TIMEOUT)
+    return summary
+
+
+def invalidate_cycle_phases(user_id):
+    bump_user_version(CYCLE_PHASES_CACHE_NAMESPACE, user_id)
@@ -0,0 +1,169 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import F, Func, Avg, Count, Max, Min, Sum, FloatField, IntegerField, Window
+from django.db.models.functions import Lead, RowNumber
+
+from .cache import aget_user_version, get_user_version, bump_user_version
+from .models import Period
+
+
+CYCLE_STATS_CACHE_NAMESPACE = 'cycle_stats'
+CYCLE_STATS_TIMEOUT = 60 * 60 * 24 * 7
+
+RECENT_PERIODS = 6
+
+# Cycles lengthening or shortening by less than this many days per cycle
+# are reported as stable.
+TREND_THRESHOLD_DAYS = 0.1
+
+
+class DaysBetween(Func):
+    """Whole days from the second date expression to the first"""
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection, template='DATEDIFF(%(expressions)s)', arg_joiner=', ',
+            **extra_context
+        )
+
+
+def periods_with_cycle_lengths(user):
+    """
+    A user's periods annotated with the length of the cycle each one closes
+    (days since the previous start, NULL for the first) and their position
+    counted from the most recent one.
+
+    The window runs newest first, matching Period's default ordering, so the
+    (user, start_date) index serves both the window and a later LIMIT.
+    """
+    newest_first = F('start_date').desc()
+    return Period.objects.filter(user=user).annotate(
+        cycle_length=DaysBetween('start_date', Window(Lead('start_date'), order_by=newest_first)),
+        recency=Window(RowNumber(), order_by=newest_first),
+    )
+
+
+def trend_slope(count, sum_y, sum_iy):
+    """
+    Least-squares slope of cycle length against cycle number 1..count, in
+    days per cycle. The sums over the cycle numbers have closed forms, so
+    only sum(y) and sum(i * y) need to come from the database.
+    """
+    if count < 2:
+        return None
+    sum_i = count * (count + 1) / 2
+    sum_ii = count * (count + 1) * (2 * count + 1) / 6
+    return (count * sum_iy - sum_i * sum_y) / (count * sum_ii - sum_i ** 2)
+
+
+def trend_label(slope):
+    if slope is None:
+        return None
+    if slope >= TREND_THRESHOLD_DAYS:
+        return 'lengthening'
+    if slope <= -TREND_THRESHOLD_DAYS:
+        return 'shortening'
+    return 'stable'
+
+
+def compute_cycle_stats(user):
+    """
+    Cycle and period statistics over a user's whole history.
+
+    Cycle lengths come from a LEAD() window over start_date and are
+    aggregated in the same query, so no Period rows are loaded except the
+    few recent ones shown in the table.
+    """
+    periods = periods_with_cycle_lengths(user)
+    totals = periods.aggregate(
+        period_count=Count('pk'),
+        cycle_count=Count('cycle_length'),
+        avg_cycle_length=Avg('cycle_length'),
+        min_cycle_length=Min('cycle_length'),
+        max_cycle_length=Max('cycle_length'),
+        mean_square=Avg(F('cycle_length') * F('cycle_length'), output_field=FloatField()),
+        sum_cycle_length=Sum('cycle_length'),
+        sum_recency_weighted=Sum(F('recency') * F('cycle_length')),
+    )
+    durations = Period.objects.filter(user=user, end_date__isnull=False).aggregate(
+        avg_duration=Avg(DaysBetween('end_date', 'start_date') + 1, output_field=FloatField()),
+        min_duration=Min(DaysBetween('end_date', 'start_date') + 1),
+        max_duration=Max(DaysBetween('end_date', 'start_date') + 1),
+    )
+
+    count = totals['cycle_count']
+    mean = totals['avg_cycle_length']
+    variability = None
+    if count:
+        variability = max(totals['mean_square'] - mean ** 2, 0) ** 0.5
+    slope = None
+    if count:
+        # Numbering cycles oldest first, the cycle closed by the period at
+        # recency r is number period_count - r (the oldest period closes none).
+        sum_y = totals['sum_cycle_length']
+        sum_iy = totals['period_count'] * sum_y - totals['sum_recency_weighted']
+        slope = trend_slope(count, sum_y, sum_iy)
+
+    recent_periods = list(periods[:RECENT_PERIODS])
+    return {
+        'period_count': totals['period_count'],
+        'cycle_count': count,
+        'avg_cycle_length': round(mean, 1) if mean is not None else None,
+        'min_cycle_length': totals['min_cycle_length'],
+        'max_cycle_length': totals['max_cycle_length'],
+        'cycle_variability': round(variability, 1) if variability is not None else None,
+        'cycle_trend': round(slope, 2) if slope is not None else None,
+        'cycle_trend_label': trend_label(slope),
+        'avg_period_duration': (
+            round(durations['avg_duration'], 1) if durations['avg_duration'] is not None else None
+        ),
+        'min_period_duration': durations['min_duration'],
+        'max_period_duration': durations['max_duration'],
+        'recent_periods': recent_periods,
+        'recent_cycle_lengths': [
+            period.cycle_length for period in recent_periods if period.cycle_length is not None
+        ],
+    }
+
+
+def cycle_stats_key(user_id, version=None):
+    if version is None:
+        version = get_user_version(CYCLE_STATS_CACHE_NAMESPACE, user_id)
+    return f'myflo:cycle_stats:{user_id}:{version}'
+
+
+def get_cycle_stats(user):
+    """Cycle statistics for a user, cached until one of their periods changes"""
+    key = cycle_stats_key(user.pk)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_cycle_stats(user)
+        cache.set(key, stats, CYCLE_STATS_TIMEOUT)
+    return stats
+
+
+async def aget_cycle_stats(user):
+    """get_cycle_stats for async views"""
+    version = await aget_user_version(CYCLE_STATS_CACHE_NAMESPACE, user.pk)
+    key = cycle_stats_key(user.pk, version)
+    stats = await cache.aget(key)
+    if stats is None:
+        # Several queries and Python arithmetic: run the lot off the event loop
+        stats = await sync_to_async(compute_cycle_stats)(user)
+        await cache.aset(key, stats, CYCLE_STATS_TIMEOUT)
+    return stats
+
+
+def invalidate_cycle_stats(user_id):
+    bump_user_version(CYCLE_STATS_CACHE_NAMESPACE, user_id)
@@ -0,0 +1,113 @@
+from datetime import date
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .async_queries import gather_queries
+from .cache import aget_user_version, get_user_version, bump_user_version
+from .models import Period, DailyLog, Prediction, Notification, CycleInsight
+
+
+DASHBOARD_CACHE_NAMESPACE = 'dashboard'
+DASHBOARD_BUNDLE_TIMEOUT = 60 * 60
+
+FIRST_ROW_KEYS = {'recent_period', 'today_log', 'expires_at'}
+
+
+def dashboard_bundle_key(user_id, today, version=None):
+    if version is None:
+        version = get_user_version(DASHBOARD_CACHE_NAMESPACE, user_id)
+    return f'myflo:dashboard:{user_id}:{today.isoformat()}:{version}'
+
+
+def dashboard_queries(user, today, now):
+    """
+    The independent queries behind the dashboard bundle, by bundle key.
+    Those in FIRST_ROW_KEYS are read as their first row, the rest as lists.
+    """
+    return {
+        'recent_period': Period.objects.filter(user=user),
+        # No row is created until the user actually logs something
+        'today_log': DailyLog.objects.filter(user=user, date=today),
+        'predictions': Prediction.objects.filter(
+            user=user,
+            is_active=True,
+            predicted_date__gte=today
+        ).order_by('predicted_date'),
+        'insights': CycleInsight.objects.filter(
+            user=user,
+            is_dismissed=False
+        )[:3],
+        'notifications': Notification.objects.filter(
+            user=user,
+            is_read=False,
+            scheduled_date__lte=now
+        )[:5],
+        # The bundle goes stale when the next unread notification falls due
+        'expires_at': Notification.objects.filter(
+            user=user,
+            is_read=False,
+            scheduled_date__gt=now
+        ).order_by('scheduled_date').values_list('scheduled_date', flat=True),
+    }
+
+
+def build_dashboard_bundle(user, today, now):
+    """Everything dashboard.html shows, read without writing anything"""
+    return {
+        name: query.first() if name in FIRST_ROW_KEYS else list(query)
+        for name, query in dashboard_queries(user, today, now).items()
+    }
+
+
+async def abuild_dashboard_bundle(user, today, now):
+    """build_dashboard_bundle for async code, with the queries awaited together"""
+    return await gather_queries(**{
+        name: query.afirst() if name in FIRST_ROW_KEYS else query
+        for name, query in dashboard_queries(user, today, now).items()
+    })
+
+
+def bundle_is_fresh(bundle, now):
+    return bundle is not None and not (bundle['expires_at'] and bundle['expires_at'] <= now)
+
+
+def bundle_timeout(bundle, now):
+    if not bundle['expires_at']:
+        return DASHBOARD_BUNDLE_TIMEOUT
+    seconds_left = (bundle['expires_at'] - now).total_seconds()
+    return max(1, min(DASHBOARD_BUNDLE_TIMEOUT, int(seconds_left) + 1))
+
+
+def get_dashboard_bundle(user, today=None, now=None):
+    """
+    Per-user dashboard data, cached until one of the models it reads
+    changes (see invalidate_dashboard), the day rolls over or the next
+    unread notification becomes due.
+    """
+    today = today or date.today()
+    now = now or timezone.now()
+    key = dashboard_bundle_key(user.pk, today)
+    bundle = cache.get(key)
+    if not bundle_is_fresh(bundle, now):
+        bundle = build_dashboard_bundle(user, today, now)
+        cache.set(key, bundle, bundle_timeout(bundle, now))
+    return bundle
+
+
+async def aget_dashboard_bundle(user, today=None, now=None):
+    """get_dashboard_bundle for async views"""
+    today = today or date.today()
+    now = now or timezone.now()
+    version = await aget_user_version(DASHBOARD_CACHE_NAMESPACE, user.pk)
+    key = dashboard_bundle_key(user.pk, today, version)
+    bundle = await cache.aget(key)
+    if not bundle_is_fresh(bundle, now):
+        bundle = await abuild_dashboard_bundle(user, today, now)
+        await cache.aset(key, bundle, bundle_timeout(bundle, now))
+    return bundle
+
+
+def invalidate_dashboard(user_id):
+    """Drop a user's cached dashboard bundle"""
+    bump_user_version(DASHBOARD_CACHE_NAMESPACE, user_id)
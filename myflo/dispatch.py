@@ -0,0 +1,232 @@
+import asyncio
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Notification
+
+
+DEFAULT_BACKEND = 'myflo.dispatch.EmailBackend'
+
+# Failed deliveries are retried with exponential backoff until this many
+# attempts have been made; after that the notification is left unsent.
+MAX_DELIVERY_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 60 * 60
+
+CLAIM_RETRIES = 5
+
+
+class PermanentDeliveryError(Exception):
+    """A delivery failure that retrying cannot fix, e.g. no address"""
+
+
+class NotificationBackend:
+    """
+    Delivers notifications for the dispatch worker.
+
+    send() is a coroutine and runs concurrently with other sends, so it
+    must not touch the database; the notification arrives with its user
+    already loaded.
+    """
+
+    async def send(self, notification):
+        raise NotImplementedError
+
+
+class EmailBackend(NotificationBackend):
+    """Email through Django's EMAIL_BACKEND (SMTP, file, console, locmem)"""
+
+    async def send(self, notification):
+        if not notification.user.email:
+            raise PermanentDeliveryError('User has no email address')
+        await asyncio.to_thread(
+            send_mail, notification.title, notification.message, None,
+            [notification.user.email]
+        )
+
+
+class FileBackend(NotificationBackend):
+    """Append each notification as a JSON line to MYFLO_NOTIFICATION_FILE"""
+
+    def __init__(self, path=None):
+        self.path = path or settings.MYFLO_NOTIFICATION_FILE
+
+    async def send(self, notification):
+        line = json.dumps({
+            'id': notification.pk,
+            'user': notification.user.username,
+            'type': notification.notification_type,
+            'title': notification.title,
+            'message': notification.message,
+            'scheduled_date': notification.scheduled_date.isoformat(),
+        })
+        # Writes happen on the event loop thread, so lines never interleave
+        with open(self.path, 'a') as out:
+            out.write(line + '\n')
+
+
+def get_backend(path=None):
+    return import_string(
+        path or getattr(settings, 'MYFLO_NOTIFICATION_BACKEND', DEFAULT_BACKEND)
+    )()
+
+
+def retry_delay(attempts):
+    """Seconds to wait before delivery attempt number attempts + 1"""
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+
+def claimable_notifications(now):
+    """
+    Due, unsent notifications that no live lease or retry delay holds.
+    Users who turned notifications off are left out; their notifications
+    still show in the app. Users without a profile get the default, on.
+    """
+    return Notification.objects.filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lte=now),
+        is_sent=False,
+        scheduled_date__lte=now,
+        delivery_attempts__lt=MAX_DELIVERY_ATTEMPTS,
+    ).exclude(user__userprofile__notifications_enabled=False)
+
+
+def claim_batch(worker, batch_size, lease_seconds, now=None):
+    """
+    Lease up to batch_size due notifications to worker.
+
+    Candidates are picked with a plain SELECT and then claimed with an
+    UPDATE that repeats the "not leased" condition, so when several
+    workers race for the same rows each row goes to exactly one of them.
+    Returns (claim token, notifications with their users loaded).
+    """
+    now = now or timezone.now()
+    token = f'{worker[:31]}:{uuid.uuid4().hex}'
+    # Losing every candidate to other workers doesn't mean nothing is due
+    for _ in range(CLAIM_RETRIES):
+        candidates = list(
+            claimable_notifications(now).order_by('scheduled_date').values_list(
+                'id', flat=True
+            )[:batch_size]
+        )
+        if not candidates:
+            break
+        claimed = claimable_notifications(now).filter(id__in=candidates).update(
+            claimed_by=token,
+            claimed_until=now + timedelta(seconds=lease_seconds),
+        )
+        if claimed:
+            return token, list(
+                Notification.objects.filter(claimed_by=token).select_related('user')
+            )
+    return token, []
+
+
+async def deliver_batch(backend, notifications, concurrency, timeout):
+    """
+    Send notifications through backend with at most concurrency sends in
+    flight. Returns [(notification, exception or None)] in input order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(notification):
+        async with semaphore:
+            try:
+                await asyncio.wait_for(backend.send(notification), timeout)
+            except Exception as exc:
+                return notification, exc
+            return notification, None
+
+    return await asyncio.gather(*(deliver(notification) for notification in notifications))
+
+
+def record_results(token, results, now=None):
+    """
+    Mark delivered notifications sent and schedule retries for the rest.
+    Rows whose lease was lost to another worker are left alone.
+    Returns (sent, retried, given_up) counts.
+    """
+    now = now or timezone.now()
+    sent_ids = [notification.pk for notification, error in results if error is None]
+    sent = Notification.objects.filter(pk__in=sent_ids, claimed_by=token).update(
+        is_sent=True, sent_at=now, updated_at=now, claimed_by='', claimed_until=None,
+        last_error=''
+    ) if sent_ids else 0
+
+    retried = given_up = 0
+    for notification, error in results:
+        if error is None:
+            continue
+        attempts = notification.delivery_attempts + 1
+        if isinstance(error, PermanentDeliveryError):
+            attempts = MAX_DELIVERY_ATTEMPTS
+        updated = Notification.objects.filter(pk=notification.pk, claimed_by=token).update(
+            delivery_attempts=attempts,
+            last_error=str(error) or type(error).__name__,
+            claimed_by='',
+            claimed_until=now + timedelta(seconds=retry_delay(attempts)),
+        )
+        if updated and attempts >= MAX_DELIVERY_ATTEMPTS:
+            given_up += 1
+        elif updated:
+            retried += 1
+    return sent, retried, given_up
+
+
+def dispatch_backlog(now=None):
+    """Due notifications still waiting to be sent and the oldest one's lag"""
+    now = now or timezone.now()
+    backlog = claimable_notifications(now).aggregate(
+        due=Count('id'), oldest=Min('scheduled_date')
+    )
+    return {
+        'due': backlog['due'],
+        'lag_seconds': (now - backlog['oldest']).total_seconds() if backlog['oldest'] else 0.0,
+    }
+
+
+class DispatchMetrics:
+    """Running counters for one dispatch worker"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.batches = 0
+        self.claimed = 0
+        self.sent = 0
+        self.retried = 0
+        self.given_up = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def record_batch(self, results, sent, retried, given_up, now):
+        self.batches += 1
+        self.claimed += len(results)
+        self.sent += sent
+        self.retried += retried
+        self.given_up += given_up
+        for notification, error in results:
+            if error is None:
+                lag = max((now - notification.scheduled_date).total_seconds(), 0.0)
+                self.lag_total += lag
+                self.lag_max = max(self.lag_max, lag)
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'elapsed_seconds': round(elapsed, 1),
+            'batches': self.batches,
+            'claimed': self.claimed,
+            'sent': self.sent,
+            'retried': self.retried,
+            'given_up': self.given_up,
+            'sent_per_second': round(self.sent / elapsed, 2) if elapsed else 0.0,
+            'mean_lag_seconds': round(self.lag_total / self.sent, 1) if self.sent else 0.0,
+            'max_lag_seconds': round(self.lag_max, 1),
+        }
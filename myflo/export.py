@@ -0,0 +1,184 @@
+import csv
+import io
+import zipfile
+from collections import defaultdict
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from . import catalogs
+from .models import (
+    Period, DailyLog, DailySymptom, ContraceptiveUse, Appointment, Prediction,
+    CycleInsight, Settings
+)
+
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_CHUNK_SIZE = 2000
+
+# (section, model, ordering, fields). Each ordering follows an index that
+# starts with user, so rows stream in index order without a sort.
+EXPORT_SECTIONS = [
+    ('periods', Period, 'start_date', [
+        'start_date', 'end_date', 'flow_intensity', 'cycle_day', 'notes',
+        'created_at', 'updated_at',
+    ]),
+    ('daily_logs', DailyLog, 'date', [
+        'id', 'date', 'flow', 'mood', 'energy_level', 'pain_level', 'sleep_hours',
+        'exercise_minutes', 'water_intake_glasses', 'notes', 'created_at', 'updated_at',
+    ]),
+    ('contraceptive_uses', ContraceptiveUse, 'date_taken', [
+        'contraceptive_type_id', 'date_taken', 'dosage', 'reason', 'notes', 'created_at',
+    ]),
+    ('appointments', Appointment, 'appointment_date', [
+        'health_provider__name', 'appointment_date', 'appointment_type', 'notes',
+        'is_completed', 'created_at',
+    ]),
+    ('predictions', Prediction, 'id', [
+        'prediction_type', 'predicted_date', 'confidence_level', 'is_active', 'created_at',
+    ]),
+    ('insights', CycleInsight, 'id', [
+        'insight_type', 'title', 'description', 'data_period_start', 'data_period_end',
+        'is_dismissed', 'created_at',
+    ]),
+]
+
+# Column names as they appear in the export
+RENAMED_FIELDS = {
+    'contraceptive_type_id': 'contraceptive_type',
+    'health_provider__name': 'health_provider',
+}
+
+
+def export_allowed(user):
+    """Whether the user's Settings permit exporting their data"""
+    allowed = Settings.objects.filter(user=user).values_list(
+        'allow_data_export', flat=True
+    ).first()
+    return allowed is not False
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def with_symptoms(logs):
+    """
+    Attach a 'symptoms' list to each DailyLog row dict, fetching the
+    symptoms of a whole chunk of logs in one query.
+    """
+    symptoms = catalogs.symptoms.by_id()
+    by_log = defaultdict(list)
+    for daily_log_id, symptom_id, severity in DailySymptom.objects.filter(
+        daily_log_id__in=[log['id'] for log in logs]
+    ).values_list('daily_log_id', 'symptom_id', 'severity'):
+        symptom = symptoms.get(symptom_id)
+        by_log[daily_log_id].append({
+            'symptom': symptom.name if symptom else str(symptom_id),
+            'severity': severity,
+        })
+    for log in logs:
+        log['symptoms'] = by_log.get(log.pop('id'), [])
+    return logs
+
+
+def export_rows(user, section, model, ordering, fields):
+    """Stream one section's rows as dicts, EXPORT_CHUNK_SIZE at a time"""
+    contraceptive_types = catalogs.contraceptive_types.by_id()
+    rows = model.objects.filter(user=user).order_by(ordering).values(*fields).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+    for chunk in chunks(rows, EXPORT_CHUNK_SIZE):
+        if section == 'daily_logs':
+            chunk = with_symptoms(chunk)
+        for row in chunk:
+            if 'contraceptive_type_id' in row:
+                contraceptive_type = contraceptive_types.get(row['contraceptive_type_id'])
+                row['contraceptive_type_id'] = (
+                    contraceptive_type.name if contraceptive_type else None
+                )
+            yield {RENAMED_FIELDS.get(key, key): value for key, value in row.items()}
+
+
+def export_header(user):
+    return {
+        'type': 'export',
+        'format_version': EXPORT_FORMAT_VERSION,
+        'user': user.get_username(),
+        'exported_at': timezone.now(),
+    }
+
+
+def iter_ndjson(user):
+    """A user's history as NDJSON lines (bytes), one record per line"""
+    encoder = DjangoJSONEncoder()
+    yield (encoder.encode(export_header(user)) + '\n').encode()
+    for section, model, ordering, fields in EXPORT_SECTIONS:
+        for row in export_rows(user, section, model, ordering, fields):
+            yield (encoder.encode({'type': section, **row}) + '\n').encode()
+
+
+class StreamBuffer(io.RawIOBase):
+    """Write-only sink whose contents are drained as the zip is produced"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def csv_value(value):
+    if isinstance(value, list):
+        # Daily log symptoms, e.g. "Cramps:3;Headache:2"
+        return ';'.join(f"{item['symptom']}:{item['severity']}" for item in value)
+    return '' if value is None else value
+
+
+def iter_csv_zip(user):
+    """
+    A user's history as a zip of one CSV per section (bytes chunks).
+
+    The archive is written to a non-seekable buffer, which zipfile handles
+    with data descriptors, so no section is ever held in memory whole.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for section, model, ordering, fields in EXPORT_SECTIONS:
+            columns = [RENAMED_FIELDS.get(field, field) for field in fields]
+            if section == 'daily_logs':
+                columns = [column for column in columns if column != 'id'] + ['symptoms']
+            with archive.open(f'{section}.csv', 'w', force_zip64=True) as member:
+                text = io.TextIOWrapper(member, encoding='utf-8', newline='')
+                writer = csv.writer(text)
+                writer.writerow(columns)
+                for row in export_rows(user, section, model, ordering, fields):
+                    writer.writerow([csv_value(row[column]) for column in columns])
+                    if buffer.chunks:
+                        yield buffer.drain()
+                text.flush()
+                text.detach()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+EXPORT_FORMATS = {
+    'ndjson': (iter_ndjson, 'application/x-ndjson', 'ndjson'),
+    'csv': (iter_csv_zip, 'application/zip', 'zip'),
+}
+
+
+def export_filename(user, extension):
+    return f'myflo-export-{user.get_username()}-{timezone.localdate().isoformat()}.{extension}'
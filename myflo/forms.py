@@ -1,5 +1,6 @@
 from django import forms
 from django.contrib.auth.models import User
+from . import catalogs
 from .models import (
     UserProfile, CycleProfile, Period, DailyLog, ContraceptiveUse,
     HealthProvider, Appointment, Settings
@@ -41,6 +42,12 @@ class CycleProfileForm(forms.ModelForm):
         }
 
 
+def check_period_dates(start_date, end_date):
+    """Rules every period must satisfy, shared by PeriodForm and imports"""
+    if start_date and end_date and end_date < start_date:
+        raise forms.ValidationError("End date cannot be before start date.")
+
+
 class PeriodForm(forms.ModelForm):
     class Meta:
         model = Period
@@ -56,12 +63,7 @@ class PeriodForm(forms.ModelForm):
 
     def clean(self):
         cleaned_data = super().clean()
-        start_date = cleaned_data.get('start_date')
-        end_date = cleaned_data.get('end_date')
-
-        if start_date and end_date and end_date < start_date:
-            raise forms.ValidationError("End date cannot be before start date.")
-
+        check_period_dates(cleaned_data.get('start_date'), cleaned_data.get('end_date'))
         return cleaned_data
 
 
@@ -83,6 +85,15 @@ class DailyLogForm(forms.ModelForm):
 
 
 class ContraceptiveUseForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Render the type choices from the cached catalog, not a query
+        field = self.fields['contraceptive_type']
+        field.choices = [('', field.empty_label)] + [
+            (contraceptive_type.pk, field.label_from_instance(contraceptive_type))
+            for contraceptive_type in catalogs.contraceptive_types.all()
+        ]
+
     class Meta:
         model = ContraceptiveUse
         fields = ['contraceptive_type', 'date_taken', 'dosage', 'reason', 'notes']
@@ -134,4 +145,10 @@ class SettingsForm(forms.ModelForm):
         widgets = {
             'period_reminder_days': forms.NumberInput(attrs={'min': 0, 'max': 7}),
             'daily_log_reminder_time': forms.TimeInput(attrs={'type': 'time'}),
-        }
\ No newline at end of file
+        }
+
+
+class HistoryImportForm(forms.Form):
+    file = forms.FileField(
+        help_text='A MyFlo export (.ndjson or .zip), or a .csv/.json file of periods and daily logs'
+    )
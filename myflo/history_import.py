@@ -0,0 +1,395 @@
+import csv
+import io
+import json
+import time
+import zipfile
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django import forms
+from django.db import transaction
+from django.db.models import Q
+
+from . import catalogs
+from .calendar_grid import invalidate_calendar
+from .cycle_phases import invalidate_cycle_phases
+from .cycle_stats import invalidate_cycle_stats
+from .dashboard import invalidate_dashboard
+from .forms import check_period_dates
+from .models import CycleProfile, Period, DailyLog, DailySymptom
+from .predictions import generate_predictions
+from .sharding import shard_for_user
+from .symptoms import adjust_symptom_usage
+
+
+IMPORT_BATCH_SIZE = 2000
+MAX_REPORTED_ERRORS = 50
+
+# Record types, matching the section names of myflo.export
+PERIOD_TYPES = ('periods', 'period')
+DAILY_LOG_TYPES = ('daily_logs', 'daily_log')
+
+# Archive members of a zipped CSV export and the record type they hold
+ZIP_MEMBERS = [('periods.csv', 'periods'), ('daily_logs.csv', 'daily_logs')]
+
+IMPORT_FORMATS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.json': 'json',
+    '.csv': 'csv',
+    '.zip': 'zip',
+}
+
+PERIOD_FIELDS = ['end_date', 'flow_intensity', 'notes', 'updated_at']
+DAILY_LOG_FIELDS = [
+    'flow', 'mood', 'energy_level', 'pain_level', 'sleep_hours', 'exercise_minutes',
+    'water_intake_glasses', 'notes', 'updated_at',
+]
+
+# Counters every import report carries
+REPORT_COUNTS = [
+    'rows', 'skipped', 'invalid', 'periods_created', 'periods_updated',
+    'daily_logs_created', 'daily_logs_updated', 'symptoms', 'unknown_symptoms',
+    'predictions_changed',
+]
+
+FLOW_INTENSITIES = {value for value, _ in Period._meta.get_field('flow_intensity').choices}
+FLOWS = {value for value, _ in DailyLog.FLOW_CHOICES}
+MOODS = {value for value, _ in DailyLog.MOOD_CHOICES}
+
+
+def import_format_for(filename):
+    """Import format implied by a file name's extension, or None"""
+    for extension, import_format in IMPORT_FORMATS.items():
+        if filename.lower().endswith(extension):
+            return import_format
+    return None
+
+
+def is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def parse_date(record, field, required=False):
+    value = record.get(field)
+    if is_blank(value):
+        if required:
+            raise ValueError(f'{field} is required')
+        return None
+    try:
+        # Datetimes are cut to their date part
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        raise ValueError(f'{field}: {value!r} is not a YYYY-MM-DD date')
+
+
+def parse_number(record, field, low, high, kind=int):
+    value = record.get(field)
+    if is_blank(value):
+        return None
+    try:
+        number = kind(str(value).strip())
+        in_range = low <= number <= high
+    except (ValueError, InvalidOperation):
+        raise ValueError(f'{field}: {value!r} is not a number')
+    if not in_range:
+        raise ValueError(f'{field}: {value!r} is outside {low}-{high}')
+    return number
+
+
+def parse_choice(record, field, choices, default):
+    value = record.get(field)
+    if is_blank(value):
+        return default
+    value = str(value).strip()
+    if value not in choices:
+        raise ValueError(f'{field}: {value!r} is not one of {", ".join(sorted(choices))}')
+    return value
+
+
+def parse_symptoms(value):
+    """
+    [(name, severity)] from a record's symptoms, given either as a list of
+    {"symptom", "severity"} objects (JSON) or "Name:3;Name:2" (CSV).
+    None means the record doesn't mention symptoms at all.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        pairs = [item.rsplit(':', 1) for item in value.split(';') if item.strip()]
+    elif isinstance(value, list):
+        pairs = [(item.get('symptom'), item.get('severity')) for item in value]
+    else:
+        raise ValueError('symptoms must be a list or "Name:severity;..." text')
+    symptoms = []
+    for pair in pairs:
+        if len(pair) != 2:
+            raise ValueError(f'symptoms: {":".join(pair)!r} has no severity')
+        name, severity = pair
+        severity = parse_number({'severity': severity}, 'severity', 1, 5)
+        if is_blank(name) or severity is None:
+            raise ValueError('symptoms: every entry needs a name and a severity')
+        symptoms.append((str(name).strip(), severity))
+    return symptoms
+
+
+def period_from_record(user, record):
+    start_date = parse_date(record, 'start_date', required=True)
+    end_date = parse_date(record, 'end_date')
+    check_period_dates(start_date, end_date)
+    return Period(
+        user=user,
+        start_date=start_date,
+        end_date=end_date,
+        flow_intensity=parse_choice(record, 'flow_intensity', FLOW_INTENSITIES, 'medium'),
+        notes=record.get('notes') or '',
+    )
+
+
+def daily_log_from_record(user, record):
+    daily_log = DailyLog(
+        user=user,
+        date=parse_date(record, 'date', required=True),
+        flow=parse_choice(record, 'flow', FLOWS, 'none'),
+        mood=parse_choice(record, 'mood', MOODS, ''),
+        energy_level=parse_number(record, 'energy_level', 1, 10),
+        pain_level=parse_number(record, 'pain_level', 0, 10),
+        sleep_hours=parse_number(record, 'sleep_hours', 0, 24, kind=Decimal),
+        exercise_minutes=parse_number(record, 'exercise_minutes', 0, 24 * 60),
+        water_intake_glasses=parse_number(record, 'water_intake_glasses', 0, 100),
+        notes=record.get('notes') or '',
+    )
+    return daily_log, parse_symptoms(record.get('symptoms'))
+
+
+def read_records(fileobj, import_format):
+    """
+    Yield (row number, record) from a binary file. Records that can't be
+    decoded are yielded as the exception instead, so one bad line doesn't
+    stop the import.
+    """
+    if import_format == 'ndjson':
+        for number, line in enumerate(io.TextIOWrapper(fileobj, encoding='utf-8'), 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as exc:
+                    yield number, exc
+    elif import_format == 'json':
+        data = json.load(fileobj)
+        if isinstance(data, dict):
+            # {"periods": [...], "daily_logs": [...]}
+            data = [
+                dict(record, type=record_type)
+                for record_type in ('periods', 'daily_logs')
+                for record in data.get(record_type, [])
+            ]
+        yield from enumerate(data, 1)
+    elif import_format == 'csv':
+        # One file with a "type" column; row 1 is the header
+        reader = csv.DictReader(io.TextIOWrapper(fileobj, encoding='utf-8', newline=''))
+        for number, row in enumerate(reader, 2):
+            yield number, row
+    elif import_format == 'zip':
+        with zipfile.ZipFile(fileobj) as archive:
+            for member, record_type in ZIP_MEMBERS:
+                if member not in archive.namelist():
+                    continue
+                with archive.open(member) as csv_file:
+                    reader = csv.DictReader(io.TextIOWrapper(csv_file, encoding='utf-8', newline=''))
+                    for number, row in enumerate(reader, 2):
+                        yield f'{member}:{number}', dict(row, type=record_type)
+    else:
+        raise ValueError(f'Unknown import format {import_format!r}')
+
+
+class HistoryImport:
+    """
+    Upsert a user's periods, daily logs and symptoms from decoded records.
+
+    Valid records are buffered and written batch_size at a time, each batch
+    in its own transaction with a fixed number of queries; invalid ones are
+    reported and skipped. Call finish() once for the report, which also
+    regenerates predictions and drops the user's cached pages.
+    """
+
+    def __init__(self, user, batch_size=IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.periods = {}
+        self.daily_logs = {}
+        self.counts = Counter()
+        self.errors = []
+        self.earliest_start = None
+        # Last day of every period the user will have, by start date: the
+        # existing ones and those imported so far, which replace them
+        self.period_spans = {
+            start_date: end_date or start_date
+            for start_date, end_date in Period.objects.filter(user=user).values_list(
+                'start_date', 'end_date'
+            )
+        }
+        self.period_starts = sorted(self.period_spans)
+        self.symptoms_by_name = {
+            symptom.name.lower(): symptom for symptom in catalogs.symptoms.all()
+        }
+        self.started = time.monotonic()
+
+    def add(self, number, record):
+        self.counts['rows'] += 1
+        try:
+            if isinstance(record, Exception):
+                raise ValueError(f'unreadable record: {record}')
+            if not isinstance(record, dict):
+                raise ValueError('expected an object')
+            record_type = record.get('type')
+            if record_type in PERIOD_TYPES:
+                period = period_from_record(self.user, record)
+                self.check_overlap(period)
+                # A later row for the same start date wins
+                self.periods[period.start_date] = period
+            elif record_type in DAILY_LOG_TYPES:
+                daily_log, symptoms = daily_log_from_record(self.user, record)
+                self.daily_logs[daily_log.date] = (daily_log, symptoms)
+            else:
+                # Export headers, predictions, insights... aren't imported
+                self.counts['skipped'] += 1
+                return
+        except (ValueError, forms.ValidationError) as exc:
+            messages = exc.messages if isinstance(exc, forms.ValidationError) else [str(exc)]
+            self.counts['invalid'] += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append((number, '; '.join(messages)))
+            return
+        if len(self.periods) + len(self.daily_logs) >= self.batch_size:
+            self.flush()
+
+    def check_overlap(self, period):
+        """
+        Refuse a period that overlaps another of the user's periods; one
+        with the same start date is replaced instead. Open-ended periods
+        only count their start day.
+        """
+        start_date, last_day = period.start_date, period.end_date or period.start_date
+        starts = self.period_starts
+        index = bisect_left(starts, start_date)
+        replaces = index < len(starts) and starts[index] == start_date
+        following = index + 1 if replaces else index
+        if index and self.period_spans[starts[index - 1]] >= start_date:
+            other = starts[index - 1]
+        elif following < len(starts) and starts[following] <= last_day:
+            other = starts[following]
+        else:
+            if not replaces:
+                insort(starts, start_date)
+            self.period_spans[start_date] = last_day
+            return
+        raise ValueError(f'overlaps the period starting {other.isoformat()}')
+
+    def flush(self):
+        if not self.periods and not self.daily_logs:
+            return
+        with transaction.atomic(using=shard_for_user(self.user.pk)):
+            if self.periods:
+                self.save_periods(list(self.periods.values()))
+            if self.daily_logs:
+                self.save_daily_logs(list(self.daily_logs.values()))
+        self.periods, self.daily_logs = {}, {}
+
+    def save_periods(self, periods):
+        existing = set(Period.objects.filter(
+            user=self.user, start_date__in=[period.start_date for period in periods]
+        ).values_list('start_date', flat=True))
+        Period.objects.bulk_create(
+            periods, update_conflicts=True, unique_fields=['user', 'start_date'],
+            update_fields=PERIOD_FIELDS
+        )
+        self.counts['periods_updated'] += len(existing)
+        self.counts['periods_created'] += len(periods) - len(existing)
+        first = min(period.start_date for period in periods)
+        self.earliest_start = min(first, self.earliest_start or first)
+
+    def save_daily_logs(self, entries):
+        dates = [daily_log.date for daily_log, _ in entries]
+        existing = dict(DailyLog.objects.filter(
+            user=self.user, date__in=dates
+        ).values_list('date', 'id'))
+        DailyLog.objects.bulk_create(
+            [daily_log for daily_log, _ in entries], update_conflicts=True,
+            unique_fields=['user', 'date'], update_fields=DAILY_LOG_FIELDS
+        )
+        self.counts['daily_logs_updated'] += len(existing)
+        self.counts['daily_logs_created'] += len(entries) - len(existing)
+
+        # Logs that list symptoms get exactly those symptoms
+        with_symptoms = [(daily_log, symptoms) for daily_log, symptoms in entries if symptoms is not None]
+        if not with_symptoms:
+            return
+        log_ids = dict(existing)
+        new_dates = [daily_log.date for daily_log, _ in with_symptoms if daily_log.date not in existing]
+        if new_dates:
+            log_ids.update(DailyLog.objects.filter(
+                user=self.user, date__in=new_dates
+            ).values_list('date', 'id'))
+        usage = Counter()
+        replaced_ids = [existing[daily_log.date] for daily_log, _ in with_symptoms if daily_log.date in existing]
+        if replaced_ids:
+            # Only logs that existed before this batch can have symptoms to replace
+            replaced = DailySymptom.objects.filter(daily_log_id__in=replaced_ids)
+            usage.subtract(replaced.values_list('symptom_id', flat=True))
+            replaced.delete()
+
+        new_symptoms = []
+        for daily_log, symptoms in with_symptoms:
+            severities = {}
+            for name, severity in symptoms:
+                symptom = self.symptoms_by_name.get(name.lower())
+                if symptom is None:
+                    self.counts['unknown_symptoms'] += 1
+                    continue
+                severities[symptom.pk] = severity
+            new_symptoms.extend(
+                DailySymptom(daily_log_id=log_ids[daily_log.date], symptom_id=symptom_id, severity=severity)
+                for symptom_id, severity in severities.items()
+            )
+        DailySymptom.objects.bulk_create(new_symptoms)
+        usage.update(daily_symptom.symptom_id for daily_symptom in new_symptoms)
+        adjust_symptom_usage({symptom_id: delta for symptom_id, delta in usage.items() if delta})
+        self.counts['symptoms'] += len(new_symptoms)
+
+    def finish(self):
+        self.flush()
+        imported = sum(self.counts[key] for key in (
+            'periods_created', 'periods_updated', 'daily_logs_created', 'daily_logs_updated'
+        ))
+        if imported:
+            if self.earliest_start:
+                CycleProfile.objects.get_or_create(user=self.user)
+                CycleProfile.objects.filter(user=self.user).filter(
+                    Q(first_period_date__isnull=True) |
+                    Q(first_period_date__gt=self.earliest_start)
+                ).update(first_period_date=self.earliest_start)
+            # Bulk writes send no signals, so drop every cached view here
+            invalidate_calendar(self.user.pk)
+            invalidate_dashboard(self.user.pk)
+            invalidate_cycle_stats(self.user.pk)
+            invalidate_cycle_phases(self.user.pk)
+            self.counts['predictions_changed'] = generate_predictions(self.user)
+
+        elapsed = time.monotonic() - self.started
+        return dict(
+            {key: self.counts[key] for key in REPORT_COUNTS},
+            errors=self.errors,
+            seconds=round(elapsed, 2),
+            rows_per_second=round(self.counts['rows'] / elapsed) if elapsed else 0,
+        )
+
+
+def import_history(user, fileobj, import_format, batch_size=IMPORT_BATCH_SIZE):
+    """Import a CSV/JSON/NDJSON/zip history file for user; returns the report"""
+    history_import = HistoryImport(user, batch_size)
+    for number, record in read_records(fileobj, import_format):
+        history_import.add(number, record)
+    return history_import.finish()
@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from myflo.benchmarking import invalidate_read_caches, percentile
+
+# Mode: (handler, whether the async views are served)
+MODES = {
+    'wsgi': ('wsgi', False),
+    # Isolates the handler's cost from the views'
+    'asgi-sync': ('asgi', False),
+    'asgi': ('asgi', True),
+}
+DEFAULT_URL_NAMES = ['dashboard', 'calendar', 'analytics', 'notifications']
+HOST = 'localhost'
+
+
+def wsgi_get(application, path, cookie):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': HOST, 'HTTP_COOKIE': cookie,
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+    result = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(result)
+    finally:
+        # Fires request_finished, which releases the thread's connection
+        result.close()
+    return int(statuses[0].split()[0])
+
+
+async def asgi_get(application, path, cookie):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': b'', 'headers': [(b'host', HOST.encode()), (b'cookie', cookie.encode())],
+        'server': (HOST, 80), 'client': ('127.0.0.1', 0),
+    }
+    requested = False
+    statuses = []
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client never disconnects
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await application(scope, receive, send)
+    return statuses[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare p50/p99 latency and requests per second of the read-heavy pages '
+        'served through the WSGI handler (sync views) and the ASGI handler (sync views, '
+        'then async views). Each mode runs in its own process and calls the handler directly, so no server '
+        'or network time is included'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User whose pages are requested')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per mode (default 200)')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight (default 8)')
+        parser.add_argument(
+            '--url-name', action='append', dest='url_names',
+            help=f"URL name to request, repeatable (default: {', '.join(DEFAULT_URL_NAMES)})"
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help="Drop the user's cached pages before every request"
+        )
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+        # Internal: benchmark one mode in this process
+        parser.add_argument('--mode', choices=list(MODES), help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1.')
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options)))
+            return
+
+        results = [self.run_child(mode, options) for mode in MODES]
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=1))
+            return
+        self.stdout.write(
+            f"{options['requests']} requests, concurrency {options['concurrency']}, "
+            f"{'cold' if options['cold'] else 'warm'} caches, in-process handlers"
+        )
+        self.stdout.write(f"{'mode':<10}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<10}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                f"{result['requests_per_second']:>10.1f}{result['errors']:>8}"
+            )
+
+    def run_child(self, mode, options):
+        """Benchmark a mode in a fresh process, with MYFLO_ASYNC_VIEWS set for it"""
+        command = [
+            sys.executable, '-m', 'django', 'benchmark_async_views', options['username'],
+            '--mode', mode, '--requests', str(options['requests']),
+            '--concurrency', str(options['concurrency']),
+        ]
+        for url_name in options['url_names'] or []:
+            command += ['--url-name', url_name]
+        if options['cold']:
+            command.append('--cold')
+        env = dict(os.environ, MYFLO_ASYNC_VIEWS='1' if MODES[mode][1] else '0')
+        env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+        child = subprocess.run(command, env=env, capture_output=True, text=True)
+        if child.returncode:
+            raise CommandError(f'{mode} benchmark failed:\n{child.stderr}')
+        return json.loads(child.stdout.strip().splitlines()[-1])
+
+    def run_mode(self, options):
+        mode = options['mode']
+        handler, async_views = MODES[mode]
+        if settings.MYFLO_ASYNC_VIEWS != async_views:
+            raise CommandError(f'MYFLO_ASYNC_VIEWS must be {"on" if async_views else "off"} for {mode}.')
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist.")
+        client = Client()
+        client.force_login(user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        paths = [reverse(url_name) for url_name in options['url_names'] or DEFAULT_URL_NAMES]
+        schedule = [paths[index % len(paths)] for index in range(options['requests'])]
+        cold = options['cold']
+
+        if handler == 'wsgi':
+            from django.core.wsgi import get_wsgi_application
+            application = get_wsgi_application()
+
+            def timed(path):
+                if cold:
+                    invalidate_read_caches(user.pk)
+                started = time.perf_counter()
+                status = wsgi_get(application, path, cookie)
+                return time.perf_counter() - started, status
+
+            for path in paths:
+                wsgi_get(application, path, cookie)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                timings = list(pool.map(timed, schedule))
+            elapsed = time.perf_counter() - started
+        else:
+            from asgiref.sync import sync_to_async
+            from django.core.asgi import get_asgi_application
+            application = get_asgi_application()
+
+            async def run():
+                slots = asyncio.Semaphore(options['concurrency'])
+
+                async def timed(path):
+                    async with slots:
+                        if cold:
+                            await sync_to_async(invalidate_read_caches)(user.pk)
+                        started = time.perf_counter()
+                        status = await asgi_get(application, path, cookie)
+                        return time.perf_counter() - started, status
+
+                for path in paths:
+                    await asgi_get(application, path, cookie)
+                started = time.perf_counter()
+                timings = await asyncio.gather(*(timed(path) for path in schedule))
+                return timings, time.perf_counter() - started
+
+            timings, elapsed = asyncio.run(run())
+
+        latencies = sorted(seconds * 1000 for seconds, _ in timings)
+        return {
+            'mode': mode,
+            'paths': paths,
+            'requests': len(timings),
+            'concurrency': options['concurrency'],
+            'cold': cold,
+            'errors': sum(1 for _, status in timings if status != 200),
+            'p50_ms': percentile(latencies, 0.5),
+            'p99_ms': percentile(latencies, 0.99),
+            'requests_per_second': len(timings) / elapsed,
+        }
+
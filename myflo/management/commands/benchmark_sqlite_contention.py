@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.utils import timezone
+
+from myflo import catalogs
+from myflo.benchmarking import latency_summary
+from myflo.calendar_grid import build_calendar_grid, month_span
+from myflo.dashboard import build_dashboard_bundle
+from myflo.models import DailyLog
+from myflo.routers import read_only_queries
+from myflo.symptoms import save_daily_symptoms
+
+# Profile: journal mode the copy of the database starts in
+PROFILES = {
+    'basic': 'DELETE',
+    'production': 'WAL',
+}
+MAX_USERS = 200
+
+
+def copy_database(source, target, journal_mode):
+    """Consistent copy of an SQLite database, even while it is being written"""
+    origin, copy = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        origin.backup(copy)
+        copy.execute(f'PRAGMA journal_mode={journal_mode}')
+    finally:
+        origin.close()
+        copy.close()
+
+
+def write_daily_log(user, day, rng, symptom_ids):
+    """What saving the daily log form does"""
+    daily_log = DailyLog.objects.filter(user=user, date=day).first()
+    if daily_log is None:
+        daily_log = DailyLog(user=user, date=day, flow='none')
+    daily_log.mood = rng.choice(DailyLog.MOOD_CHOICES)[0]
+    daily_log.energy_level = rng.randint(1, 5)
+    with transaction.atomic():
+        daily_log.save()
+        save_daily_symptoms(daily_log, {rng.choice(symptom_ids): rng.randint(1, 5)} if symptom_ids else {})
+
+
+def read_pages(user, day):
+    """What the dashboard and calendar read when their caches are cold"""
+    with read_only_queries():
+        build_dashboard_bundle(user, day, timezone.now())
+        build_calendar_grid(user, *month_span(day.year, day.month), today=day)
+
+
+class Command(BaseCommand):
+    help = (
+        'Run daily log writers against dashboard/calendar readers on copies of the '
+        'database, under the basic and the production SQLite profile, and report '
+        'throughput, p50/p99 latency and "database is locked" failures of each'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5, help='Duration per profile (default 5)')
+        parser.add_argument('--writers', type=int, default=2, help='Writer threads (default 2)')
+        parser.add_argument('--readers', type=int, default=4, help='Reader threads (default 4)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+        # Internal: run one profile in this process
+        parser.add_argument('--profile', choices=list(PROFILES), help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['writers'] < 0 or options['readers'] < 0 or options['seconds'] <= 0:
+            raise CommandError('--seconds must be positive, --writers and --readers not negative.')
+        if options['profile']:
+            self.stdout.write(json.dumps(self.run_profile(options)))
+            return
+
+        source = str(settings.DATABASES['default']['NAME'])
+        if not os.path.exists(source):
+            raise CommandError(f'Database {source} does not exist.')
+        results = []
+        with tempfile.TemporaryDirectory() as scratch:
+            for profile, journal_mode in PROFILES.items():
+                path = os.path.join(scratch, f'{profile}.sqlite3')
+                copy_database(source, path, journal_mode)
+                results.append(self.run_child(profile, path, options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=1))
+            return
+        self.stdout.write(
+            f"{options['writers']} writers, {options['readers']} readers, "
+            f"{options['seconds']:g} s per profile"
+        )
+        self.stdout.write(
+            f"{'profile':<12}{'role':<8}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'locked':>8}"
+        )
+        for result in results:
+            for role in ('writes', 'reads'):
+                summary = result[role]
+                self.stdout.write(
+                    f"{result['profile']:<12}{role:<8}{summary['per_second'] or 0:>10.1f}"
+                    f"{summary['p50_ms'] or 0:>10.2f}{summary['p99_ms'] or 0:>10.2f}"
+                    f"{summary['locked']:>8}"
+                )
+
+    def run_child(self, profile, path, options):
+        """Run a profile in a fresh process, configured by the settings' environment variables"""
+        command = [
+            sys.executable, '-m', 'django', 'benchmark_sqlite_contention', '--profile', profile,
+            '--seconds', str(options['seconds']), '--writers', str(options['writers']),
+            '--readers', str(options['readers']),
+        ]
+        env = dict(os.environ, MYFLO_SQLITE_PROFILE=profile, MYFLO_SQLITE_PATH=path)
+        env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+        child = subprocess.run(command, env=env, capture_output=True, text=True)
+        if child.returncode:
+            raise CommandError(f'{profile} benchmark failed:\n{child.stderr}')
+        return json.loads(child.stdout.strip().splitlines()[-1])
+
+    def run_profile(self, options):
+        if settings.SQLITE_PROFILE != options['profile']:
+            raise CommandError(f"MYFLO_SQLITE_PROFILE must be {options['profile']!r}.")
+        users = list(User.objects.order_by('id')[:MAX_USERS])
+        if not users:
+            raise CommandError('The database has no users to read and write for.')
+        symptom_ids = [symptom.pk for symptom in catalogs.symptoms.all()]
+        today = date.today()
+        deadline = time.perf_counter() + options['seconds']
+        timings = {'writes': [], 'reads': []}
+        locked = {'writes': 0, 'reads': 0}
+        lock = threading.Lock()
+
+        def worker(role, seed):
+            rng = random.Random(seed)
+            durations, failures = [], 0
+            try:
+                while time.perf_counter() < deadline:
+                    user = rng.choice(users)
+                    day = today - timedelta(days=rng.randrange(365))
+                    started = time.perf_counter()
+                    try:
+                        if role == 'writes':
+                            write_daily_log(user, day, rng, symptom_ids)
+                        else:
+                            read_pages(user, day)
+                    except OperationalError:
+                        # database is locked: the busy timeout ran out
+                        failures += 1
+                        continue
+                    durations.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+            with lock:
+                timings[role].extend(durations)
+                locked[role] += failures
+
+        threads = [
+            threading.Thread(target=worker, args=('writes', index))
+            for index in range(options['writers'])
+        ] + [
+            threading.Thread(target=worker, args=('reads', 1000 + index))
+            for index in range(options['readers'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        result = {'profile': options['profile']}
+        for role in ('writes', 'reads'):
+            result[role] = dict(latency_summary(timings[role], elapsed), locked=locked[role])
+        return result
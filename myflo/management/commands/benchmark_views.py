@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from myflo.sharding import data_aliases
+from myflo.view_benchmark import (
+    BASELINE_PATH, configuration_changes, find_regressions, run_view_benchmark, server_errors
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every page of myflo.urls for a small, a medium and a large '
+        'synthetic user in a scratch database, recording wall time, SQL queries '
+        'and peak memory of each, and fail on regressions from the baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Timed requests per page (default 5)')
+        parser.add_argument(
+            '--baseline', default=BASELINE_PATH,
+            help='Baseline results to compare with (default: the checked-in baseline)'
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Save the results as the new baseline instead of comparing'
+        )
+        parser.add_argument(
+            '--time-threshold', type=float, default=0.5,
+            help='Allowed wall time increase, as a fraction of the baseline (default 0.5)'
+        )
+        parser.add_argument(
+            '--memory-threshold', type=float, default=0.5,
+            help='Allowed peak memory increase, as a fraction of the baseline (default 0.5)'
+        )
+        parser.add_argument('--output', help='Also write the results as JSON to this file')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+        # Internal: benchmark in this process, against an empty database
+        parser.add_argument('--scratch', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        if options['time_threshold'] < 0 or options['memory_threshold'] < 0:
+            raise CommandError('Thresholds must not be negative.')
+        if options['scratch']:
+            self.stdout.write(json.dumps(self.run_scratch(options)))
+            return
+
+        with tempfile.TemporaryDirectory() as scratch:
+            results = self.run_child(os.path.join(scratch, 'benchmark.sqlite3'), options)
+        if options['update_baseline']:
+            regressions = server_errors(results)
+            # A broken page must be fixed, not budgeted
+            if not regressions:
+                self.write_json(options['baseline'], results)
+        else:
+            try:
+                with open(options['baseline']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except FileNotFoundError:
+                raise CommandError(
+                    f"No baseline at {options['baseline']}; create it with --update-baseline."
+                )
+            for change in configuration_changes(results, baseline):
+                self.stderr.write(f'Measured under different settings than the baseline, {change}')
+            regressions = find_regressions(
+                results, baseline, options['time_threshold'], options['memory_threshold']
+            )
+        results['regressions'] = regressions
+        if options['output']:
+            self.write_json(options['output'], results)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=1))
+        else:
+            self.stdout.write(
+                f"{'profile':<8}{'view':<26}{'status':>7}{'p50 ms':>10}{'min ms':>10}{'queries':>9}"
+                f"{'peak KiB':>10}"
+            )
+            for profile, measured in results['profiles'].items():
+                for name, view in measured['views'].items():
+                    self.stdout.write(
+                        f"{profile:<8}{name:<26}{view['status']:>7}{view['median_ms']:>10.2f}"
+                        f"{view['min_ms']:>10.2f}{view['queries']:>9}{view['peak_kib']:>10}"
+                    )
+        if regressions:
+            raise CommandError(f'{len(regressions)} regressions:\n' + '\n'.join(regressions))
+        elif options['update_baseline']:
+            self.stdout.write(self.style.SUCCESS(f"Saved the baseline to {options['baseline']}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    def write_json(self, path, results):
+        with open(path, 'w') as out:
+            json.dump(results, out, indent=1)
+            out.write('\n')
+
+    def run_child(self, path, options):
+        """Benchmark in a fresh process whose database (and shards) are scratch files"""
+        command = [
+            sys.executable, '-m', 'django', 'benchmark_views', '--scratch',
+            '--repeat', str(options['repeat']),
+        ]
+        env = dict(os.environ, MYFLO_SQLITE_PATH=path)
+        env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+        child = subprocess.run(command, env=env, capture_output=True, text=True)
+        if child.returncode:
+            raise CommandError(f'Benchmark failed:\n{child.stderr}')
+        return json.loads(child.stdout.strip().splitlines()[-1])
+
+    def run_scratch(self, options):
+        for alias in data_aliases():
+            call_command('migrate', database=alias, verbosity=0)
+        if User.objects.exists():
+            raise CommandError('The benchmark seeds its own users and needs an empty database.')
+        return run_view_benchmark(options['repeat'])
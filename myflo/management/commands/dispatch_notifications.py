@@ -0,0 +1,113 @@
+import asyncio
+import json
+import math
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myflo.dispatch import (
+    DispatchMetrics, claim_batch, deliver_batch, dispatch_backlog, get_backend,
+    record_results
+)
+from myflo.sharding import data_aliases, fan_out, use_shard
+
+
+class Command(BaseCommand):
+    help = 'Deliver due notifications; several workers may run side by side'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Notifications claimed per batch (default: 100)'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=10,
+            help='Deliveries in flight at once (default: 10)'
+        )
+        parser.add_argument(
+            '--send-timeout', type=float, default=30,
+            help='Seconds before a single delivery is abandoned (default: 30)'
+        )
+        parser.add_argument(
+            '--lease', type=float, default=None,
+            help='Seconds a claimed batch stays reserved; defaults to the worst-case '
+                 'batch delivery time plus a minute'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=5,
+            help='Seconds to sleep when nothing is due (default: 5)'
+        )
+        parser.add_argument(
+            '--stats-interval', type=float, default=60,
+            help='Seconds between metric lines (default: 60)'
+        )
+        parser.add_argument(
+            '--backend', default=None,
+            help='Dotted path of the delivery backend (default: MYFLO_NOTIFICATION_BACKEND)'
+        )
+        parser.add_argument(
+            '--worker-name', default=f'{socket.gethostname()}:{os.getpid()}',
+            help='Name recorded on claimed rows (default: host:pid)'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no notification is due instead of polling'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        concurrency = options['concurrency']
+        send_timeout = options['send_timeout']
+        if batch_size < 1 or concurrency < 1 or send_timeout <= 0:
+            raise CommandError('--batch-size, --concurrency and --send-timeout must be positive.')
+        # A lease shorter than a slow batch would let another worker re-send it
+        worst_case = math.ceil(batch_size / concurrency) * send_timeout
+        lease = options['lease'] if options['lease'] is not None else worst_case + 60
+        if lease <= worst_case:
+            raise CommandError(
+                f'--lease must exceed the worst-case batch time of {worst_case:.0f}s.'
+            )
+
+        backend = get_backend(options['backend'])
+        worker = options['worker_name']
+        metrics = DispatchMetrics()
+        last_report = time.monotonic()
+
+        try:
+            while True:
+                delivered = False
+                for alias in data_aliases():
+                    with use_shard(alias):
+                        token, notifications = claim_batch(worker, batch_size, lease)
+                        if notifications:
+                            delivered = True
+                            results = asyncio.run(
+                                deliver_batch(backend, notifications, concurrency, send_timeout)
+                            )
+                            now = timezone.now()
+                            metrics.record_batch(results, *record_results(token, results, now), now)
+                if not delivered:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                if time.monotonic() - last_report >= options['stats_interval']:
+                    self.report(metrics)
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        self.report(metrics, final=True)
+
+    def report(self, metrics, final=False):
+        backlogs = fan_out(dispatch_backlog).values()
+        backlog = {
+            'due': sum(shard['due'] for shard in backlogs),
+            'lag_seconds': max(shard['lag_seconds'] for shard in backlogs),
+        }
+        stats = dict(metrics.snapshot(), backlog=backlog)
+        if final:
+            self.stdout.write(self.style.SUCCESS(json.dumps(stats)))
+        else:
+            self.stdout.write(json.dumps(stats))
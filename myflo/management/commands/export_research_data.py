@@ -0,0 +1,43 @@
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from myflo.research_export import RESEARCH_CHUNK_SIZE, export_research_data
+
+
+class Command(BaseCommand):
+    help = (
+        'Write pseudonymized period, daily log and symptom data of users who '
+        'share data for research as columnar .npz parts; repeated runs add '
+        'only what changed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir')
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Ignore the previous watermark and export everything again'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=RESEARCH_CHUNK_SIZE,
+            help=f'Number of users per part file (default: {RESEARCH_CHUNK_SIZE})'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of worker processes (default: 1)'
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-size and --workers must be positive.')
+        try:
+            report = export_research_data(
+                options['output_dir'], full=options['full'],
+                chunk_size=options['chunk_size'], workers=options['workers']
+            )
+        except ImportError:
+            raise CommandError('The research export needs NumPy.')
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(json.dumps(report))
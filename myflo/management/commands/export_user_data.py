@@ -0,0 +1,45 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from myflo.export import EXPORT_FORMATS, export_allowed
+from myflo.sharding import use_user_shard
+
+
+class Command(BaseCommand):
+    help = "Stream one user's full history as NDJSON or zipped CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument(
+            '--format', choices=sorted(EXPORT_FORMATS), default='ndjson',
+            help='ndjson (default) or csv, a zip with one CSV per section'
+        )
+        parser.add_argument(
+            '--output', default='-',
+            help='File to write; "-" writes to standard output (default)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist.")
+        with use_user_shard(user):
+            self.export(user, options)
+
+    def export(self, user, options):
+        if not export_allowed(user):
+            raise CommandError(f'{user.username} has turned data export off.')
+
+        stream = EXPORT_FORMATS[options['format']][0]
+        if options['output'] == '-':
+            out = sys.stdout.buffer
+            for chunk in stream(user):
+                out.write(chunk)
+            out.flush()
+        else:
+            with open(options['output'], 'wb') as out:
+                for chunk in stream(user):
+                    out.write(chunk)
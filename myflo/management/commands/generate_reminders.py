@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myflo.batching import user_id_chunks
+from myflo.reminders import generate_reminder_chunk
+from myflo.sharding import data_aliases, shard_users, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        'Create period and ovulation reminders from active predictions and '
+        'remove outdated ones; safe to run repeatedly, e.g. from cron'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of users handled per chunk (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive.')
+
+        started = time.monotonic()
+        chunks = created = removed = 0
+        for alias in data_aliases():
+            user_ids = shard_users(alias).order_by('id').values_list('id', flat=True)
+            for first_user_id, last_user_id in user_id_chunks(user_ids, chunk_size):
+                with use_shard(alias):
+                    chunk_created, chunk_removed = generate_reminder_chunk(first_user_id, last_user_id)
+                chunks += 1
+                created += chunk_created
+                removed += chunk_removed
+                if options['verbosity'] >= 2:
+                    self.stdout.write(
+                        f'  users {first_user_id}-{last_user_id}: '
+                        f'{chunk_created} created, {chunk_removed} removed'
+                    )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} reminders and removed {removed} outdated ones '
+            f'in {chunks} chunks in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,47 @@
+import json
+import zipfile
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from myflo.history_import import IMPORT_BATCH_SIZE, IMPORT_FORMATS, import_format_for, import_history
+from myflo.sharding import use_user_shard
+
+
+class Command(BaseCommand):
+    help = "Import periods, daily logs and symptoms into one user's history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path', help='NDJSON, JSON, CSV or zipped CSV export file')
+        parser.add_argument(
+            '--format', choices=sorted(set(IMPORT_FORMATS.values())),
+            help="File format; by default it follows the file's extension"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help=f'Records written per transaction (default: {IMPORT_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist.")
+        import_format = options['format'] or import_format_for(options['path'])
+        if import_format is None:
+            raise CommandError('Cannot tell the file format from its name; pass --format.')
+
+        try:
+            with open(options['path'], 'rb') as fileobj, use_user_shard(user):
+                report = import_history(user, fileobj, import_format, options['batch_size'])
+        except OSError as exc:
+            raise CommandError(f'Cannot read {options["path"]}: {exc}')
+        except (ValueError, zipfile.BadZipFile) as exc:
+            raise CommandError(f'Cannot import {options["path"]}: {exc}')
+
+        for number, message in report['errors']:
+            self.stderr.write(f'  row {number}: {message}')
+        self.stdout.write(json.dumps(report, default=str))
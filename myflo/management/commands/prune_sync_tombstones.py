@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from myflo.models import SyncTombstone
+from myflo.sharding import fan_out
+from myflo.sync import tombstone_retention
+
+
+def prune(cutoff):
+    deleted, _ = SyncTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
+
+
+class Command(BaseCommand):
+    help = 'Delete sync tombstones older than MYFLO_SYNC_TOMBSTONE_DAYS'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - tombstone_retention()
+        deleted = sum(fan_out(prune, cutoff).values())
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} tombstones older than {cutoff:%Y-%m-%d}'))
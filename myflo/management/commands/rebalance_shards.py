@@ -0,0 +1,74 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from myflo.sharding import (
+    SHARD_MAP_TIMEOUT, data_aliases, finish_move, hash_shard, misplaced_users, shard_for_user,
+    sharding_enabled, start_move
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move users whose rows are not on the shard their id hashes to (or one '
+        'user, to a shard of your choice) while the site keeps running'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username of the one user to move')
+        parser.add_argument(
+            '--to', choices=data_aliases(),
+            help="Database to move --user to (default: the user's hash shard)"
+        )
+        parser.add_argument(
+            '--settle', type=float, default=SHARD_MAP_TIMEOUT,
+            help='Seconds to wait for other processes to see the new shards before moving '
+                 f'what they wrote meanwhile (default: {SHARD_MAP_TIMEOUT})'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List the moves without making them'
+        )
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError('Sharding is off; set MYFLO_SHARDS to the number of shards.')
+        if options['settle'] < 0:
+            raise CommandError('--settle must not be negative.')
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']!r} does not exist.")
+            target = options['to'] or hash_shard(user.pk)
+            moves = [(user.pk, shard_for_user(user.pk), target)]
+        elif options['to']:
+            raise CommandError('--to needs --user.')
+        else:
+            moves = list(misplaced_users())
+
+        moves = [(user_id, source, target) for user_id, source, target in moves if source != target]
+        if options['dry_run'] or not moves:
+            for user_id, source, target in moves:
+                self.stdout.write(f'  user {user_id}: {source} -> {target}')
+            self.stdout.write(f'{len(moves)} users to move')
+            return
+
+        started = time.monotonic()
+        rows = 0
+        sources = []
+        for user_id, _, target in moves:
+            source, counts = start_move(user_id, target)
+            sources.append((user_id, source, target))
+            rows += sum(counts.values())
+            if options['verbosity'] >= 2:
+                self.stdout.write(f'  user {user_id}: {source} -> {target}, {sum(counts.values())} rows')
+        # Requests that looked up the old shard before the switch may still write there
+        time.sleep(options['settle'])
+        for user_id, source, target in sources:
+            rows += sum(finish_move(user_id, source, target).values())
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {len(moves)} users ({rows} rows) in {time.monotonic() - started:.2f}s'
+        ))
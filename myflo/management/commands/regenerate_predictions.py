@@ -0,0 +1,98 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from myflo.batching import user_id_chunks
+from myflo.models import Period
+from myflo.predictions import regenerate_prediction_chunk
+from myflo.sharding import data_aliases, on_shard, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute active predictions for every user with period history, '
+        'skipping users whose inputs have not changed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of users handled per chunk (default: 500)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes; 1 runs every chunk in this process'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            raise CommandError('regenerate_predictions requires NumPy (pip install numpy).')
+
+        self.verbosity = options['verbosity']
+        chunk_size = options['chunk_size']
+        workers = options['workers']
+        if chunk_size < 1 or workers < 1:
+            raise CommandError('--chunk-size and --workers must be positive.')
+
+        chunks = list(self.user_chunks(chunk_size))
+        started = time.monotonic()
+        users = changed = 0
+
+        if workers == 1:
+            for alias, first_user_id, last_user_id in chunks:
+                chunk_users, chunk_changed = self.report_chunk(
+                    alias, first_user_id, last_user_id,
+                    on_shard(alias, regenerate_prediction_chunk, first_user_id, last_user_id)
+                )
+                users += chunk_users
+                changed += chunk_changed
+        else:
+            # Forked workers must not share the parent's open connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+                futures = {
+                    executor.submit(
+                        on_shard, alias, regenerate_prediction_chunk, first_user_id, last_user_id
+                    ): (alias, first_user_id, last_user_id)
+                    for alias, first_user_id, last_user_id in chunks
+                }
+                for future in as_completed(futures):
+                    chunk_users, chunk_changed = self.report_chunk(
+                        *futures[future], future.result()
+                    )
+                    users += chunk_users
+                    changed += chunk_changed
+
+        elapsed = time.monotonic() - started
+        # Every user is fingerprinted whether or not anything changed, so
+        # the rate counts them all
+        rate = users / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {users} users in {len(chunks)} chunks in {elapsed:.2f}s '
+            f'({rate:.0f} users/s); updated predictions for {changed} users'
+        ))
+
+    def user_chunks(self, chunk_size):
+        """(database, first user id, last user id) of every chunk"""
+        for alias in data_aliases():
+            with use_shard(alias):
+                for first_user_id, last_user_id in user_id_chunks(
+                    Period.objects.order_by('user_id').values_list('user_id', flat=True).distinct(),
+                    chunk_size
+                ):
+                    yield alias, first_user_id, last_user_id
+
+    def report_chunk(self, alias, first_user_id, last_user_id, result):
+        if self.verbosity >= 2:
+            users, changed = result
+            self.stdout.write(
+                f'  {alias} users {first_user_id}-{last_user_id}: '
+                f'{users} processed, {changed} updated'
+            )
+        return result
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myflo.reminder_schedule import fire_due_reminders
+from myflo.sharding import data_aliases, use_shard
+
+
+class Command(BaseCommand):
+    help = 'Fire due daily-log and pill reminders; run a single instance'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=60,
+            help='Seconds between ticks (default: 60)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Reminders fired per transaction (default: 1000)'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Run a single tick and exit'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1 or options['interval'] <= 0:
+            raise CommandError('--batch-size and --interval must be positive.')
+
+        try:
+            while True:
+                started = time.monotonic()
+                fired = 0
+                for alias in data_aliases():
+                    with use_shard(alias):
+                        while True:
+                            batch = fire_due_reminders(batch_size=batch_size)
+                            fired += batch
+                            if batch < batch_size:
+                                break
+                if fired or options['verbosity'] >= 2:
+                    self.stdout.write(
+                        f'Fired {fired} reminders in {time.monotonic() - started:.2f}s'
+                    )
+                if options['once']:
+                    break
+                time.sleep(max(options['interval'] - (time.monotonic() - started), 0))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,79 @@
+import os
+import time
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from myflo.synthetic import (
+    SYNTHETIC_BATCH_SIZE, SYNTHETIC_CHUNK_SIZE, delete_synthetic_users, seed_synthetic_data
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users with years of synthetic history (periods, daily logs and '
+        'symptoms, contraceptive uses, appointments, notifications) for load tests '
+        'and benchmarks. The same --seed and --end-date give the same data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to create (default 1000)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default 0)')
+        parser.add_argument('--years', type=float, default=3, help='Longest history in years (default 3)')
+        parser.add_argument(
+            '--end-date', type=date.fromisoformat, default=date.today(),
+            help='Last day of the histories, YYYY-MM-DD (default: today)'
+        )
+        parser.add_argument(
+            '--prefix', default='synthetic',
+            help='Username prefix, followed by the user number (default: synthetic)'
+        )
+        parser.add_argument(
+            '--replace', action='store_true',
+            help='Delete the users with the prefix first'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=SYNTHETIC_CHUNK_SIZE,
+            help=f'Users generated per task (default: {SYNTHETIC_CHUNK_SIZE})'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=SYNTHETIC_BATCH_SIZE,
+            help=f'Rows per bulk insert (default: {SYNTHETIC_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes; 1 generates every chunk in this process'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['chunk_size'] < 1 or options['batch_size'] < 1 \
+                or options['workers'] < 1:
+            raise CommandError('--users, --chunk-size, --batch-size and --workers must be positive.')
+        if options['years'] <= 0:
+            raise CommandError('--years must be positive.')
+        existing = User.objects.filter(username__startswith=options['prefix'])
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError(
+                    f"Users named {options['prefix']}* already exist; pass --replace to recreate them."
+                )
+            deleted = delete_synthetic_users(options['prefix'])
+            self.stdout.write(f"Deleted {deleted} {options['prefix']}* users")
+
+        started = time.monotonic()
+        counts = seed_synthetic_data(
+            options['users'], options['end_date'], seed=options['seed'], years=options['years'],
+            prefix=options['prefix'], chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'], workers=options['workers'],
+        )
+        elapsed = time.monotonic() - started
+        rows = sum(counts.values())
+        if options['verbosity'] >= 2:
+            for table, count in sorted(counts.items()):
+                self.stdout.write(f'  {table}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {rows} rows for {counts["users"]} users in {elapsed:.1f}s '
+            f'({rows / elapsed:.0f} rows/s)'
+        ))
+        self.stdout.write('Run regenerate_predictions and generate_reminders to fill in the derived data.')
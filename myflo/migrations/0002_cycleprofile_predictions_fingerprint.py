@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myflo', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cycleprofile',
+            name='predictions_fingerprint',
+            field=models.CharField(blank=True, editable=False, help_text='Hash of the inputs the active predictions were generated from', max_length=40),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myflo', '0002_cycleprofile_predictions_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['user', 'appointment_date'], name='appointment_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contraceptiveuse',
+            index=models.Index(fields=['user', 'date_taken'], name='contraceptive_user_taken_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cycleinsight',
+            index=models.Index(condition=models.Q(('is_dismissed', False)), fields=['user', 'created_at'], name='insight_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', 'scheduled_date'], name='notification_user_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='notification_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', 'predicted_date'], name='prediction_user_active_idx'),
+        ),
+    ]
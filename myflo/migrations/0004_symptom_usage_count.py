@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:20
+
+from django.db import migrations, models
+
+
+def backfill_usage_count(apps, schema_editor):
+    Symptom = apps.get_model('myflo', 'Symptom')
+    DailySymptom = apps.get_model('myflo', 'DailySymptom')
+    db_alias = schema_editor.connection.alias
+    counts = DailySymptom.objects.using(db_alias).values('symptom').annotate(uses=models.Count('id'))
+    for row in counts:
+        Symptom.objects.using(db_alias).filter(pk=row['symptom']).update(usage_count=row['uses'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myflo', '0003_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='symptom',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of daily logs recording this symptom, maintained on write'),
+        ),
+        migrations.RunPython(backfill_usage_count, migrations.RunPython.noop),
+    ]
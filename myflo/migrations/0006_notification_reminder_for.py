@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myflo', '0005_notification_dispatch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='reminder_for',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('reminder_for__isnull', False)), fields=('user', 'notification_type', 'reminder_for'), name='notification_unique_reminder'),
+        ),
+    ]
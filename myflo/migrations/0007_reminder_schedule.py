@@ -0,0 +1,97 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:34
+
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Frozen copies of the myflo.reminder_schedule helpers as of this
+# migration, so later changes to that module can't change what it does
+
+def parse_reminder_time(value):
+    if isinstance(value, time):
+        return value
+    try:
+        return time.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def wanted_reminder_times(daily_log_reminder_time, pill_reminder_times, notifications_enabled=True):
+    if notifications_enabled is False:
+        return set()
+    wanted = set()
+    if daily_log_reminder_time:
+        wanted.add(('log_reminder', daily_log_reminder_time))
+    if isinstance(pill_reminder_times, list):
+        for value in pill_reminder_times:
+            local_time = parse_reminder_time(value)
+            if local_time is not None:
+                wanted.add(('pill_reminder', local_time))
+    return wanted
+
+
+def next_fire_time(local_time, zone_name, after):
+    try:
+        zone = ZoneInfo(zone_name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        zone = ZoneInfo('UTC')
+    local_day = after.astimezone(zone).date()
+    fire_at = datetime.combine(local_day, local_time, tzinfo=zone)
+    if fire_at <= after:
+        fire_at = datetime.combine(local_day + timedelta(days=1), local_time, tzinfo=zone)
+    return fire_at
+
+
+def backfill_reminder_schedule(apps, schema_editor):
+    Settings = apps.get_model('myflo', 'Settings')
+    UserProfile = apps.get_model('myflo', 'UserProfile')
+    ReminderSchedule = apps.get_model('myflo', 'ReminderSchedule')
+    db_alias = schema_editor.connection.alias
+    now = timezone.now()
+    profiles = {
+        user_id: (zone_name, enabled) for user_id, zone_name, enabled in
+        UserProfile.objects.using(db_alias).values_list('user_id', 'timezone', 'notifications_enabled')
+    }
+    rows = []
+    for user_id, log_time, pill_times in Settings.objects.using(db_alias).values_list(
+        'user_id', 'daily_log_reminder_time', 'pill_reminder_times'
+    ).iterator():
+        zone_name, enabled = profiles.get(user_id, ('UTC', True))
+        for kind, local_time in wanted_reminder_times(log_time, pill_times, enabled):
+            rows.append(ReminderSchedule(
+                user_id=user_id, kind=kind, local_time=local_time, timezone=zone_name,
+                next_fire_at=next_fire_time(local_time, zone_name, now)
+            ))
+    ReminderSchedule.objects.using(db_alias).bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myflo', '0006_notification_reminder_for'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('log_reminder', 'Daily Log Reminder'), ('pill_reminder', 'Pill Reminder')], max_length=20)),
+                ('local_time', models.TimeField(help_text="Wall-clock time in the user's timezone")),
+                ('timezone', models.CharField(default='UTC', max_length=50)),
+                ('next_fire_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_fire_at'], name='reminder_next_fire_idx')],
+                'unique_together': {('user', 'kind', 'local_time')},
+            },
+        ),
+        migrations.RunPython(backfill_reminder_schedule, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myflo', '0007_reminder_schedule'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dailylog',
+            index=models.Index(fields=['user', 'updated_at'], name='dailylog_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='period',
+            index=models.Index(fields=['user', 'updated_at'], name='period_user_updated_idx'),
+        ),
+    ]
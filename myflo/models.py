@@ -45,6 +45,10 @@ class CycleProfile(models.Model):
     last_updated = models.DateTimeField(auto_now=True)
     is_irregular = models.BooleanField(default=False)
     notes = models.TextField(blank=True)
+    predictions_fingerprint = models.CharField(
+        max_length=40, blank=True, editable=False,
+        help_text="Hash of the inputs the active predictions were generated from"
+    )
 
     def __str__(self):
         return f"{self.user.username}'s Cycle Profile"
@@ -73,6 +77,9 @@ class Period(models.Model):
     class Meta:
         ordering = ['-start_date']
         unique_together = ['user', 'start_date']
+        indexes = [
+            models.Index(fields=['user', 'updated_at'], name='period_user_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - Period starting {self.start_date}"
@@ -133,6 +140,9 @@ class DailyLog(models.Model):
     class Meta:
         unique_together = ['user', 'date']
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['user', 'updated_at'], name='dailylog_user_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.date}"
@@ -152,6 +162,10 @@ class Symptom(models.Model):
         ]
     )
     description = models.TextField(blank=True)
+    usage_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        help_text="Number of daily logs recording this symptom, maintained on write"
+    )
 
     def __str__(self):
         return self.name
@@ -225,6 +239,9 @@ class ContraceptiveUse(models.Model):
 
     class Meta:
         ordering = ['-date_taken']
+        indexes = [
+            models.Index(fields=['user', 'date_taken'], name='contraceptive_user_taken_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.contraceptive_type.name} on {self.date_taken.date()}"
@@ -253,10 +270,18 @@ class Prediction(models.Model):
         default='medium'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
     class Meta:
         ordering = ['predicted_date']
+        indexes = [
+            models.Index(
+                fields=['user', 'predicted_date'], condition=models.Q(is_active=True),
+                name='prediction_user_active_idx'
+            ),
+            models.Index(fields=['user', 'updated_at'], name='prediction_user_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.prediction_type} on {self.predicted_date}"
@@ -282,9 +307,41 @@ class Notification(models.Model):
     is_sent = models.BooleanField(default=False)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Moves whenever a field clients sync changes; bulk updates set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Predicted date a generated period or ovulation reminder is about
+    reminder_for = models.DateField(null=True, blank=True, editable=False)
+
+    # Dispatch bookkeeping: the worker batch holding the row and until when.
+    # After a failed attempt claimed_until holds the earliest retry time.
+    claimed_by = models.CharField(max_length=64, blank=True, editable=False)
+    claimed_until = models.DateTimeField(null=True, blank=True, editable=False)
+    delivery_attempts = models.PositiveSmallIntegerField(default=0, editable=False)
+    last_error = models.TextField(blank=True, editable=False)
 
     class Meta:
         ordering = ['-scheduled_date']
+        indexes = [
+            models.Index(
+                fields=['scheduled_date'], condition=models.Q(is_sent=False),
+                name='notification_unsent_due_idx'
+            ),
+            models.Index(
+                fields=['user', 'scheduled_date'], condition=models.Q(is_read=False),
+                name='notification_user_unread_idx'
+            ),
+            models.Index(fields=['user', 'created_at', 'id'], name='notification_user_created_idx'),
+            models.Index(fields=['user', 'updated_at'], name='notification_user_updated_idx'),
+        ]
+        constraints = [
+            # One generated reminder per user, kind and predicted date
+            models.UniqueConstraint(
+                fields=['user', 'notification_type', 'reminder_for'],
+                condition=models.Q(reminder_for__isnull=False),
+                name='notification_unique_reminder'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
@@ -326,9 +383,13 @@ class Appointment(models.Model):
     notes = models.TextField(blank=True)
     is_completed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['appointment_date']
+        indexes = [
+            models.Index(fields=['user', 'appointment_date'], name='appointment_user_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.appointment_type} on {self.appointment_date.date()}"
@@ -357,6 +418,12 @@ class CycleInsight(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['user', 'created_at'], condition=models.Q(is_dismissed=False),
+                name='insight_user_active_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
@@ -396,4 +463,61 @@ class Settings(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.user.username}'s Settings"
\ No newline at end of file
+        return f"{self.user.username}'s Settings"
+
+
+class ReminderSchedule(models.Model):
+    """
+    Next firing of a user's recurring daily-log or pill reminder.
+
+    Rows are derived from Settings and UserProfile.timezone and kept in
+    sync on save, so the scheduler finds due reminders with a range scan
+    on next_fire_at instead of parsing every user's settings.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(
+        max_length=20,
+        choices=[
+            ('log_reminder', 'Daily Log Reminder'),
+            ('pill_reminder', 'Pill Reminder')
+        ]
+    )
+    local_time = models.TimeField(help_text="Wall-clock time in the user's timezone")
+    timezone = models.CharField(max_length=50, default='UTC')
+    next_fire_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['user', 'kind', 'local_time']
+        indexes = [
+            models.Index(fields=['next_fire_at'], name='reminder_next_fire_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.get_kind_display()} at {self.local_time}"
+
+
+class SyncTombstone(models.Model):
+    """A deleted row, kept so sync clients learn about the deletion"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    resource = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.resource} {self.object_id} deleted"
+
+
+class ShardAssignment(models.Model):
+    """The database holding a user's rows, when sharding is on (see myflo.sharding)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='shard_assignment')
+    shard = models.CharField(max_length=50)
+    assigned_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} on {self.shard}"
@@ -0,0 +1,166 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+
+from .async_queries import alist, gather_queries
+
+
+class KeysetPage:
+    """
+    One page of rows, newest first, positioned by the key of its first or
+    last row instead of an offset.
+
+    Iterates like a Paginator page. next_cursor/previous_cursor go in the
+    URL as ?after= and ?before=; count is only filled in when asked for,
+    since it is the one query whose cost grows with the history.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor, count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def encode_cursor(values):
+    # Dates and datetimes at full precision; a rounded key would skip rows
+    text = json.dumps(values, default=lambda value: value.isoformat(), separators=(',', ':'))
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+
+def decode_cursor(queryset, keys, cursor):
+    """Key values saved in a cursor, or None if it doesn't parse"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            return None
+        return [
+            queryset.model._meta.get_field(key).to_python(value)
+            for key, value in zip(keys, values)
+        ]
+    except (ValueError, ValidationError):
+        return None
+
+
+def row_key(row, keys):
+    return [getattr(row, key) for key in keys]
+
+
+def beyond(queryset, keys, values, older):
+    """
+    Rows strictly older (or newer) than the key values. The leading key
+    is a range on the (user, key...) index and ties are excluded on the
+    rest, so the database seeks instead of skipping an offset.
+    """
+    first, rest = keys[0], keys[1:]
+    if older:
+        rows = queryset.filter(**{f'{first}__lte' if rest else f'{first}__lt': values[0]})
+        if rest:
+            rows = rows.exclude(**{first: values[0], f'{rest[0]}__gte': values[1]})
+    else:
+        rows = queryset.filter(**{f'{first}__gte' if rest else f'{first}__gt': values[0]})
+        if rest:
+            rows = rows.exclude(**{first: values[0], f'{rest[0]}__lte': values[1]})
+    return rows
+
+
+def requested_cursors(queryset, keys, request):
+    """(before, after) key values of the request's cursor; both None on the first page"""
+    before = request.GET.get('before')
+    before = before and decode_cursor(queryset, keys, before)
+    if before:
+        return before, None
+    after = request.GET.get('after')
+    return None, after and decode_cursor(queryset, keys, after)
+
+
+def newer_rows(queryset, keys, values, per_page):
+    return beyond(queryset, keys, values, older=False).order_by(*keys)[:per_page + 1]
+
+
+def older_rows(queryset, keys, values, per_page):
+    rows = beyond(queryset, keys, values, older=True) if values else queryset
+    return rows.order_by(*[f'-{key}' for key in keys])[:per_page + 1]
+
+
+def newer_page(rows, keys, per_page, total):
+    """The page of rows read by newer_rows; None when it reaches the first page"""
+    if len(rows) <= per_page:
+        return None
+    rows = rows[:per_page][::-1]
+    return KeysetPage(
+        rows, encode_cursor(row_key(rows[-1], keys)), encode_cursor(row_key(rows[0], keys)), total
+    )
+
+
+def older_page(rows, keys, values, per_page, total):
+    """The page of rows read by older_rows after the key values"""
+    next_cursor = encode_cursor(row_key(rows[per_page - 1], keys)) if len(rows) > per_page else None
+    rows = rows[:per_page]
+    previous_cursor = None
+    if values:
+        previous_cursor = encode_cursor(row_key(rows[0], keys) if rows else values)
+    return KeysetPage(rows, next_cursor, previous_cursor, total)
+
+
+def keyset_page(queryset, keys, request, per_page, count=None):
+    """
+    The page of queryset, ordered by keys descending, that the request's
+    ?after= / ?before= cursor points at; the first page without one.
+
+    keys must identify a row within the queryset, e.g. ['date'] for a
+    user's daily logs or ['created_at', 'id'] for their notifications, and
+    an index on them must lead with the filtered user. ?count=1 (or
+    count=True) adds the total. A cursor that doesn't parse shows the
+    first page, like Paginator.get_page does for a bad page number.
+    """
+    if count is None:
+        count = request.GET.get('count') == '1'
+    total = queryset.count() if count else None
+    before, after = requested_cursors(queryset, keys, request)
+    if before:
+        page = newer_page(list(newer_rows(queryset, keys, before, per_page)), keys, per_page, total)
+        if page:
+            return page
+        # Back at the start: show a full first page
+    return older_page(list(older_rows(queryset, keys, after, per_page)), keys, after, per_page, total)
+
+
+async def akeyset_page(queryset, keys, request, per_page, count=None):
+    """keyset_page for async views; the count and the page are read together"""
+    if count is None:
+        count = request.GET.get('count') == '1'
+    before, after = requested_cursors(queryset, keys, request)
+    if before:
+        queries = {'rows': newer_rows(queryset, keys, before, per_page)}
+    else:
+        queries = {'rows': older_rows(queryset, keys, after, per_page)}
+    if count:
+        queries['total'] = queryset.acount()
+    results = await gather_queries(**queries)
+    total = results.get('total')
+    if before:
+        page = newer_page(results['rows'], keys, per_page, total)
+        if page:
+            return page
+        results['rows'] = await alist(older_rows(queryset, keys, None, per_page))
+    return older_page(results['rows'], keys, after, per_page, total)
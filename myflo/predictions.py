@@ -0,0 +1,301 @@
+import hashlib
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .calendar_grid import invalidate_calendar
+from .dashboard import invalidate_dashboard
+from .models import CycleProfile, Period, ContraceptiveUse, Prediction
+from .sharding import shard_for_user, write_database
+
+
+# Prediction rules shared by the per-user generate_predictions and the
+# population-wide regenerate_predictions command. Bump RULES_VERSION when
+# they change so stored fingerprints stop matching.
+RULES_VERSION = 2
+RECENT_PERIODS = 3
+DEFAULT_CYCLE_LENGTH = 28
+OVULATION_LEAD_DAYS = 14
+FERTILE_WINDOW_LEAD_DAYS = 5
+
+
+def next_period_confidence(period_count, delay_days=0):
+    if delay_days:
+        return 'low'
+    return 'medium' if period_count >= RECENT_PERIODS else 'low'
+
+
+def prediction_dates(last_start, cycle_length, delay_days=0):
+    """
+    Next period, ovulation and fertile window start for one user. An
+    emergency contraception delay only pushes back the next period.
+    """
+    next_period_date = last_start + timedelta(days=cycle_length)
+    ovulation_date = next_period_date - timedelta(days=OVULATION_LEAD_DAYS)
+    fertile_start = ovulation_date - timedelta(days=FERTILE_WINDOW_LEAD_DAYS)
+    return next_period_date + timedelta(days=delay_days), ovulation_date, fertile_start
+
+
+def group_last_starts(user_ids, start_dates):
+    """
+    Collapse parallel arrays of Period rows, sorted by user id, into the
+    distinct user ids, each user's period count and last start date.
+    """
+    import numpy as np
+
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    start_dates = np.asarray(start_dates, dtype='datetime64[D]')
+    if not len(user_ids):
+        return user_ids, user_ids.copy(), start_dates
+
+    # Boundaries of each user's run in the sorted arrays
+    boundaries = np.flatnonzero(np.diff(user_ids)) + 1
+    offsets = np.concatenate(([0], boundaries))
+    counts = np.diff(np.append(offsets, len(user_ids)))
+    last_starts = np.maximum.reduceat(start_dates.astype(np.int64), offsets)
+    return user_ids[offsets], counts, last_starts.astype('datetime64[D]')
+
+
+def prediction_arrays(last_starts, cycle_lengths, delays):
+    """
+    Vectorized prediction_dates() over many users at once: next-period,
+    ovulation and fertile-window dates as datetime64[D] arrays.
+    """
+    import numpy as np
+
+    next_period = last_starts + np.asarray(cycle_lengths, dtype=np.int64).astype('timedelta64[D]')
+    ovulation = next_period - np.timedelta64(OVULATION_LEAD_DAYS, 'D')
+    fertile = ovulation - np.timedelta64(FERTILE_WINDOW_LEAD_DAYS, 'D')
+    delayed = next_period + np.asarray(delays, dtype=np.int64).astype('timedelta64[D]')
+    return delayed, ovulation, fertile
+
+
+def regenerate_prediction_chunk(first_user_id, last_user_id):
+    """
+    Recompute active predictions for every user with periods whose id is in
+    [first_user_id, last_user_id]. Runs in a worker process of the
+    regenerate_predictions command.
+
+    Like generate_predictions, users whose inputs match their stored
+    fingerprint are skipped and the rest get only the rows that differ.
+    Returns the number of users processed and of those whose predictions
+    changed.
+    """
+    import numpy as np
+
+    rows = Period.objects.filter(
+        user_id__gte=first_user_id, user_id__lte=last_user_id
+    ).order_by('user_id', '-start_date').values_list('user_id', 'start_date')
+    user_ids, start_dates = [], []
+    recent_starts = {}
+    for user_id, start_date in rows.iterator(chunk_size=10000):
+        user_ids.append(user_id)
+        start_dates.append(start_date)
+        recent = recent_starts.setdefault(user_id, [])
+        if len(recent) < RECENT_PERIODS:
+            recent.append(start_date)
+    if not user_ids:
+        return 0, 0
+
+    distinct_ids, counts, last_starts = group_last_starts(user_ids, start_dates)
+    distinct_ids = distinct_ids.tolist()
+    last_start_by_user = dict(zip(distinct_ids, last_starts.tolist()))
+
+    profiles = {
+        user_id: (pk, cycle_length, fingerprint)
+        for user_id, pk, cycle_length, fingerprint in CycleProfile.objects.filter(
+            user_id__gte=first_user_id, user_id__lte=last_user_id
+        ).values_list('user_id', 'pk', 'average_cycle_length', 'predictions_fingerprint')
+    }
+    cycle_length_by_user = {
+        user_id: profiles[user_id][1] if user_id in profiles else DEFAULT_CYCLE_LENGTH
+        for user_id in distinct_ids
+    }
+
+    # Emergency contraception only delays the period after the latest start
+    delay_by_user = {}
+    emergency_uses = ContraceptiveUse.objects.filter(
+        user_id__gte=first_user_id, user_id__lte=last_user_id,
+        reason='emergency',
+        contraceptive_type__typical_cycle_delay_days__isnull=False,
+    ).values_list('user_id', 'date_taken', 'contraceptive_type__typical_cycle_delay_days')
+    for user_id, date_taken, delay_days in emergency_uses:
+        last_start = last_start_by_user.get(user_id)
+        if last_start and timezone.localtime(date_taken).date() >= last_start:
+            delay_by_user[user_id] = max(delay_by_user.get(user_id, 0), delay_days)
+
+    cycle_lengths = np.array(
+        [cycle_length_by_user[user_id] for user_id in distinct_ids], dtype=np.int64
+    )
+    delays = np.array(
+        [delay_by_user.get(user_id, 0) for user_id in distinct_ids], dtype=np.int64
+    )
+    next_period, ovulation, fertile = prediction_arrays(last_starts, cycle_lengths, delays)
+
+    wanted, fingerprints = {}, {}
+    for user_id, count, delay_days, next_date, ovulation_date, fertile_start in zip(
+        distinct_ids, counts.tolist(), delays.tolist(), next_period.tolist(),
+        ovulation.tolist(), fertile.tolist()
+    ):
+        fingerprint = predictions_fingerprint(
+            recent_starts[user_id], cycle_length_by_user[user_id], delay_days
+        )
+        if user_id in profiles and profiles[user_id][2] == fingerprint:
+            continue
+        fingerprints[user_id] = fingerprint
+        wanted[user_id] = {
+            'next_period': (next_date, next_period_confidence(count, delay_days)),
+            'ovulation': (ovulation_date, 'medium'),
+            'fertile_window': (fertile_start, 'medium'),
+        }
+    if not wanted:
+        return len(distinct_ids), 0
+
+    with transaction.atomic(using=write_database()):
+        to_create, to_update, to_deactivate, deactivated_users = prediction_changes(
+            Prediction.objects.filter(user_id__in=wanted, is_active=True), wanted
+        )
+        write_prediction_changes(to_create, to_update, to_deactivate)
+        CycleProfile.objects.bulk_update([
+            CycleProfile(pk=profiles[user_id][0], predictions_fingerprint=fingerprint)
+            for user_id, fingerprint in fingerprints.items() if user_id in profiles
+        ], ['predictions_fingerprint'])
+
+    changed_users = {
+        prediction.user_id for prediction in to_create + to_update
+    }.union(deactivated_users)
+    for user_id in changed_users:
+        invalidate_calendar(user_id)
+        invalidate_dashboard(user_id)
+    return len(distinct_ids), len(changed_users)
+
+
+def emergency_delay_days(user, last_start):
+    """
+    Longest typical delay of emergency contraception taken since the last
+    period started; doses do not stack, so the maximum applies.
+    """
+    delays = ContraceptiveUse.objects.filter(
+        user=user,
+        reason='emergency',
+        date_taken__date__gte=last_start,
+        contraceptive_type__typical_cycle_delay_days__isnull=False,
+    ).values_list('contraceptive_type__typical_cycle_delay_days', flat=True)
+    return max(delays, default=0)
+
+
+def predictions_fingerprint(start_dates, cycle_length, delay_days):
+    """Hash of everything the active predictions are derived from"""
+    inputs = '|'.join([
+        str(RULES_VERSION),
+        ','.join(start_date.isoformat() for start_date in start_dates),
+        str(cycle_length),
+        str(delay_days),
+    ])
+    return hashlib.sha1(inputs.encode()).hexdigest()
+
+
+def prediction_changes(active, wanted):
+    """
+    Diff active predictions against wanted, a mapping of user id to
+    {prediction_type: (predicted_date, confidence_level)}, for those users.
+    Returns (to_create, to_update, to_deactivate ids, user ids deactivated).
+    """
+    now = timezone.now()
+    wanted = {user_id: dict(targets) for user_id, targets in wanted.items()}
+    to_update, to_deactivate, deactivated_users = [], [], []
+    for prediction in active:
+        target = wanted[prediction.user_id].pop(prediction.prediction_type, None)
+        if target is None:
+            to_deactivate.append(prediction.pk)
+            deactivated_users.append(prediction.user_id)
+            continue
+        if (prediction.predicted_date, prediction.confidence_level) != target:
+            prediction.predicted_date, prediction.confidence_level = target
+            # bulk_update doesn't apply auto_now
+            prediction.updated_at = now
+            to_update.append(prediction)
+    to_create = [
+        Prediction(user_id=user_id, prediction_type=prediction_type,
+                   predicted_date=predicted_date, confidence_level=confidence_level)
+        for user_id, targets in wanted.items()
+        for prediction_type, (predicted_date, confidence_level) in targets.items()
+    ]
+    return to_create, to_update, to_deactivate, deactivated_users
+
+
+def write_prediction_changes(to_create, to_update, to_deactivate):
+    """Apply a prediction_changes() diff; returns the number of rows written"""
+    if to_deactivate:
+        Prediction.objects.filter(pk__in=to_deactivate).update(
+            is_active=False, updated_at=timezone.now()
+        )
+    if to_update:
+        Prediction.objects.bulk_update(
+            to_update, ['predicted_date', 'confidence_level', 'updated_at']
+        )
+    if to_create:
+        Prediction.objects.bulk_create(to_create)
+    return len(to_deactivate) + len(to_update) + len(to_create)
+
+
+def apply_predictions(user, wanted):
+    """
+    Bring a user's active predictions in line with wanted, a mapping of
+    prediction_type to (predicted_date, confidence_level), touching only
+    rows that differ. Returns the number of rows written.
+    """
+    to_create, to_update, to_deactivate, _ = prediction_changes(
+        Prediction.objects.filter(user=user, is_active=True), {user.pk: wanted}
+    )
+    return write_prediction_changes(to_create, to_update, to_deactivate)
+
+
+def generate_predictions(user):
+    """
+    Generate cycle predictions based on user's cycle history.
+
+    Skips all writes when the inputs match the fingerprint stored with the
+    current predictions; otherwise applies the minimal diff in one
+    transaction. Returns the number of prediction rows touched.
+    """
+    cycle_profile = user.cycleprofile
+    start_dates = list(
+        Period.objects.filter(user=user)
+        .order_by('-start_date')
+        .values_list('start_date', flat=True)[:RECENT_PERIODS]
+    )
+    # Without history there is nothing to predict from; existing
+    # predictions are left as they are
+    if not start_dates:
+        return 0
+    avg_cycle_length = cycle_profile.average_cycle_length
+    delay_days = emergency_delay_days(user, start_dates[0])
+
+    fingerprint = predictions_fingerprint(start_dates, avg_cycle_length, delay_days)
+    if fingerprint == cycle_profile.predictions_fingerprint:
+        return 0
+
+    # Next period (pushed back by any emergency contraception delay),
+    # ovulation (typically 14 days before the undelayed next period) and
+    # the start of the fertile window (5 days before ovulation)
+    next_period_date, ovulation_date, fertile_start = prediction_dates(
+        start_dates[0], avg_cycle_length, delay_days
+    )
+    wanted = {
+        'next_period': (next_period_date, next_period_confidence(len(start_dates), delay_days)),
+        'ovulation': (ovulation_date, 'medium'),
+        'fertile_window': (fertile_start, 'medium'),
+    }
+
+    with transaction.atomic(using=shard_for_user(user.pk)):
+        touched = apply_predictions(user, wanted)
+        cycle_profile.predictions_fingerprint = fingerprint
+        cycle_profile.save(update_fields=['predictions_fingerprint'])
+
+    # Bulk writes send no signals, so drop the cached views here
+    if touched:
+        invalidate_calendar(user.id)
+        invalidate_dashboard(user.id)
+    return touched
@@ -0,0 +1,136 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard
+from .models import Notification, ReminderSchedule, Settings, UserProfile
+from .reminders import user_zone
+from .sharding import use_user_shard, write_database
+
+
+REMINDER_MESSAGES = {
+    'log_reminder': (
+        'Time to log your day',
+        'Take a moment to record your flow, mood and symptoms for today.'
+    ),
+    'pill_reminder': ('Pill reminder', "It's time to take your pill."),
+}
+
+FIRE_BATCH_SIZE = 1000
+
+
+def parse_reminder_time(value):
+    """A pill_reminder_times entry ('HH:MM' or 'HH:MM:SS') as a time, or None"""
+    if isinstance(value, time):
+        return value
+    try:
+        return time.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def wanted_reminder_times(daily_log_reminder_time, pill_reminder_times, notifications_enabled=True):
+    """{(kind, local_time)} that a user's settings ask to be reminded at"""
+    if notifications_enabled is False:
+        return set()
+    wanted = set()
+    if daily_log_reminder_time:
+        wanted.add(('log_reminder', daily_log_reminder_time))
+    if isinstance(pill_reminder_times, list):
+        for value in pill_reminder_times:
+            local_time = parse_reminder_time(value)
+            if local_time is not None:
+                wanted.add(('pill_reminder', local_time))
+    return wanted
+
+
+def next_fire_time(local_time, zone_name, after):
+    """First instant strictly after `after` at which local_time occurs in zone_name"""
+    zone = user_zone(zone_name)
+    local_day = after.astimezone(zone).date()
+    fire_at = datetime.combine(local_day, local_time, tzinfo=zone)
+    if fire_at <= after:
+        fire_at = datetime.combine(local_day + timedelta(days=1), local_time, tzinfo=zone)
+    return fire_at
+
+
+def sync_reminder_schedule(user_id, now=None):
+    """
+    Make a user's ReminderSchedule rows match their Settings and timezone.
+
+    Rows for unchanged times keep their next_fire_at, so saving settings
+    neither skips nor repeats a pending reminder; a timezone change
+    recomputes every row.
+    """
+    now = now or timezone.now()
+    with use_user_shard(user_id):
+        settings = Settings.objects.filter(user_id=user_id).values_list(
+            'daily_log_reminder_time', 'pill_reminder_times'
+        ).first()
+        zone_name, notifications_enabled = UserProfile.objects.filter(user_id=user_id).values_list(
+            'timezone', 'notifications_enabled'
+        ).first() or ('UTC', True)
+        wanted = wanted_reminder_times(*settings, notifications_enabled) if settings else set()
+
+        with transaction.atomic(using=write_database()):
+            existing = {
+                (row.kind, row.local_time): row
+                for row in ReminderSchedule.objects.filter(user_id=user_id)
+            }
+            stale = [row.pk for key, row in existing.items() if key not in wanted]
+            if stale:
+                ReminderSchedule.objects.filter(pk__in=stale).delete()
+
+            moved = []
+            for key in wanted & existing.keys():
+                row = existing[key]
+                if row.timezone != zone_name:
+                    row.timezone = zone_name
+                    row.next_fire_at = next_fire_time(row.local_time, zone_name, now)
+                    moved.append(row)
+            if moved:
+                ReminderSchedule.objects.bulk_update(moved, ['timezone', 'next_fire_at'])
+
+            ReminderSchedule.objects.bulk_create([
+                ReminderSchedule(
+                    user_id=user_id, kind=kind, local_time=local_time, timezone=zone_name,
+                    next_fire_at=next_fire_time(local_time, zone_name, now)
+                )
+                for kind, local_time in wanted - existing.keys()
+            ])
+
+
+def fire_due_reminders(now=None, batch_size=FIRE_BATCH_SIZE):
+    """
+    Create the Notification of up to batch_size due reminders and advance
+    each to its next occurrence. Due rows come from one range scan of the
+    next_fire_at index. Run a single scheduler at a time.
+
+    Occurrences missed while no scheduler ran are not replayed: a row
+    fires once and moves to its first occurrence after now.
+    Returns the number of reminders fired.
+    """
+    now = now or timezone.now()
+    with transaction.atomic(using=write_database()):
+        due = list(
+            ReminderSchedule.objects.filter(next_fire_at__lte=now).order_by('next_fire_at')[:batch_size]
+        )
+        notifications = []
+        for row in due:
+            title, message = REMINDER_MESSAGES[row.kind]
+            notifications.append(Notification(
+                user_id=row.user_id,
+                notification_type=row.kind,
+                title=title,
+                message=message,
+                scheduled_date=row.next_fire_at,
+            ))
+            row.next_fire_at = next_fire_time(row.local_time, row.timezone, now)
+        Notification.objects.bulk_create(notifications)
+        ReminderSchedule.objects.bulk_update(due, ['next_fire_at'])
+
+    # bulk_create sends no signals
+    for user_id in {row.user_id for row in due}:
+        invalidate_dashboard(user_id)
+    return len(due)
@@ -0,0 +1,140 @@
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.db import transaction
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard
+from .models import Notification, Prediction, Settings
+from .sharding import write_database
+
+
+# Prediction type -> notification type of the reminder generated for it
+REMINDER_TYPES = {
+    'next_period': 'period_reminder',
+    'ovulation': 'ovulation_reminder',
+}
+
+# Reminders go out at this hour of the user's local day
+REMINDER_HOUR = 9
+OVULATION_REMINDER_DAYS = 1
+
+DEFAULT_PERIOD_REMINDER_DAYS = Settings._meta.get_field('period_reminder_days').default
+
+
+@lru_cache(maxsize=None)
+def user_zone(name):
+    """ZoneInfo for a UserProfile.timezone value, UTC if it is unknown"""
+    try:
+        return ZoneInfo(name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo('UTC')
+
+
+def reminder_time(predicted_date, days_before, zone_name):
+    """When to remind about predicted_date, in the user's timezone"""
+    return datetime.combine(
+        predicted_date - timedelta(days=days_before), time(REMINDER_HOUR),
+        tzinfo=user_zone(zone_name)
+    )
+
+
+def reminder_text(notification_type, predicted_date):
+    """(title, message) of a generated reminder"""
+    day = predicted_date.strftime('%B %d')
+    if notification_type == 'period_reminder':
+        return 'Period expected soon', f'Your next period is predicted to start on {day}.'
+    return 'Ovulation approaching', f'Ovulation is predicted around {day}.'
+
+
+def wanted_reminders(first_user_id, last_user_id, now):
+    """
+    {(user_id, notification_type, predicted_date): remind_at} for the users
+    in [first_user_id, last_user_id], from one query joining their active
+    upcoming predictions with their Settings and UserProfile.
+    """
+    rows = Prediction.objects.filter(
+        user_id__gte=first_user_id,
+        user_id__lte=last_user_id,
+        is_active=True,
+        prediction_type__in=REMINDER_TYPES,
+        predicted_date__gte=now.date(),
+    ).values_list(
+        'user_id', 'prediction_type', 'predicted_date',
+        'user__settings__period_reminder_days',
+        'user__settings__ovulation_reminder_enabled',
+        'user__userprofile__notifications_enabled',
+        'user__userprofile__timezone',
+    )
+
+    wanted = {}
+    for (user_id, prediction_type, predicted_date, period_days, ovulation_enabled,
+         notifications_enabled, zone_name) in rows:
+        # Users without a Settings or UserProfile row get the model defaults
+        if notifications_enabled is False:
+            continue
+        if prediction_type == 'next_period':
+            days_before = DEFAULT_PERIOD_REMINDER_DAYS if period_days is None else period_days
+        elif ovulation_enabled is False:
+            continue
+        else:
+            days_before = OVULATION_REMINDER_DAYS
+        # A reminder whose time has passed still goes out if the day hasn't
+        remind_at = max(reminder_time(predicted_date, days_before, zone_name), now)
+        wanted[user_id, REMINDER_TYPES[prediction_type], predicted_date] = remind_at
+    return wanted
+
+
+def generate_reminder_chunk(first_user_id, last_user_id, now=None):
+    """
+    Bring the upcoming period and ovulation reminders of the users in
+    [first_user_id, last_user_id] in line with their active predictions.
+
+    Missing reminders are bulk-created; the unique (user, type,
+    reminder_for) constraint makes concurrent or repeated runs harmless.
+    Unsent reminders for dates no longer predicted, or that the user
+    turned off, are removed. Returns (created, removed).
+    """
+    now = now or timezone.now()
+    wanted = wanted_reminders(first_user_id, last_user_id, now)
+
+    existing = Notification.objects.filter(
+        user_id__gte=first_user_id,
+        user_id__lte=last_user_id,
+        notification_type__in=REMINDER_TYPES.values(),
+        reminder_for__gte=now.date(),
+    ).values_list('id', 'user_id', 'notification_type', 'reminder_for', 'is_sent')
+    existing_keys = set()
+    stale_ids = []
+    for pk, user_id, notification_type, reminder_for, is_sent in existing:
+        key = (user_id, notification_type, reminder_for)
+        existing_keys.add(key)
+        if key not in wanted and not is_sent:
+            stale_ids.append(pk)
+
+    new_reminders = []
+    for key, remind_at in wanted.items():
+        if key in existing_keys:
+            continue
+        user_id, notification_type, predicted_date = key
+        title, message = reminder_text(notification_type, predicted_date)
+        new_reminders.append(Notification(
+            user_id=user_id,
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            scheduled_date=remind_at,
+            reminder_for=predicted_date,
+        ))
+
+    with transaction.atomic(using=write_database()):
+        removed = 0
+        if stale_ids:
+            removed, _ = Notification.objects.filter(pk__in=stale_ids, is_sent=False).delete()
+        Notification.objects.bulk_create(new_reminders, batch_size=1000, ignore_conflicts=True)
+
+    # bulk_create sends no signals; the deletes above invalidate their own users
+    for user_id in {reminder.user_id for reminder in new_reminders}:
+        invalidate_dashboard(user_id)
+    return len(new_reminders), removed
@@ -0,0 +1,284 @@
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.utils import timezone
+
+from . import catalogs
+from .batching import user_id_chunks
+from .models import Period, DailyLog, DailySymptom, Settings
+from .sharding import data_aliases, on_shard, use_shard
+
+
+RESEARCH_FORMAT_VERSION = 1
+RESEARCH_CHUNK_SIZE = 500
+MANIFEST_NAME = 'manifest.json'
+
+# Every date of a user is moved by the same pseudo-random number of days
+# in [-MAX_DATE_SHIFT, MAX_DATE_SHIFT]: intervals within a user's history
+# survive, calendar dates don't.
+MAX_DATE_SHIFT = 30
+
+# Integer columns store missing values as this
+MISSING = -1
+
+PERIOD_COLUMNS = ['user', 'start_date', 'end_date', 'flow_intensity']
+DAILY_LOG_COLUMNS = [
+    'user', 'date', 'flow', 'mood', 'energy_level', 'pain_level', 'sleep_hours',
+    'exercise_minutes', 'water_intake_glasses',
+]
+SYMPTOM_COLUMNS = ['user', 'date', 'symptom', 'severity']
+
+
+def pseudonym_key():
+    """
+    The dedicated pseudonym key. Never SECRET_KEY: user ids are small
+    sequential numbers, so anyone holding the key can hash 1..N and
+    reverse every pseudonym.
+    """
+    key = getattr(settings, 'MYFLO_RESEARCH_PSEUDONYM_KEY', '')
+    if not key or key == settings.SECRET_KEY:
+        raise ImproperlyConfigured(
+            'Set MYFLO_RESEARCH_PSEUDONYM_KEY to a private key of its own before '
+            'exporting research data.'
+        )
+    return key.encode()
+
+
+def pseudonymize(key, user_id):
+    """
+    (pseudonym, date shift) of a user: a keyed hash of the id, so the same
+    user gets the same pseudonym in every run but it can't be reversed or
+    recomputed without the key
+    """
+    digest = hmac.new(key, str(user_id).encode(), hashlib.sha256).digest()
+    shift = int.from_bytes(digest[16:18], 'big') % (2 * MAX_DATE_SHIFT + 1) - MAX_DATE_SHIFT
+    return digest[:16].hex(), timedelta(days=shift)
+
+
+def consenting_users(first_user_id=None, last_user_id=None):
+    # Read through Settings so the query runs on the current shard
+    users = Settings.objects.filter(share_data_for_research=True, user__is_active=True)
+    if first_user_id is not None:
+        users = users.filter(user_id__gte=first_user_id, user_id__lte=last_user_id)
+    return users.order_by('user_id').values_list('user_id', flat=True)
+
+
+def shifted(value, shift):
+    return None if value is None else value + shift
+
+
+def collect_chunk(first_user_id, last_user_id, since, known):
+    """
+    Rows of the consenting users in [first_user_id, last_user_id] as lists
+    of column values. Users whose pseudonym is in `known` only contribute
+    rows updated after `since`; new users contribute their whole history.
+    Free-text notes are never read.
+    """
+    key = pseudonym_key()
+    pseudonyms = {}
+    for user_id in consenting_users(first_user_id, last_user_id):
+        pseudonyms[user_id] = pseudonymize(key, user_id)
+    new_ids = [user_id for user_id, (name, _) in pseudonyms.items() if name not in known]
+    known_ids = [user_id for user_id, (name, _) in pseudonyms.items() if name in known]
+
+    def changed(queryset):
+        # Whole history of new users, rows changed since the last run of the others
+        rows = queryset.filter(user_id__in=new_ids)
+        if known_ids:
+            rows |= queryset.filter(user_id__in=known_ids, updated_at__gt=since)
+        return rows
+
+    periods = {column: [] for column in PERIOD_COLUMNS}
+    for user_id, start_date, end_date, flow_intensity in changed(Period.objects.all()).values_list(
+        'user_id', 'start_date', 'end_date', 'flow_intensity'
+    ).iterator(chunk_size=5000):
+        name, shift = pseudonyms[user_id]
+        periods['user'].append(name)
+        periods['start_date'].append(start_date + shift)
+        periods['end_date'].append(shifted(end_date, shift))
+        periods['flow_intensity'].append(flow_intensity)
+
+    daily_logs = {column: [] for column in DAILY_LOG_COLUMNS}
+    log_dates = {}
+    for row in changed(DailyLog.objects.all()).values_list(
+        'id', 'user_id', 'date', 'flow', 'mood', 'energy_level', 'pain_level',
+        'sleep_hours', 'exercise_minutes', 'water_intake_glasses'
+    ).iterator(chunk_size=5000):
+        daily_log_id, user_id, log_date, *values = row
+        name, shift = pseudonyms[user_id]
+        log_dates[daily_log_id] = (name, log_date + shift)
+        daily_logs['user'].append(name)
+        daily_logs['date'].append(log_date + shift)
+        for column, value in zip(DAILY_LOG_COLUMNS[2:], values):
+            daily_logs[column].append(value)
+
+    # A changed log is exported with its full current set of symptoms
+    symptoms = {column: [] for column in SYMPTOM_COLUMNS}
+    for daily_log_id, symptom_id, severity in DailySymptom.objects.filter(
+        daily_log__in=changed(DailyLog.objects.all())
+    ).values_list('daily_log_id', 'symptom_id', 'severity').iterator(chunk_size=5000):
+        if daily_log_id not in log_dates:
+            # Logged after the daily log query; exported next run
+            continue
+        name, log_date = log_dates[daily_log_id]
+        symptoms['user'].append(name)
+        symptoms['date'].append(log_date)
+        symptoms['symptom'].append(symptom_id)
+        symptoms['severity'].append(severity)
+
+    return {'periods': periods, 'daily_logs': daily_logs, 'symptoms': symptoms}, [
+        name for name, _ in pseudonyms.values()
+    ]
+
+
+def int_column(np, values, dtype):
+    return np.array([MISSING if value is None else value for value in values], dtype=dtype)
+
+
+def to_arrays(np, tables):
+    """{'<table>_<column>': ndarray} for np.savez"""
+    periods, daily_logs, symptoms = tables['periods'], tables['daily_logs'], tables['symptoms']
+    return {
+        'periods_user': np.array(periods['user'], dtype='S32'),
+        'periods_start_date': np.array(periods['start_date'], dtype='datetime64[D]'),
+        'periods_end_date': np.array(periods['end_date'], dtype='datetime64[D]'),
+        'periods_flow_intensity': np.array(periods['flow_intensity'], dtype='U10'),
+        'daily_logs_user': np.array(daily_logs['user'], dtype='S32'),
+        'daily_logs_date': np.array(daily_logs['date'], dtype='datetime64[D]'),
+        'daily_logs_flow': np.array(daily_logs['flow'], dtype='U15'),
+        'daily_logs_mood': np.array(daily_logs['mood'], dtype='U15'),
+        'daily_logs_energy_level': int_column(np, daily_logs['energy_level'], np.int8),
+        'daily_logs_pain_level': int_column(np, daily_logs['pain_level'], np.int8),
+        'daily_logs_sleep_hours': np.array(
+            [np.nan if value is None else float(value) for value in daily_logs['sleep_hours']],
+            dtype=np.float32
+        ),
+        'daily_logs_exercise_minutes': int_column(np, daily_logs['exercise_minutes'], np.int32),
+        'daily_logs_water_intake_glasses': int_column(np, daily_logs['water_intake_glasses'], np.int16),
+        'symptoms_user': np.array(symptoms['user'], dtype='S32'),
+        'symptoms_date': np.array(symptoms['date'], dtype='datetime64[D]'),
+        'symptoms_symptom': np.array(symptoms['symptom'], dtype=np.int32),
+        'symptoms_severity': np.array(symptoms['severity'], dtype=np.int8),
+    }
+
+
+def export_chunk(output_dir, run, first_user_id, last_user_id, since, known):
+    """
+    Write one chunk of users to <output_dir>/part-<run>-<first>-<last>.npz.
+    Returns (file name or None when nothing changed, row counts, pseudonyms).
+    Runs in a worker process, so everything it needs comes in as arguments.
+    """
+    import numpy as np
+
+    tables, names = collect_chunk(first_user_id, last_user_id, since, known)
+    counts = {table: len(columns['user']) for table, columns in tables.items()}
+    if not any(counts.values()):
+        return None, counts, names
+
+    file_name = f'part-{run}-{first_user_id}-{last_user_id}.npz'
+    path = os.path.join(output_dir, file_name)
+    # Written under a temporary name so a crash never leaves half a part
+    with open(path + '.tmp', 'wb') as out:
+        np.savez_compressed(out, **to_arrays(np, tables))
+    os.replace(path + '.tmp', path)
+    return file_name, counts, names
+
+
+def close_inherited_connections():
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+
+
+def read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as out:
+        json.dump(manifest, out, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def export_research_data(output_dir, full=False, chunk_size=RESEARCH_CHUNK_SIZE, workers=1, now=None):
+    """
+    Export the data of users who opted in to research sharing as
+    pseudonymized columnar .npz parts in output_dir.
+
+    Users are split into chunks of chunk_size ids, each written by one of
+    `workers` processes, so memory is bounded by the chunk size. The
+    manifest records the parts, the users already exported and a
+    watermark; the next run writes only rows updated after it, plus the
+    whole history of newly consenting users. Pass full=True to start over.
+    Consumers take the latest row per (user, date). Deleted rows and
+    withdrawn consent are not propagated to earlier parts.
+    """
+    import numpy as np  # noqa: F401 -- fail before any work when NumPy is missing
+    pseudonym_key()
+
+    now = now or timezone.now()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = None if full else read_manifest(output_dir)
+    if manifest is None:
+        manifest = {
+            'format_version': RESEARCH_FORMAT_VERSION,
+            'max_date_shift_days': MAX_DATE_SHIFT,
+            'missing_integer': MISSING,
+            'watermark': None,
+            'users': [],
+            'runs': [],
+        }
+    since = manifest['watermark'] and datetime.fromisoformat(manifest['watermark'])
+    known = frozenset(manifest['users'])
+    run = now.strftime('%Y%m%dT%H%M%S%f')
+
+    # Chunks never span shards; each is read inside its shard's context
+    arguments = []
+    for alias in data_aliases():
+        with use_shard(alias):
+            arguments += [
+                (alias, export_chunk, output_dir, run, first, last, since, known)
+                for first, last in user_id_chunks(consenting_users(), chunk_size)
+            ]
+    if workers > 1 and len(arguments) > 1:
+        close_inherited_connections()
+        # Forked workers inherit the configured Django setup
+        with ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('fork'),
+            initializer=close_inherited_connections
+        ) as pool:
+            results = list(pool.map(on_shard, *zip(*arguments)))
+    else:
+        results = [on_shard(*chunk_arguments) for chunk_arguments in arguments]
+
+    totals = {'periods': 0, 'daily_logs': 0, 'symptoms': 0}
+    parts = []
+    users = set(known)
+    for file_name, counts, names in results:
+        users.update(names)
+        if file_name:
+            parts.append(file_name)
+        for table, count in counts.items():
+            totals[table] += count
+
+    # Rows changed while this run was reading are picked up again next time
+    manifest['watermark'] = now.isoformat()
+    manifest['users'] = sorted(users)
+    manifest['symptoms'] = {str(symptom.pk): symptom.name for symptom in catalogs.symptoms.all()}
+    manifest['runs'].append({
+        'run': run, 'incremental': since is not None, 'parts': parts, 'rows': totals,
+    })
+    write_manifest(output_dir, manifest)
+    return {'run': run, 'chunks': len(arguments), 'parts': parts, 'rows': totals}
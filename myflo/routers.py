@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Alias of the read-only connection (see the database profile in settings)
+READ_DATABASE = 'read'
+
+_read_only = ContextVar('myflo_read_only', default=False)
+
+
+@contextmanager
+def read_only_queries():
+    """Send the reads made inside the block to the read connection"""
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def read_only_view(view):
+    """Serve a view that never writes to the database from the read connection"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            with read_only_queries():
+                return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with read_only_queries():
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReadConnectionRouter:
+    """
+    Routes reads inside read_only_queries() to the READ_DATABASE
+    connection, so read-only pages don't queue behind the connection that
+    writes. Both point at the same SQLite file, so there is no lag.
+
+    Reads stay on the default connection when it has a transaction open,
+    where they must see its uncommitted writes, and when no read
+    connection is configured.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            _read_only.get()
+            and READ_DATABASE in settings.DATABASES
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return READ_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same database file either way
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db != READ_DATABASE
@@ -0,0 +1,562 @@
+"""
+Per-user sharding over several database files.
+
+With settings.MYFLO_SHARDS listing database aliases, every row that
+belongs to a user (periods, logs, predictions, notifications, profiles...)
+lives on one of those shards. Global tables (auth, sessions, admin and
+ShardAssignment) stay on the default database. The catalogs (Symptom,
+ContraceptiveType) are copied to every shard, and each user's auth_user
+row to their shard, so foreign keys and joins stay within one file.
+
+A new user is placed on a shard by a hash of their id and the choice is
+kept in ShardAssignment. Users without one (created before sharding was
+turned on) still live on the default database until rebalance_shards
+moves them.
+
+Querysets carry no user, so the shard for a query comes from the
+instance involved (saves, related lookups) or else from the current
+shard context: shard_middleware opens one for the logged-in user's
+requests, and batch jobs open one per shard with fan_out(). A query on
+per-user data with neither raises ShardNotSelected instead of silently
+reading the empty tables of the default database.
+
+Each shard hands out ids from a range of its own (see SHARD_ID_BITS), so
+the shard of any row can be told from its id.
+"""
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+
+# Ids of shard n (1-based) start at n << SHARD_ID_BITS; the default
+# database keeps the ids below 1 << SHARD_ID_BITS.
+SHARD_ID_BITS = 40
+
+# Models of this app that are not per-user
+GLOBAL_MODELS = {'shardassignment'}
+CATALOG_MODELS = {'symptom', 'contraceptivetype'}
+
+# Field leading from a per-user model to its user
+USER_LOOKUPS = {'dailysymptom': 'daily_log__user'}
+
+# Other processes see a user's new shard once their cached entry expires
+SHARD_MAP_TIMEOUT = 60
+
+MOVE_BATCH_SIZE = 500
+
+_current_shard = ContextVar('myflo_current_shard', default=None)
+
+
+class ShardNotSelected(Exception):
+    """A query on per-user data ran outside any shard context"""
+
+
+def shard_aliases():
+    """Database aliases of the shards; empty when sharding is off"""
+    return list(getattr(settings, 'MYFLO_SHARDS', []))
+
+
+def sharding_enabled():
+    return bool(shard_aliases())
+
+
+def data_aliases():
+    """Every database that may hold per-user rows, the default one first"""
+    return [DEFAULT_DB_ALIAS] + shard_aliases()
+
+
+def is_sharded(model):
+    meta = model._meta
+    return (
+        meta.app_label == 'myflo'
+        and meta.model_name not in GLOBAL_MODELS
+        and meta.model_name not in CATALOG_MODELS
+    )
+
+
+def is_catalog(model):
+    return model._meta.app_label == 'myflo' and model._meta.model_name in CATALOG_MODELS
+
+
+def is_user_model(model):
+    return model._meta.label == settings.AUTH_USER_MODEL
+
+
+def sharded_models():
+    """Per-user models, each after the models it has foreign keys to"""
+    return [model for model in apps.get_app_config('myflo').get_models() if is_sharded(model)]
+
+
+def user_lookup(model):
+    return USER_LOOKUPS.get(model._meta.model_name, 'user')
+
+
+def hash_shard(user_id):
+    """Shard a user is placed on when they sign up"""
+    aliases = shard_aliases()
+    digest = hashlib.md5(str(user_id).encode(), usedforsecurity=False).digest()
+    return aliases[int.from_bytes(digest[:8], 'big') % len(aliases)]
+
+
+def shard_of_id(pk):
+    """Database whose id range pk is in"""
+    index = int(pk) >> SHARD_ID_BITS
+    aliases = shard_aliases()
+    return aliases[index - 1] if 0 < index <= len(aliases) else DEFAULT_DB_ALIAS
+
+
+def shard_map_key(user_id):
+    return f'myflo:shard:{user_id}'
+
+
+def shard_for_user(user_id):
+    """Database holding a user's rows"""
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    key = shard_map_key(user_id)
+    alias = cache.get(key)
+    if alias is None:
+        from .models import ShardAssignment
+        alias = ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(
+            user_id=user_id
+        ).values_list('shard', flat=True).first() or DEFAULT_DB_ALIAS
+        cache.set(key, alias, SHARD_MAP_TIMEOUT)
+    return alias
+
+
+def assign_shard(user_id, alias):
+    """Point the shard map at alias; the default database needs no entry"""
+    from .models import ShardAssignment
+    assignments = ShardAssignment.objects.using(DEFAULT_DB_ALIAS)
+    if alias == DEFAULT_DB_ALIAS:
+        assignments.filter(user_id=user_id).delete()
+    else:
+        assignments.update_or_create(user_id=user_id, defaults={'shard': alias})
+    cache.set(shard_map_key(user_id), alias, SHARD_MAP_TIMEOUT)
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+def write_database():
+    """Database the per-user writes of the current shard context go to"""
+    return current_shard() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_shard(alias):
+    """Run the queries of the block on one shard"""
+    token = _current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_shard.reset(token)
+
+
+def use_user_shard(user):
+    """use_shard() for the shard of a user (or user id)"""
+    return use_shard(shard_for_user(getattr(user, 'pk', user)))
+
+
+def on_shard(alias, function, *args, **kwargs):
+    """Call function inside use_shard(alias); picklable, for process pools"""
+    with use_shard(alias):
+        return function(*args, **kwargs)
+
+
+def _on_shard_in_thread(alias, function, args, kwargs):
+    try:
+        return on_shard(alias, function, *args, **kwargs)
+    finally:
+        # Threads of the pool open connections of their own
+        connections.close_all()
+
+
+def fan_out(function, *args, aliases=None, workers=1, **kwargs):
+    """
+    Run function(*args, **kwargs) once per database holding per-user rows,
+    each inside its shard context, and return {alias: result}. With
+    workers > 1 the shards are worked on in that many threads.
+    """
+    aliases = data_aliases() if aliases is None else aliases
+    if workers <= 1 or len(aliases) <= 1:
+        return {alias: on_shard(alias, function, *args, **kwargs) for alias in aliases}
+    with ThreadPoolExecutor(min(workers, len(aliases))) as pool:
+        futures = {
+            alias: pool.submit(copy_context().run, _on_shard_in_thread, alias, function, args, kwargs)
+            for alias in aliases
+        }
+        return {alias: future.result() for alias, future in futures.items()}
+
+
+def shard_users(alias):
+    """The users whose rows live on a database"""
+    from django.contrib.auth.models import User
+    users = User.objects.using(DEFAULT_DB_ALIAS)
+    if not sharding_enabled():
+        return users
+    if alias == DEFAULT_DB_ALIAS:
+        return users.filter(shard_assignment__isnull=True)
+    return users.filter(shard_assignment__shard=alias)
+
+
+def instance_shard(instance):
+    """Database of a per-user instance, or of the user it belongs to"""
+    if is_user_model(instance):
+        return shard_for_user(instance.pk) if instance.pk else None
+    if instance._state.db:
+        return instance._state.db
+    user_id = getattr(instance, 'user_id', None)
+    if user_id is not None:
+        return shard_for_user(user_id)
+    daily_log = instance._state.fields_cache.get('daily_log')
+    if daily_log is not None:
+        return instance_shard(daily_log)
+    daily_log_id = getattr(instance, 'daily_log_id', None)
+    if daily_log_id is not None:
+        return shard_of_id(daily_log_id)
+    return None
+
+
+class ShardRouter:
+    """
+    Sends per-user models to their shard, and writes of users and
+    catalogs to the default database (see the module docstring). Does
+    nothing while settings.MYFLO_SHARDS is empty.
+    """
+
+    def db_for_read(self, model, **hints):
+        if sharding_enabled() and is_sharded(model):
+            return self.shard(model, hints)
+        # Users and catalogs are read from the default database, or from
+        # the shard copy when a related lookup starts on a shard
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not sharding_enabled():
+            return None
+        if is_sharded(model):
+            return self.shard(model, hints)
+        # The copies on the shards follow through signals
+        return DEFAULT_DB_ALIAS
+
+    def shard(self, model, hints):
+        instance = hints.get('instance')
+        alias = instance_shard(instance) if instance is not None else None
+        alias = alias or current_shard()
+        if alias is None:
+            raise ShardNotSelected(
+                f'No shard selected for {model._meta.label}; run the query inside '
+                f'use_shard(), use_user_shard() or fan_out().'
+            )
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not sharding_enabled():
+            return None
+        if is_sharded(obj1) and is_sharded(obj2):
+            return obj1._state.db == obj2._state.db
+        # Users and catalogs exist on every database their rows are on
+        return True
+
+
+def shard_for_request(request):
+    user_id = request.session.get(SESSION_KEY)
+    return shard_for_user(user_id) if user_id is not None else None
+
+
+def shard_middleware(get_response):
+    """Open the logged-in user's shard context for the whole request"""
+
+    def in_shard(alias, streaming_content):
+        # Streaming responses are read after the view has returned
+        with use_shard(alias):
+            yield from streaming_content
+
+    async def in_shard_async(alias, streaming_content):
+        with use_shard(alias):
+            async for chunk in streaming_content:
+                yield chunk
+
+    def wrap_streaming(alias, response):
+        if alias is not None and getattr(response, 'streaming', False):
+            if response.is_async:
+                response.streaming_content = in_shard_async(alias, response.streaming_content)
+            else:
+                response.streaming_content = in_shard(alias, response.streaming_content)
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not sharding_enabled():
+                return await get_response(request)
+            alias = await sync_to_async(shard_for_request)(request)
+            with use_shard(alias):
+                return wrap_streaming(alias, await get_response(request))
+        markcoroutinefunction(middleware)
+    else:
+        def middleware(request):
+            if not sharding_enabled():
+                return get_response(request)
+            alias = shard_for_request(request)
+            with use_shard(alias):
+                return wrap_streaming(alias, get_response(request))
+    return middleware
+
+
+shard_middleware.sync_capable = True
+shard_middleware.async_capable = True
+
+
+def copy_to(instance, alias):
+    """Save a copy of instance, same primary key, on another database"""
+    copy = type(instance)(**{
+        field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields
+    })
+    copy.save(using=alias)
+
+
+def replicate_catalog_row(instance):
+    for alias in shard_aliases():
+        copy_to(instance, alias)
+
+
+def remove_catalog_row(instance):
+    for alias in shard_aliases():
+        with use_shard(alias):
+            type(instance)._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def copy_catalogs(alias):
+    """Bring the catalogs of a shard in line with the default database"""
+    for model in apps.get_app_config('myflo').get_models():
+        if is_catalog(model):
+            rows = list(model._base_manager.using(DEFAULT_DB_ALIAS).all())
+            with use_shard(alias):
+                model._base_manager.using(alias).exclude(pk__in=[row.pk for row in rows]).delete()
+            for row in rows:
+                copy_to(row, alias)
+
+
+def replicate_user(user, created=False):
+    """Keep the copy of a user on their shard; new users are placed by hash"""
+    if created:
+        assign_shard(user.pk, hash_shard(user.pk))
+    alias = shard_for_user(user.pk)
+    if alias != DEFAULT_DB_ALIAS:
+        copy_to(user, alias)
+
+
+def place_new_users(users):
+    """replicate_user() for users made with bulk_create, which sends no post_save"""
+    if not sharding_enabled():
+        return
+    from .models import ShardAssignment
+    placements = {user.pk: hash_shard(user.pk) for user in users}
+    ShardAssignment.objects.using(DEFAULT_DB_ALIAS).bulk_create([
+        ShardAssignment(user_id=user_id, shard=alias) for user_id, alias in placements.items()
+    ], batch_size=MOVE_BATCH_SIZE)
+    for alias in shard_aliases():
+        type(users[0])._base_manager.using(alias).bulk_create([
+            type(user)(**{
+                field.attname: getattr(user, field.attname) for field in user._meta.concrete_fields
+            })
+            for user in users if placements[user.pk] == alias
+        ], batch_size=MOVE_BATCH_SIZE)
+    cache.set_many({shard_map_key(user_id): alias for user_id, alias in placements.items()}, SHARD_MAP_TIMEOUT)
+
+
+def remove_user(user):
+    """Delete a user's copy on their shard, and with it all their rows there"""
+    alias = shard_for_user(user.pk)
+    if alias != DEFAULT_DB_ALIAS:
+        with use_shard(alias):
+            type(user)._base_manager.using(alias).filter(pk=user.pk).delete()
+    cache.delete(shard_map_key(user.pk))
+
+
+def seed_id_range(alias):
+    """
+    Start the AUTOINCREMENT sequences of a shard's per-user tables at the
+    shard's id range (SQLite only; other backends need their sequences set
+    the same way)
+    """
+    if alias not in shard_aliases() or connections[alias].vendor != 'sqlite':
+        return
+    start = (shard_aliases().index(alias) + 1) << SHARD_ID_BITS
+    with connections[alias].cursor() as cursor:
+        for model in sharded_models():
+            table = model._meta.db_table
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s '
+                'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                [table, start, table]
+            )
+            cursor.execute(
+                'UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s',
+                [start, table, start]
+            )
+
+
+def copy_user_rows(user_id, source, target, now):
+    """
+    Copy a user's rows to target under new ids from its range, with the
+    foreign keys between them remapped. Returns {model: {old id: new id}}.
+    """
+    from .models import SyncTombstone
+    from .sync import TOMBSTONE_RESOURCES
+
+    id_maps = {}
+    for model in sharded_models():
+        rows = list(
+            model._base_manager.using(source).filter(**{user_lookup(model): user_id}).order_by('pk')
+        )
+        old_ids = [row.pk for row in rows]
+        # bulk_create stamps auto_now_add fields; creation times are kept
+        kept = [
+            field.attname for field in model._meta.concrete_fields
+            if getattr(field, 'auto_now_add', False)
+        ]
+        originals = [[getattr(row, attname) for attname in kept] for row in rows]
+        for row in rows:
+            row.pk = None
+            row._state.adding, row._state.db = True, None
+            for field in model._meta.concrete_fields:
+                if field.is_relation and field.related_model in id_maps:
+                    old_id = getattr(row, field.attname)
+                    if old_id is not None:
+                        setattr(row, field.attname, id_maps[field.related_model][old_id])
+        model._base_manager.using(target).bulk_create(rows, batch_size=MOVE_BATCH_SIZE)
+        if kept and rows:
+            for row, values in zip(rows, originals):
+                for attname, value in zip(kept, values):
+                    setattr(row, attname, value)
+            model._base_manager.using(target).bulk_update(rows, kept, batch_size=MOVE_BATCH_SIZE)
+        id_maps[model] = dict(zip(old_ids, [row.pk for row in rows]))
+
+    # Sync clients drop the old ids and pull the rows again, since
+    # bulk_create moved their updated_at to now
+    SyncTombstone._base_manager.using(target).bulk_create([
+        SyncTombstone(user_id=user_id, resource=resource, object_id=old_id, deleted_at=now)
+        for model, resource in TOMBSTONE_RESOURCES.items()
+        for old_id in id_maps.get(model, {})
+    ], batch_size=MOVE_BATCH_SIZE)
+    return id_maps
+
+
+def delete_rows(alias, ids_by_model):
+    """Delete rows by id, children first and without signals: they were moved, not deleted"""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model, ids in reversed(list(ids_by_model.items())):
+            ids = list(ids)
+            table = connection.ops.quote_name(model._meta.db_table)
+            pk = connection.ops.quote_name(model._meta.pk.column)
+            for start in range(0, len(ids), MOVE_BATCH_SIZE):
+                batch = ids[start:start + MOVE_BATCH_SIZE]
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE {pk} IN ({", ".join(["%s"] * len(batch))})', batch
+                )
+
+
+def move_rows(user_id, source, target):
+    """
+    Move the user's rows that are on source now to target. The source
+    transaction stays open while the copy commits and only the copied
+    rows are deleted, so rows written meanwhile wait for the next call.
+    """
+    now = timezone.now()
+    with transaction.atomic(using=source):
+        with transaction.atomic(using=target):
+            if target != DEFAULT_DB_ALIAS:
+                user = apps.get_model(settings.AUTH_USER_MODEL)._base_manager.using(
+                    DEFAULT_DB_ALIAS
+                ).get(pk=user_id)
+                copy_to(user, target)
+            id_maps = copy_user_rows(user_id, source, target, now)
+        delete_rows(source, id_maps)
+    return {model._meta.model_name: len(ids) for model, ids in id_maps.items() if ids}
+
+
+def invalidate_user_pages(user_id):
+    # Cached pages and bundles hold the old ids
+    from .calendar_grid import invalidate_calendar
+    from .cycle_phases import invalidate_cycle_phases
+    from .cycle_stats import invalidate_cycle_stats
+    from .dashboard import invalidate_dashboard
+
+    invalidate_dashboard(user_id)
+    invalidate_calendar(user_id)
+    invalidate_cycle_stats(user_id)
+    invalidate_cycle_phases(user_id)
+
+
+def start_move(user_id, target):
+    """
+    Move a user's rows to the database target and switch the shard map
+    to it. Returns (previous database, rows moved per model).
+    """
+    if target not in data_aliases():
+        raise ValueError(f'{target!r} is not one of the databases ({", ".join(data_aliases())}).')
+    source = shard_for_user(user_id)
+    if source == target:
+        return source, {}
+    counts = move_rows(user_id, source, target)
+    assign_shard(user_id, target)
+    invalidate_user_pages(user_id)
+    return source, counts
+
+
+def finish_move(user_id, source, target):
+    """
+    Move what was written to source after start_move(), then drop the
+    user's copy there. Returns the rows moved per model.
+    """
+    if source == target:
+        return {}
+    counts = move_rows(user_id, source, target)
+    if source != DEFAULT_DB_ALIAS:
+        delete_rows(source, {apps.get_model(settings.AUTH_USER_MODEL): [user_id]})
+    if counts:
+        invalidate_user_pages(user_id)
+    return counts
+
+
+def move_user(user_id, target, settle=0):
+    """
+    Move all of a user's rows to the database target while the site is up.
+
+    Rows get new ids from the target's range, and sync clients tombstones
+    for the old ones. The shard map is switched once the copy has
+    committed; requests in other processes may write to the old shard
+    until their cached entry expires (SHARD_MAP_TIMEOUT), so after `settle`
+    seconds whatever they wrote is moved as well. Returns the number of
+    rows moved per model.
+    """
+    source, counts = start_move(user_id, target)
+    if settle and source != target:
+        time.sleep(settle)
+    for model_name, count in finish_move(user_id, source, target).items():
+        counts[model_name] = counts.get(model_name, 0) + count
+    return counts
+
+
+def misplaced_users():
+    """(user id, current database, hash shard) of each user not on their hash shard"""
+    from django.contrib.auth.models import User
+    user_ids = User.objects.using(DEFAULT_DB_ALIAS).order_by('pk').values_list('pk', flat=True)
+    for user_id in user_ids.iterator():
+        source, target = shard_for_user(user_id), hash_shard(user_id)
+        if source != target:
+            yield user_id, source, target
@@ -0,0 +1,217 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, post_migrate
+from django.dispatch import receiver
+
+from . import catalogs
+from .calendar_grid import OPEN_PERIOD_MAX_DAYS, invalidate_calendar_months
+from .cycle_phases import invalidate_cycle_phases
+from .cycle_stats import invalidate_cycle_stats
+from .dashboard import invalidate_dashboard
+from .reminder_schedule import sync_reminder_schedule
+from .models import (
+    UserProfile, CycleProfile, Period, DailyLog, Prediction, Notification, CycleInsight,
+    Symptom, DailySymptom, ContraceptiveType, Settings, ReminderSchedule, SyncTombstone
+)
+from .sharding import (
+    copy_catalogs, remove_catalog_row, remove_user, replicate_catalog_row, replicate_user,
+    seed_id_range, shard_aliases, use_shard
+)
+from .symptoms import adjust_symptom_usage, touch_daily_logs
+from .sync import TOMBSTONE_RESOURCES
+
+
+def calendar_range(instance):
+    """Dates on the calendar that a Period, DailyLog or Prediction shows on"""
+    if isinstance(instance, Period):
+        last_day = instance.end_date or (
+            instance.start_date + timedelta(days=OPEN_PERIOD_MAX_DAYS - 1)
+        )
+        return instance.start_date, max(instance.start_date, last_day)
+    if isinstance(instance, DailyLog):
+        return instance.date, instance.date
+    return instance.predicted_date, instance.predicted_date
+
+
+@receiver(pre_save, sender=Period)
+@receiver(pre_save, sender=DailyLog)
+@receiver(pre_save, sender=Prediction)
+def remember_calendar_range(sender, instance, raw=False, using=None, **kwargs):
+    # An edit can move a row out of a month, so the month it used to be in
+    # has to be invalidated as well as the one it lands in.
+    instance._previous_calendar_range = None
+    if raw or instance.pk is None:
+        return
+    previous = sender.objects.using(using).filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._previous_calendar_range = calendar_range(previous)
+
+
+@receiver(post_save, sender=Period)
+@receiver(post_save, sender=DailyLog)
+@receiver(post_save, sender=Prediction)
+@receiver(post_delete, sender=Period)
+@receiver(post_delete, sender=DailyLog)
+@receiver(post_delete, sender=Prediction)
+def invalidate_calendar_fragments(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_calendar_months(instance.user_id, *calendar_range(instance))
+    previous = getattr(instance, '_previous_calendar_range', None)
+    if previous is not None:
+        invalidate_calendar_months(instance.user_id, *previous)
+
+
+@receiver(post_save, sender=Period)
+@receiver(post_save, sender=DailyLog)
+@receiver(post_save, sender=Prediction)
+@receiver(post_save, sender=Notification)
+@receiver(post_save, sender=CycleInsight)
+@receiver(post_delete, sender=Period)
+@receiver(post_delete, sender=DailyLog)
+@receiver(post_delete, sender=Prediction)
+@receiver(post_delete, sender=Notification)
+@receiver(post_delete, sender=CycleInsight)
+def invalidate_dashboard_bundle(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_dashboard(instance.user_id)
+
+
+@receiver(post_save, sender=Period)
+@receiver(post_delete, sender=Period)
+def invalidate_period_statistics(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_cycle_stats(instance.user_id)
+
+
+@receiver(post_save, sender=Period)
+@receiver(post_save, sender=DailyLog)
+@receiver(post_save, sender=CycleProfile)
+@receiver(post_delete, sender=Period)
+@receiver(post_delete, sender=DailyLog)
+@receiver(post_delete, sender=CycleProfile)
+def invalidate_phase_summary(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_cycle_phases(instance.user_id)
+
+
+@receiver(post_save, sender=Symptom)
+@receiver(post_delete, sender=Symptom)
+def invalidate_symptom_catalog(sender, **kwargs):
+    catalogs.symptoms.invalidate()
+
+
+@receiver(post_save, sender=ContraceptiveType)
+@receiver(post_delete, sender=ContraceptiveType)
+def invalidate_contraceptive_type_catalog(sender, **kwargs):
+    catalogs.contraceptive_types.invalidate()
+
+
+@receiver(pre_save, sender=DailySymptom)
+def remember_symptom(sender, instance, using=None, **kwargs):
+    instance._previous_symptom_id = None
+    if instance.pk is not None:
+        instance._previous_symptom_id = sender.objects.using(using).filter(
+            pk=instance.pk
+        ).values_list('symptom_id', flat=True).first()
+
+
+@receiver(post_save, sender=DailySymptom)
+def count_symptom_use(sender, instance, created, **kwargs):
+    invalidate_cycle_phases(instance.daily_log.user_id)
+    touch_daily_logs([instance.daily_log_id])
+    previous = getattr(instance, '_previous_symptom_id', None)
+    if created or previous is None:
+        adjust_symptom_usage({instance.symptom_id: 1})
+    elif previous != instance.symptom_id:
+        adjust_symptom_usage({previous: -1, instance.symptom_id: 1})
+
+
+@receiver(post_delete, sender=DailySymptom)
+def uncount_symptom_use(sender, instance, origin=None, **kwargs):
+    # Bulk deletes of DailySymptom rows adjust the counters themselves, and
+    # a deleted Symptom takes its counter with it.
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model in (DailySymptom, Symptom) and origin is not instance:
+        return
+    # Cascades from a deleted DailyLog are covered by its own signal
+    if origin is instance:
+        invalidate_cycle_phases(instance.daily_log.user_id)
+        touch_daily_logs([instance.daily_log_id])
+    adjust_symptom_usage({instance.symptom_id: -1})
+
+
+@receiver(post_save, sender=Settings)
+@receiver(post_save, sender=UserProfile)
+def update_reminder_schedule(sender, instance, raw=False, **kwargs):
+    # Reminder times and the timezone they are read in live on these two
+    if raw:
+        return
+    sync_reminder_schedule(instance.user_id)
+
+
+@receiver(post_delete, sender=Settings)
+def clear_reminder_schedule(sender, instance, **kwargs):
+    ReminderSchedule.objects.filter(user_id=instance.user_id).delete()
+
+
+@receiver(post_delete, sender=Period)
+@receiver(post_delete, sender=DailyLog)
+@receiver(post_delete, sender=Prediction)
+@receiver(post_delete, sender=Notification)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    # A deleted account takes its tombstones with it
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is User:
+        return
+    SyncTombstone.objects.create(
+        user_id=instance.user_id, resource=TOMBSTONE_RESOURCES[sender], object_id=instance.pk
+    )
+
+
+# Sharding (see myflo.sharding); users and catalogs are written to the
+# default database and copied to the shards from here.
+
+@receiver(post_save, sender=User)
+def replicate_user_to_shard(sender, instance, created, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if raw or using != DEFAULT_DB_ALIAS or not shard_aliases():
+        return
+    replicate_user(instance, created)
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_from_shard(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    if using != DEFAULT_DB_ALIAS or not shard_aliases():
+        return
+    remove_user(instance)
+
+
+@receiver(post_save, sender=Symptom)
+@receiver(post_save, sender=ContraceptiveType)
+def replicate_catalog(sender, instance, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if raw or using != DEFAULT_DB_ALIAS:
+        return
+    replicate_catalog_row(instance)
+
+
+@receiver(post_delete, sender=Symptom)
+@receiver(post_delete, sender=ContraceptiveType)
+def delete_catalog_copies(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    if using != DEFAULT_DB_ALIAS:
+        return
+    remove_catalog_row(instance)
+
+
+@receiver(post_migrate)
+def prepare_shard(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name != 'myflo' or using not in shard_aliases():
+        return
+    seed_id_range(using)
+    with use_shard(using):
+        copy_catalogs(using)
@@ -0,0 +1,129 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, When
+from django.utils import timezone
+
+from . import catalogs
+from .cycle_phases import invalidate_cycle_phases
+from .models import Symptom, DailyLog, DailySymptom
+from .sharding import shard_for_user
+
+
+SEVERITY_LABELS = [
+    (1, '1 - Mild'),
+    (2, '2 - Moderate'),
+    (3, '3 - Noticeable'),
+    (4, '4 - Strong'),
+    (5, '5 - Severe'),
+]
+
+
+def parse_symptom_severities(data):
+    """
+    Read the {symptom_id: severity} selection from a daily log POST.
+
+    Each checked symptom takes its severity from its own severity_<id>
+    field; older forms that post a parallel severities list are paired by
+    position. Symptoms without a valid 1-5 severity are ignored.
+    """
+    symptom_ids = data.getlist('symptoms')
+    severities = data.getlist('severities')
+    selected = {}
+    for index, symptom_id in enumerate(symptom_ids):
+        severity = data.get(f'severity_{symptom_id}')
+        if severity is None and index < len(severities):
+            severity = severities[index]
+        try:
+            symptom_id, severity = int(symptom_id), int(severity)
+        except (TypeError, ValueError):
+            continue
+        if 1 <= severity <= 5:
+            selected[symptom_id] = severity
+    return selected
+
+
+def symptom_severities(daily_log):
+    """{symptom_id: severity} of the symptoms recorded on a daily log"""
+    if daily_log.pk is None:
+        return {}
+    return dict(
+        DailySymptom.objects.filter(daily_log=daily_log).values_list('symptom_id', 'severity')
+    )
+
+
+def adjust_symptom_usage(deltas):
+    """
+    Apply {symptom_id: delta} to Symptom.usage_count in a single UPDATE.
+    Bulk writers of DailySymptom rows call this themselves, since
+    bulk_create and queryset deletes bypass the per-row signals.
+    """
+    deltas = {symptom_id: delta for symptom_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    Symptom.objects.filter(pk__in=deltas).update(usage_count=Case(
+        *[When(pk=symptom_id, then=F('usage_count') + delta)
+          for symptom_id, delta in deltas.items()],
+        default=F('usage_count'),
+        output_field=PositiveIntegerField(),
+    ))
+
+
+def touch_daily_logs(daily_log_ids):
+    """
+    Move updated_at of daily logs whose symptoms changed; sync clients get
+    a log's symptoms with the log, and only fetch logs that moved.
+    """
+    DailyLog.objects.filter(pk__in=daily_log_ids).update(updated_at=timezone.now())
+
+
+def save_daily_symptoms(daily_log, selected):
+    """
+    Make a daily log's symptoms match selected ({symptom_id: severity}).
+
+    Removed symptoms are deleted, changed severities updated and new ones
+    bulk-created, all in one transaction and with a fixed number of
+    queries however many symptoms change. Returns (added, updated, removed).
+    """
+    known_symptoms = catalogs.symptoms.by_id()
+    unknown = set(selected) - set(known_symptoms)
+    if unknown and Symptom.objects.filter(pk__in=unknown).exists():
+        # Added in another process since this copy was loaded
+        catalogs.symptoms.invalidate()
+        known_symptoms = catalogs.symptoms.by_id()
+    selected = {
+        symptom_id: severity for symptom_id, severity in selected.items()
+        if symptom_id in known_symptoms
+    }
+
+    with transaction.atomic(using=shard_for_user(daily_log.user_id)):
+        to_update, to_delete = [], []
+        usage = Counter()
+        for daily_symptom in DailySymptom.objects.filter(daily_log=daily_log).only(
+            'id', 'symptom_id', 'severity'
+        ):
+            severity = selected.pop(daily_symptom.symptom_id, None)
+            if severity is None:
+                to_delete.append(daily_symptom.pk)
+                usage[daily_symptom.symptom_id] -= 1
+            elif severity != daily_symptom.severity:
+                daily_symptom.severity = severity
+                to_update.append(daily_symptom)
+        to_create = [
+            DailySymptom(daily_log=daily_log, symptom_id=symptom_id, severity=severity)
+            for symptom_id, severity in selected.items()
+        ]
+
+        if to_delete:
+            DailySymptom.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            DailySymptom.objects.bulk_update(to_update, ['severity'])
+        if to_create:
+            DailySymptom.objects.bulk_create(to_create)
+        usage.update(selected.keys())
+        adjust_symptom_usage(usage)
+        if to_create or to_update or to_delete:
+            touch_daily_logs([daily_log.pk])
+    if to_create or to_update or to_delete:
+        invalidate_cycle_phases(daily_log.user_id)
+    return len(to_create), len(to_update), len(to_delete)
@@ -0,0 +1,429 @@
+import json
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.forms.models import model_to_dict
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import require_http_methods
+
+from .api import API_VERSION, api_error, api_login_required
+from .forms import PeriodForm, DailyLogForm
+from .models import CycleProfile, Period, DailyLog, DailySymptom, Prediction, Notification, SyncTombstone
+from .predictions import generate_predictions
+from .sharding import shard_for_user
+from .symptoms import save_daily_symptoms
+
+
+SYNC_PAGE_SIZE = 500
+MAX_SYNC_PAGE_SIZE = 2000
+MAX_PUSH_CHANGES = 500
+CURSOR_SALT = 'myflo.sync'
+
+# (resource, model, fields), pulled in this order; tombstones come last
+SYNC_RESOURCES = [
+    ('periods', Period, [
+        'id', 'start_date', 'end_date', 'flow_intensity', 'cycle_day', 'notes',
+        'created_at', 'updated_at',
+    ]),
+    ('daily_logs', DailyLog, [
+        'id', 'date', 'flow', 'mood', 'energy_level', 'pain_level', 'sleep_hours',
+        'exercise_minutes', 'water_intake_glasses', 'notes', 'created_at', 'updated_at',
+    ]),
+    ('predictions', Prediction, [
+        'id', 'prediction_type', 'predicted_date', 'confidence_level', 'is_active',
+        'created_at', 'updated_at',
+    ]),
+    ('notifications', Notification, [
+        'id', 'notification_type', 'title', 'message', 'scheduled_date', 'is_sent',
+        'is_read', 'created_at', 'sent_at', 'updated_at',
+    ]),
+]
+SYNC_MODELS = {resource: model for resource, model, _ in SYNC_RESOURCES}
+SYNC_FIELDS = {resource: fields for resource, _, fields in SYNC_RESOURCES}
+
+# Resource name of each model whose deletions are recorded as tombstones
+TOMBSTONE_RESOURCES = {model: resource for resource, model, _ in SYNC_RESOURCES}
+
+# Fields a client may change on a notification
+NOTIFICATION_PUSH_FIELDS = {'is_read'}
+
+
+def settle_delay():
+    """
+    How far behind the clock a sync page stops. A row's updated_at is set
+    before its transaction commits, so the newest rows may still be
+    invisible; they are picked up by the next sync instead of skipped.
+    """
+    return timedelta(seconds=getattr(settings, 'MYFLO_SYNC_SETTLE_SECONDS', 5))
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'MYFLO_SYNC_TOMBSTONE_DAYS', 90))
+
+
+def encode_cursor(state):
+    return signing.dumps(state, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """The state saved in a cursor; ValueError if it was tampered with"""
+    try:
+        state = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise ValueError('Invalid sync cursor.')
+    return {
+        key: datetime.fromisoformat(value) if key in ('since', 'until', 'after') and value else value
+        for key, value in state.items()
+    }
+
+
+def cursor_state(**state):
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in state.items()
+    }
+
+
+def changed_rows(queryset, field, until, after, after_id, limit):
+    """
+    Up to limit rows with after < (field, id) and field <= until, in
+    (field, id) order. The range is a seek on the (user, field) index,
+    whose entries are ordered by id within equal keys, so there is no sort.
+    """
+    rows = queryset.filter(**{f'{field}__lte': until})
+    if after is not None:
+        rows = rows.filter(**{f'{field}__gte': after})
+        # Rows at exactly `after` were sent already: up to after_id within
+        # a session, all of them when resuming from the previous session
+        seen = {field: after}
+        if after_id is not None:
+            seen['id__lte'] = after_id
+        rows = rows.exclude(**seen)
+    return rows.order_by(field, 'id')[:limit]
+
+
+def with_daily_symptoms(rows):
+    """Embed each daily log's symptoms, for all rows in one query"""
+    by_log = defaultdict(list)
+    for daily_symptom_id, daily_log_id, symptom_id, severity in DailySymptom.objects.filter(
+        daily_log_id__in=[row['id'] for row in rows]
+    ).values_list('id', 'daily_log_id', 'symptom_id', 'severity'):
+        by_log[daily_log_id].append({'id': daily_symptom_id, 'symptom': symptom_id, 'severity': severity})
+    for row in rows:
+        row['symptoms'] = by_log.get(row['id'], [])
+    return rows
+
+
+def pull_changes(user, state, limit, now=None):
+    """
+    One page of a user's changes after the position saved in state.
+
+    A sync session covers the changes in (since, until]; until is fixed
+    when the session starts, so rows changing while a client pages through
+    land in the next session instead of shifting pages. Each resource is
+    paged by (updated_at, id), then tombstones by (deleted_at, id).
+    Returns (changes, deleted, next state, has_more).
+    """
+    now = now or timezone.now()
+    if state.get('until') is None:
+        # A new session starts where the previous one ended
+        state = {
+            'since': state.get('since'), 'until': now - settle_delay(),
+            'table': 0, 'after': state.get('since'), 'after_id': None,
+        }
+    tables = [(resource, model, 'updated_at') for resource, model, _ in SYNC_RESOURCES]
+    tables.append(('deleted', SyncTombstone, 'deleted_at'))
+
+    changes = {resource: [] for resource, _, _ in SYNC_RESOURCES}
+    deleted = []
+    remaining = limit
+    while state['table'] < len(tables) and remaining > 0:
+        resource, model, field = tables[state['table']]
+        queryset = model.objects.filter(user=user)
+        if resource == 'deleted':
+            rows = list(changed_rows(
+                queryset, field, state['until'], state['after'], state['after_id'], remaining
+            ).values('id', 'resource', 'object_id', 'deleted_at'))
+            deleted.extend(
+                {'resource': row['resource'], 'id': row['object_id'], 'deleted_at': row['deleted_at']}
+                for row in rows
+            )
+        else:
+            rows = list(changed_rows(
+                queryset, field, state['until'], state['after'], state['after_id'], remaining
+            ).values(*SYNC_FIELDS[resource]))
+            if resource == 'daily_logs':
+                with_daily_symptoms(rows)
+            changes[resource].extend(rows)
+
+        remaining -= len(rows)
+        if remaining == 0:
+            # This table may have more; resume right after the last row
+            last = rows[-1]
+            state = dict(state, after=last[field], after_id=last['id'])
+        else:
+            state = dict(state, table=state['table'] + 1, after=state['since'], after_id=None)
+
+    if state['table'] >= len(tables):
+        return changes, deleted, {'since': state['until']}, False
+    return changes, deleted, state, True
+
+
+def validate_since(state, now):
+    """Cursors older than the tombstones kept can't see every deletion"""
+    since = state.get('since')
+    return since is None or since >= now - tombstone_retention()
+
+
+class SyncJSONEncoder(DjangoJSONEncoder):
+    """Keeps microseconds, so clients can echo updated_at back exactly"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def same_version(seen, updated_at):
+    # The read API sends timestamps cut to milliseconds
+    return seen in (updated_at, updated_at.replace(microsecond=updated_at.microsecond // 1000 * 1000))
+
+
+class PushError(Exception):
+    """A pushed change that can't be applied; the whole push is rolled back"""
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise PushError(f'updated_at: {value!r} is not an ISO 8601 timestamp')
+
+
+def parse_row_id(value):
+    """The id of a pushed change: None for a new row, else a positive integer"""
+    if value is None:
+        return None
+    # bool is an int too; ids past SQLite's 64-bit integers can't exist
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 < value < 2 ** 63:
+        raise PushError(f'id: {value!r} is not a row id')
+    return value
+
+
+def form_errors(form):
+    return '; '.join(
+        f'{field}: {" ".join(errors)}' if field != '__all__' else ' '.join(errors)
+        for field, errors in form.errors.items()
+    )
+
+
+def current_row(resource, instance):
+    row = SYNC_MODELS[resource].objects.filter(pk=instance.pk).values(*SYNC_FIELDS[resource]).first()
+    if resource == 'daily_logs' and row is not None:
+        with_daily_symptoms([row])
+    return row
+
+
+def apply_period(user, instance, data):
+    # Fields the change leaves out keep their current (or default) value
+    form = PeriodForm({**model_to_dict(instance, PeriodForm._meta.fields), **data}, instance=instance)
+    if not form.is_valid():
+        raise PushError(form_errors(form))
+    clash = Period.objects.filter(user=user, start_date=form.cleaned_data['start_date'])
+    if instance.pk:
+        clash = clash.exclude(pk=instance.pk)
+    if clash.exists():
+        return clash.first()
+    form.save()
+    return None
+
+
+def apply_daily_log(user, instance, data):
+    if instance.pk is None:
+        try:
+            instance.date = date.fromisoformat(str(data.get('date')))
+        except ValueError:
+            raise PushError('date: a YYYY-MM-DD date is required')
+        clash = DailyLog.objects.filter(user=user, date=instance.date).first()
+        if clash is not None:
+            return clash
+    elif 'date' in data and str(data['date']) != instance.date.isoformat():
+        raise PushError("date: a log's date can't change; delete it and push a new one")
+    fields = {key: value for key, value in data.items() if key not in ('date', 'symptoms')}
+    form = DailyLogForm({**model_to_dict(instance, DailyLogForm._meta.fields), **fields}, instance=instance)
+    if not form.is_valid():
+        raise PushError(form_errors(form))
+    daily_log = form.save()
+    if 'symptoms' in data:
+        try:
+            selected = {int(item['symptom']): int(item['severity']) for item in data['symptoms']}
+        except (TypeError, KeyError, ValueError):
+            raise PushError('symptoms: expected a list of {"symptom": id, "severity": 1-5}')
+        if any(not 1 <= severity <= 5 for severity in selected.values()):
+            raise PushError('symptoms: severities go from 1 to 5')
+        save_daily_symptoms(daily_log, selected)
+    return None
+
+
+def apply_notification(user, instance, data):
+    if instance.pk is None:
+        raise PushError('notifications can only be updated')
+    unknown = set(data) - NOTIFICATION_PUSH_FIELDS
+    if unknown:
+        raise PushError(f'notifications: only {", ".join(NOTIFICATION_PUSH_FIELDS)} can change')
+    if 'is_read' in data:
+        instance.is_read = bool(data['is_read'])
+    instance.save()
+    return None
+
+
+PUSH_HANDLERS = {
+    'periods': apply_period,
+    'daily_logs': apply_daily_log,
+    'notifications': apply_notification,
+}
+
+
+def apply_change(user, change):
+    """
+    Apply one pushed change. Returns (applied entry, None) or (None,
+    conflict entry); raises PushError for changes that are invalid.
+
+    A change to an existing row must carry the updated_at the client last
+    saw; if the row moved since, or a new row clashes with an existing
+    one, the server's row is returned as a conflict and nothing is written.
+    """
+    if not isinstance(change, dict):
+        raise PushError('each change must be an object')
+    resource, op = change.get('resource'), change.get('op', 'upsert')
+    if resource not in PUSH_HANDLERS:
+        raise PushError(f'resource must be one of {", ".join(PUSH_HANDLERS)}')
+    if op not in ('upsert', 'delete'):
+        raise PushError('op must be upsert or delete')
+    data = change.get('data') or {}
+    if not isinstance(data, dict):
+        raise PushError('data must be an object')
+    row_id = parse_row_id(change.get('id'))
+    model = SYNC_MODELS[resource]
+    entry = {'ref': change.get('ref'), 'resource': resource}
+
+    instance = model(user=user)
+    if row_id is not None:
+        seen = parse_timestamp(change.get('updated_at'))
+        if seen is None:
+            raise PushError('updated_at is required when changing an existing row')
+        instance = model.objects.select_for_update().filter(user=user, pk=row_id).first()
+        if instance is None:
+            if op == 'delete':
+                return dict(entry, id=row_id, op='delete'), None
+            return None, dict(entry, id=row_id, reason='deleted', current=None)
+        if not same_version(seen, instance.updated_at):
+            return None, dict(entry, id=instance.pk, reason='changed',
+                              current=current_row(resource, instance))
+    elif op == 'delete':
+        raise PushError('id is required to delete a row')
+
+    if op == 'delete':
+        if resource == 'notifications':
+            raise PushError('notifications can only be updated')
+        instance.delete()
+        return dict(entry, id=row_id, op='delete'), None
+
+    clash = PUSH_HANDLERS[resource](user, instance, data)
+    if clash is not None:
+        return None, dict(entry, id=clash.pk, reason='exists', current=current_row(resource, clash))
+    row = current_row(resource, instance)
+    return dict(entry, id=instance.pk, op='upsert', updated_at=row['updated_at']), None
+
+
+def push_changes(user, changes):
+    """
+    Apply a batch of offline edits in one transaction. Conflicting changes
+    are skipped and reported; an invalid change rolls the whole batch back.
+    Returns (applied, conflicts); raises PushError with the change's index.
+    """
+    applied, conflicts = [], []
+    with transaction.atomic(using=shard_for_user(user.pk)):
+        for index, change in enumerate(changes):
+            try:
+                done, conflict = apply_change(user, change)
+            except PushError as exc:
+                raise PushError(f'change {index}: {exc}')
+            if done:
+                applied.append(done)
+            else:
+                conflicts.append(conflict)
+
+        if any(entry['resource'] == 'periods' for entry in applied):
+            first_start = Period.objects.filter(user=user).order_by('start_date').values_list(
+                'start_date', flat=True
+            ).first()
+            CycleProfile.objects.filter(user=user, first_period_date__isnull=True).update(
+                first_period_date=first_start
+            )
+            if CycleProfile.objects.filter(user=user).exists():
+                generate_predictions(user)
+    return applied, conflicts
+
+
+def sync_response(payload, status=200):
+    return JsonResponse(dict(payload, version=API_VERSION), status=status, encoder=SyncJSONEncoder)
+
+
+@require_http_methods(['GET', 'POST'])
+@api_login_required
+def sync_view(request):
+    """
+    GET /api/v1/sync/?cursor=...&limit=... returns one page of changes;
+    clients repeat with the returned cursor while has_more is true, then
+    keep the last cursor for next time. Omit the cursor to fetch
+    everything.
+
+    POST /api/v1/sync/ with {"changes": [...]} pushes offline edits.
+    """
+    if request.method == 'POST':
+        try:
+            changes = json.loads(request.body).get('changes')
+        except (ValueError, AttributeError):
+            return api_error('Expected a JSON object with a changes list.', 400)
+        if not isinstance(changes, list):
+            return api_error('Expected a JSON object with a changes list.', 400)
+        if len(changes) > MAX_PUSH_CHANGES:
+            return api_error(f'Push at most {MAX_PUSH_CHANGES} changes at a time.', 400)
+        try:
+            applied, conflicts = push_changes(request.user, changes)
+        except PushError as exc:
+            return api_error(str(exc), 400)
+        return sync_response({'applied': applied, 'conflicts': conflicts})
+
+    now = timezone.now()
+    try:
+        state = decode_cursor(request.GET['cursor']) if request.GET.get('cursor') else {}
+    except ValueError as exc:
+        return api_error(str(exc), 400)
+    try:
+        limit = int(request.GET.get('limit', SYNC_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_SYNC_PAGE_SIZE:
+        return api_error(f'limit must be between 1 and {MAX_SYNC_PAGE_SIZE}.', 400)
+    if not validate_since(state, now):
+        return sync_response({
+            'error': 'This cursor is too old to include every deletion; sync again without one.',
+            'reset': True,
+        }, status=410)
+
+    changes, deleted, state, has_more = pull_changes(request.user, state, limit, now)
+    return sync_response({
+        'changes': changes,
+        'deleted': deleted,
+        'cursor': encode_cursor(cursor_state(**state)),
+        'has_more': has_more,
+    })
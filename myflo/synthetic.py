@@ -0,0 +1,354 @@
+import multiprocessing
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Count
+
+from .models import (
+    Appointment, ContraceptiveType, ContraceptiveUse, CycleProfile, DailyLog, DailySymptom,
+    HealthProvider, Notification, Period, Settings, Symptom, UserProfile
+)
+from .sharding import (
+    data_aliases, place_new_users, shard_for_user, sharded_models, use_shard, user_lookup
+)
+from .symptoms import adjust_symptom_usage
+
+SYNTHETIC_CHUNK_SIZE = 50
+SYNTHETIC_BATCH_SIZE = 2000
+
+# Created only when the catalogs are empty
+DEFAULT_SYMPTOMS = [
+    ('Acne', 'skin'), ('Anxiety', 'emotional'), ('Back pain', 'physical'),
+    ('Bloating', 'digestive'), ('Breast tenderness', 'physical'), ('Cramps', 'physical'),
+    ('Fatigue', 'physical'), ('Food cravings', 'digestive'), ('Headache', 'physical'),
+    ('Insomnia', 'other'), ('Irritability', 'emotional'), ('Mood swings', 'emotional'),
+    ('Nausea', 'digestive'),
+]
+# name, category, affects_cycle, typical_cycle_delay_days
+DEFAULT_CONTRACEPTIVE_TYPES = [
+    ('Combined pill', 'pill', True, None),
+    ('Condom', 'barrier', False, None),
+    ('Emergency pill', 'emergency', True, 5),
+    ('Hormonal IUD', 'iud', True, None),
+    ('Implant', 'implant', True, None),
+]
+
+TIMEZONES = ['UTC', 'Europe/London', 'America/New_York', 'Africa/Nairobi', 'Asia/Kolkata']
+MOODS = [mood for mood, _ in DailyLog.MOOD_CHOICES]
+# Flow on the 1st, 2nd, ... day of a period
+PERIOD_FLOWS = ['medium', 'heavy', 'medium', 'light', 'light', 'spotting', 'spotting']
+SPECIALTIES = ['Gynecology', 'General practice', 'Endocrinology', 'Fertility']
+SURNAMES = ['Achieng', 'Brown', 'Garcia', 'Kamau', 'Nguyen', 'Otieno', 'Patel', 'Smith']
+APPOINTMENT_TYPES = ['routine_checkup', 'gynecology', 'contraception', 'fertility', 'other']
+NOTIFICATIONS = [
+    ('period_reminder', 'Period expected soon', 'Your next period is expected in a few days.'),
+    ('ovulation_reminder', 'Fertile window', 'Your fertile window starts soon.'),
+    ('log_reminder', 'Daily log', "Don't forget to log how you feel today."),
+    ('general', 'Cycle summary', 'Your monthly cycle summary is ready.'),
+]
+
+# Alias: multiprocessing.Lock, set in forked workers
+_write_locks = {}
+
+
+def ensure_catalogs():
+    """Symptom ids and contraceptive types, by name, creating the defaults in empty catalogs"""
+    if not Symptom.objects.exists():
+        for name, category in DEFAULT_SYMPTOMS:
+            # save() so the signals copy the rows to the shards
+            Symptom.objects.create(name=name, category=category)
+    if not ContraceptiveType.objects.exists():
+        for name, category, affects_cycle, delay in DEFAULT_CONTRACEPTIVE_TYPES:
+            ContraceptiveType.objects.create(
+                name=name, category=category, affects_cycle=affects_cycle,
+                typical_cycle_delay_days=delay,
+            )
+    symptom_ids = list(Symptom.objects.order_by('name').values_list('id', flat=True))
+    types = list(ContraceptiveType.objects.order_by('name').values_list('id', 'category'))
+    return symptom_ids, types
+
+
+def delete_synthetic_users(prefix, batch_size=500):
+    """
+    Delete the users named prefix*. Their rows go in raw deletes per
+    table: the per-row signals (tombstones, cache bumps) only matter for
+    users who stay, and would take longer than the seeding.
+    """
+    user_ids = list(User.objects.filter(username__startswith=prefix).values_list('pk', flat=True))
+    usage = Counter()
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        for alias in data_aliases():
+            with use_shard(alias):
+                usage.update(dict(
+                    DailySymptom.objects.using(alias).filter(daily_log__user_id__in=batch)
+                    .values_list('symptom_id').annotate(uses=Count('id')).order_by()
+                ))
+                for model in reversed(sharded_models()):
+                    model._base_manager.using(alias).filter(
+                        **{f'{user_lookup(model)}_id__in': batch}
+                    )._raw_delete(alias)
+        # Only the users themselves are left
+        User.objects.filter(pk__in=batch).delete()
+    adjust_symptom_usage({symptom_id: -uses for symptom_id, uses in usage.items()})
+    return len(user_ids)
+
+
+def at(day, rng, first_hour=7, last_hour=22):
+    return datetime.combine(
+        day, time(rng.randint(first_hour, last_hour), rng.choice([0, 15, 30, 45])),
+        tzinfo=dt_timezone.utc,
+    )
+
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def generate_user(rng, user_id, end_date, years, symptom_ids, types, history_days=None,
+                  engagement=None):
+    """
+    One user's history up to end_date as unsaved rows, drawn from rng
+    only. Daily logs come with their (symptom_id, severity) lists and
+    providers with their appointments, since those need saved ids.
+    history_days and engagement fix the length of the history and the
+    share of days logged instead of drawing them.
+    """
+    days = rng.randint(90, max(90, int(years * 365)))
+    start = end_date - timedelta(days=history_days or days)
+    cycle_length = clamp(round(rng.gauss(28, 2)), 23, 35)
+    irregular = rng.random() < 0.2
+    spread = 6 if irregular else 1.5
+    period_length = rng.randint(3, 7)
+    # Share of days logged: some users log daily, most now and then
+    drawn_engagement = rng.betavariate(2, 3)
+    if engagement is None:
+        engagement = drawn_engagement
+
+    periods = []
+    period_days = {}
+    day = start + timedelta(days=rng.randrange(cycle_length))
+    while day <= end_date:
+        length = clamp(period_length + rng.randint(-1, 1), 2, 10)
+        last = day + timedelta(days=length - 1)
+        periods.append(Period(
+            user_id=user_id, start_date=day, end_date=last if last < end_date else None,
+            flow_intensity=rng.choices(
+                ['light', 'medium', 'heavy', 'very_heavy'], [3, 5, 2, 0.5]
+            )[0],
+        ))
+        for offset in range(length):
+            period_days[day + timedelta(days=offset)] = offset
+        day += timedelta(days=clamp(round(rng.gauss(cycle_length, spread)), 18, 60))
+
+    logs = []
+    day = start
+    while day <= end_date:
+        offset = period_days.get(day)
+        if rng.random() < (min(1, engagement * 1.5) if offset is not None else engagement):
+            if offset is None:
+                flow = 'spotting' if rng.random() < 0.02 else 'none'
+                pain = rng.randint(0, 3)
+                symptom_count = rng.choices([0, 1, 2], [6, 3, 1])[0]
+            else:
+                flow = PERIOD_FLOWS[min(offset, len(PERIOD_FLOWS) - 1)]
+                pain = rng.randint(2, 8)
+                symptom_count = rng.choices([0, 1, 2, 3], [1, 3, 3, 2])[0]
+            symptoms = [
+                (symptom_id, rng.randint(1, 5))
+                for symptom_id in rng.sample(symptom_ids, min(symptom_count, len(symptom_ids)))
+            ]
+            logs.append((DailyLog(
+                user_id=user_id, date=day, flow=flow, mood=rng.choice(MOODS),
+                energy_level=rng.randint(1, 10), pain_level=pain,
+                sleep_hours=Decimal(rng.randint(10, 18)) / 2,
+                exercise_minutes=rng.choice([None, 0, 15, 30, 45, 60]),
+                water_intake_glasses=rng.randint(2, 10),
+            ), symptoms))
+        day += timedelta(days=1)
+
+    contraceptive_uses = []
+    regular = [type_id for type_id, category in types if category != 'emergency']
+    emergency = [type_id for type_id, category in types if category == 'emergency']
+    if regular and rng.random() < 0.3:
+        type_id = rng.choice(regular)
+        day = start
+        while day <= end_date:
+            contraceptive_uses.append(ContraceptiveUse(
+                user_id=user_id, contraceptive_type_id=type_id, date_taken=at(day, rng),
+                reason='regular' if rng.random() < 0.95 else 'missed_pill',
+            ))
+            day += timedelta(days=28)
+    if emergency:
+        for _ in range(rng.choices([0, 1, 2], [8, 1.5, 0.5])[0]):
+            day = start + timedelta(days=rng.randint(0, (end_date - start).days))
+            contraceptive_uses.append(ContraceptiveUse(
+                user_id=user_id, contraceptive_type_id=rng.choice(emergency),
+                date_taken=at(day, rng), reason='emergency',
+            ))
+
+    providers = []
+    for index in range(rng.choices([0, 1, 2], [4, 4.5, 1.5])[0]):
+        appointments = []
+        for _ in range(rng.randint(0, 4)):
+            day = start + timedelta(days=rng.randint(0, (end_date - start).days + 60))
+            appointments.append(Appointment(
+                user_id=user_id, appointment_date=at(day, rng, 8, 17),
+                appointment_type=rng.choice(APPOINTMENT_TYPES), is_completed=day < end_date,
+            ))
+        providers.append((HealthProvider(
+            user_id=user_id, name=f'Dr. {rng.choice(SURNAMES)}',
+            specialty=rng.choice(SPECIALTIES), is_primary=index == 0,
+        ), appointments))
+
+    notifications = []
+    for _ in range(int((end_date - start).days / 15 * (0.5 + engagement))):
+        notification_type, title, message = rng.choice(NOTIFICATIONS)
+        sent_at = at(start + timedelta(days=rng.randint(0, (end_date - start).days)), rng, 8, 20)
+        notifications.append(Notification(
+            user_id=user_id, notification_type=notification_type, title=title, message=message,
+            scheduled_date=sent_at, is_sent=True, sent_at=sent_at, is_read=rng.random() < 0.7,
+        ))
+
+    rows = {
+        'profiles': [UserProfile(
+            user_id=user_id, timezone=rng.choice(TIMEZONES),
+            date_of_birth=end_date - timedelta(days=rng.randint(16 * 365, 45 * 365)),
+            privacy_level=rng.choice(['private', 'private', 'family', 'public']),
+        )],
+        'cycle_profiles': [CycleProfile(
+            user_id=user_id, average_cycle_length=cycle_length, average_period_length=period_length,
+            first_period_date=periods[0].start_date if periods else None, is_irregular=irregular,
+        )],
+        'settings': [Settings(user_id=user_id, share_data_for_research=rng.random() < 0.3)],
+        'periods': periods,
+        'contraceptive_uses': contraceptive_uses,
+        'notifications': notifications,
+    }
+    return rows, logs, providers
+
+
+def write_rows(rows, logs, providers, batch_size):
+    """Bulk insert one chunk's rows; returns the row counts and symptom usage"""
+    counts = Counter()
+    for table, objects in rows.items():
+        if objects:
+            type(objects[0]).objects.bulk_create(objects, batch_size=batch_size)
+        counts[table] += len(objects)
+
+    DailyLog.objects.bulk_create([daily_log for daily_log, _ in logs], batch_size=batch_size)
+    daily_symptoms = [
+        DailySymptom(daily_log_id=daily_log.pk, symptom_id=symptom_id, severity=severity)
+        for daily_log, symptoms in logs for symptom_id, severity in symptoms
+    ]
+    DailySymptom.objects.bulk_create(daily_symptoms, batch_size=batch_size)
+
+    HealthProvider.objects.bulk_create([provider for provider, _ in providers], batch_size=batch_size)
+    appointments = []
+    for provider, provider_appointments in providers:
+        for appointment in provider_appointments:
+            appointment.health_provider_id = provider.pk
+            appointments.append(appointment)
+    Appointment.objects.bulk_create(appointments, batch_size=batch_size)
+
+    counts.update(
+        daily_logs=len(logs), daily_symptoms=len(daily_symptoms),
+        health_providers=len(providers), appointments=len(appointments),
+    )
+    return counts, Counter(daily_symptom.symptom_id for daily_symptom in daily_symptoms)
+
+
+def seed_chunk(users, seed, end_date, years, symptom_ids, types, batch_size, overrides):
+    """
+    Generate and save the data of [(index, user_id), ...]. Each user's
+    random stream is seeded by (seed, index), so the data doesn't depend
+    on the chunking or the number of workers.
+    """
+    by_shard = {}
+    for index, user_id in users:
+        by_shard.setdefault(shard_for_user(user_id), []).append((index, user_id))
+
+    counts, usage = Counter(), Counter()
+    for alias, shard_users in by_shard.items():
+        rows, logs, providers = {}, [], []
+        for index, user_id in shard_users:
+            rng = random.Random(f'{seed}:{index}')
+            user_rows, user_logs, user_providers = generate_user(
+                rng, user_id, end_date, years, symptom_ids, types, **overrides
+            )
+            for table, objects in user_rows.items():
+                rows.setdefault(table, []).extend(objects)
+            logs += user_logs
+            providers += user_providers
+        # Workers generate in parallel but take turns to write: SQLite has one writer per file
+        with use_shard(alias), _write_locks.get(alias, nullcontext()):
+            with transaction.atomic(using=alias):
+                chunk_counts, chunk_usage = write_rows(rows, logs, providers, batch_size)
+        counts += chunk_counts
+        usage += chunk_usage
+    return counts, usage
+
+
+def init_worker(locks):
+    global _write_locks
+    _write_locks = locks
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+
+
+def seed_synthetic_data(count, end_date, seed=0, years=3, prefix='synthetic',
+                        chunk_size=SYNTHETIC_CHUNK_SIZE, batch_size=SYNTHETIC_BATCH_SIZE, workers=1,
+                        history_days=None, engagement=None):
+    """
+    Create `count` users named <prefix>0000000, <prefix>0000001, ... with
+    up to `years` of history ending at end_date: periods with regular or
+    irregular cycles, daily logs with moods and symptoms, contraceptive
+    uses, providers with appointments and sent notifications.
+
+    The same seed, end_date and catalogs give the same data. Chunks of
+    chunk_size users are generated by `workers` forked processes.
+    history_days and engagement give every user the same history length
+    and share of days logged. Returns the number of rows created per table.
+    """
+    symptom_ids, types = ensure_catalogs()
+    unusable = make_password(None)
+    joined = datetime.combine(end_date - timedelta(days=int(years * 365)), time(), tzinfo=dt_timezone.utc)
+    users = User.objects.bulk_create([
+        User(
+            username=f'{prefix}{index:07d}', email=f'{prefix}{index:07d}@example.com',
+            password=unusable, date_joined=joined,
+        )
+        for index in range(count)
+    ], batch_size=batch_size)
+    place_new_users(users)
+
+    arguments = [
+        ([(index, user.pk) for index, user in enumerate(users[first:first + chunk_size], first)],
+         seed, end_date, years, symptom_ids, types, batch_size,
+         {'history_days': history_days, 'engagement': engagement})
+        for first in range(0, len(users), chunk_size)
+    ]
+    if workers > 1 and len(arguments) > 1:
+        context = multiprocessing.get_context('fork')
+        locks = {alias: context.Lock() for alias in {shard_for_user(user.pk) for user in users}}
+        connections.close_all()
+        with ProcessPoolExecutor(
+            workers, mp_context=context, initializer=init_worker, initargs=(locks,)
+        ) as pool:
+            results = list(pool.map(seed_chunk, *zip(*arguments)))
+    else:
+        results = [seed_chunk(*chunk_arguments) for chunk_arguments in arguments]
+
+    counts, usage = Counter(users=len(users)), Counter()
+    for chunk_counts, chunk_usage in results:
+        counts += chunk_counts
+        usage += chunk_usage
+    adjust_symptom_usage(usage)
+    return dict(counts)
@@ -1,3 +1,1664 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+import zipfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    UserProfile, CycleProfile, Period, DailyLog, Symptom, DailySymptom,
+    ContraceptiveType, ContraceptiveUse, Prediction, Notification,
+    HealthProvider, Appointment, CycleInsight, Settings, ReminderSchedule, SyncTombstone
+)
+from . import async_views, catalogs
+from .cache import bump_version, get_version
+from .calendar_grid import (
+    OPEN_PERIOD_MAX_DAYS, build_calendar_grid, month_span, render_month_fragment, span_for
+)
+from .cycle_phases import get_cycle_phases
+from .export import iter_csv_zip, iter_ndjson
+from .history_import import import_history
+from .predictions import generate_predictions
+from .research_export import export_research_data, read_manifest
+from .routers import READ_DATABASE, read_only_queries
+from .sharding import (
+    SHARD_ID_BITS, ShardNotSelected, ShardRouter, copy_catalogs, fan_out, hash_shard, move_user,
+    seed_id_range, shard_aliases, shard_for_user, shard_map_key, shard_of_id, use_shard, use_user_shard
+)
+from .dispatch import (
+    MAX_DELIVERY_ATTEMPTS, NotificationBackend, claim_batch, claimable_notifications,
+    deliver_batch, dispatch_backlog, record_results
+)
+from .cycle_stats import get_cycle_stats
+from .reminder_schedule import fire_due_reminders
+from .reminders import generate_reminder_chunk
+from .symptoms import save_daily_symptoms, symptom_severities
+from .synthetic import seed_synthetic_data
+from .view_benchmark import (
+    BASELINE_PATH, benchmark_urls, find_regressions, run_view_benchmark, server_errors
+)
+
+
+class CalendarGridTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo')
+        self.today = date(2024, 3, 3)
+
+    def period_days(self, first_day, last_day):
+        return [
+            day['date'] for day in build_calendar_grid(self.user, first_day, last_day, self.today)
+            if day['periods']
+        ]
+
+    def test_ongoing_period_runs_until_today(self):
+        # Started in February and not ended yet
+        Period.objects.create(user=self.user, start_date=date(2024, 2, 28))
+        self.assertEqual(
+            self.period_days(*month_span(2024, 3)),
+            [date(2024, 3, 1), date(2024, 3, 2), date(2024, 3, 3)]
+        )
+        self.assertEqual(
+            self.period_days(*month_span(2024, 2)), [date(2024, 2, 28), date(2024, 2, 29)]
+        )
+
+    def test_forgotten_ongoing_period_is_capped(self):
+        start = date(2024, 1, 1)
+        Period.objects.create(user=self.user, start_date=start)
+        days = self.period_days(*span_for('quarter', self.today))
+        self.assertEqual(days[0], start)
+        self.assertEqual(len(days), OPEN_PERIOD_MAX_DAYS)
+
+    def test_spans_and_query_count_do_not_grow_with_history(self):
+        for cycle in range(60):
+            start = self.today - timedelta(days=28 * cycle)
+            Period.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+            DailyLog.objects.create(user=self.user, date=start, mood='calm')
+        for kind, days in (('week', 7), ('month', 31), ('quarter', 91), ('year', 366)):
+            with self.assertNumQueries(3):
+                grid = build_calendar_grid(self.user, *span_for(kind, self.today), self.today)
+            self.assertEqual(len(grid), days)
+        week = build_calendar_grid(self.user, *span_for('week', self.today), self.today)
+        self.assertEqual(week[0]['date'].weekday(), 6)
+        today = next(day for day in week if day['is_today'])
+        self.assertEqual(today['daily_log'].mood, 'calm')
+        self.assertEqual(len(today['periods']), 1)
+
+
+class CalendarFragmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        self.period = Period.objects.create(
+            user=self.user, start_date=date(2024, 1, 10), end_date=date(2024, 1, 14)
+        )
+        self.months = [(2024, 1), (2024, 2), (2024, 3)]
+        for year, month in self.months:
+            render_month_fragment(self.user, year, month)
+
+    def assertCached(self, *months):
+        for year, month in months:
+            with self.assertNumQueries(0):
+                render_month_fragment(self.user, year, month)
+
+    def assertRendered(self, *months):
+        for year, month in months:
+            with self.assertNumQueries(3):
+                render_month_fragment(self.user, year, month)
+
+    def test_past_months_come_from_cache(self):
+        self.assertCached(*self.months)
+
+    def test_edits_invalidate_only_their_months(self):
+        DailyLog.objects.create(user=self.user, date=date(2024, 2, 5), mood='calm')
+        self.assertCached((2024, 1), (2024, 3))
+        self.assertRendered((2024, 2))
+
+        # Moving a period invalidates the month it left and the one it joined
+        self.period.start_date, self.period.end_date = date(2024, 3, 1), date(2024, 3, 5)
+        self.period.save()
+        self.assertCached((2024, 2))
+        self.assertRendered((2024, 1), (2024, 3))
+
+        Prediction.objects.create(
+            user=self.user, prediction_type='next_period', predicted_date=date(2024, 2, 20)
+        )
+        self.assertCached((2024, 1), (2024, 3))
+        self.assertRendered((2024, 2))
+
+    def test_fragment_endpoint(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('calendar_grid'), {'year': 2024, 'month': 1})
+        self.assertContains(response, 'data-month="1"')
+        self.assertContains(response, 'data-date="2024-01-10"')
+        self.assertNotContains(response, '<html')
+
+    def test_invalid_month_falls_back_to_this_month(self):
+        self.client.force_login(self.user)
+        today = date.today()
+        for params in ({'month': 13}, {'year': 'x'}, {'year': 10000, 'month': 1}, {'year': 1}):
+            for name in ('calendar', 'calendar_grid'):
+                response = self.client.get(reverse(name), params)
+                self.assertContains(response, f'data-month="{today.month}"')
+                self.assertContains(response, f'data-year="{today.year}"')
+
+
+class PredictionRegenerationTests(TestCase):
+    def setUp(self):
+        self.users = []
+        for index, cycle_length in enumerate([26, 28, 32]):
+            user = User.objects.create_user(f'user{index}')
+            CycleProfile.objects.create(user=user, average_cycle_length=cycle_length)
+            for cycle in range(index + 2):
+                start = date(2024, 1, 1) + timedelta(days=cycle_length * cycle)
+                Period.objects.create(user=user, start_date=start, end_date=start + timedelta(days=4))
+            self.users.append(user)
+        # No profile: the default cycle length applies
+        self.no_profile = User.objects.create_user('noprofile')
+        Period.objects.create(user=self.no_profile, start_date=date(2024, 1, 1))
+
+    def regenerate(self):
+        out = StringIO()
+        call_command('regenerate_predictions', '--workers', '1', '--chunk-size', '2', stdout=out)
+        # Every user with periods is processed, changed or not
+        self.assertIn('Processed 4 users in 2 chunks', out.getvalue())
+        return re.search(r'updated predictions for (\d+) users', out.getvalue()).group(1)
+
+    def active(self, user):
+        return dict(Prediction.objects.filter(user=user, is_active=True).values_list(
+            'prediction_type', 'predicted_date'
+        ))
+
+    def test_batch_matches_per_user_predictions(self):
+        self.assertEqual(self.regenerate(), '4')
+        last_start = date(2024, 1, 1) + timedelta(days=32 * 3)
+        self.assertEqual(self.active(self.users[2]), {
+            'next_period': last_start + timedelta(days=32),
+            'ovulation': last_start + timedelta(days=32 - 14),
+            'fertile_window': last_start + timedelta(days=32 - 19),
+        })
+        self.assertEqual(
+            self.active(self.no_profile)['next_period'], date(2024, 1, 1) + timedelta(days=28)
+        )
+        # Same rules and fingerprints as the per-user path
+        for user in User.objects.filter(cycleprofile__isnull=False):
+            self.assertEqual(generate_predictions(user), 0)
+
+    def test_unchanged_users_are_skipped(self):
+        self.regenerate()
+        rows = set(Prediction.objects.values_list('pk', 'predicted_date', 'is_active'))
+        self.assertEqual(self.regenerate(), '0')
+        self.assertEqual(set(Prediction.objects.values_list('pk', 'predicted_date', 'is_active')), rows)
+
+        user = self.users[0]
+        before = dict(Prediction.objects.filter(user=user, is_active=True).values_list(
+            'prediction_type', 'pk'
+        ))
+        Period.objects.create(user=user, start_date=date(2024, 3, 1))
+        self.assertEqual(self.regenerate(), '1')
+        # Rewritten in place, nothing deactivated
+        self.assertEqual(dict(Prediction.objects.filter(user=user, is_active=True).values_list(
+            'prediction_type', 'pk'
+        )), before)
+        self.assertFalse(Prediction.objects.filter(is_active=False).exists())
+        self.assertEqual(self.active(user)['next_period'], date(2024, 3, 27))
+
+
+class PredictionGenerationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo')
+        CycleProfile.objects.create(user=self.user, average_cycle_length=28)
+        for start in (date(2024, 1, 1), date(2024, 1, 29), date(2024, 2, 26)):
+            Period.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+
+    def active(self):
+        return {
+            prediction_type: (pk, predicted_date, confidence)
+            for prediction_type, pk, predicted_date, confidence in Prediction.objects.filter(
+                user=self.user, is_active=True
+            ).values_list('prediction_type', 'pk', 'predicted_date', 'confidence_level')
+        }
+
+    def test_unchanged_inputs_write_nothing(self):
+        self.assertEqual(generate_predictions(self.user), 3)
+        self.user.cycleprofile.refresh_from_db()
+        # Reading the inputs, and no write
+        with self.assertNumQueries(2):
+            self.assertEqual(generate_predictions(self.user), 0)
+
+    def test_emergency_delay_moves_only_the_next_period(self):
+        generate_predictions(self.user)
+        before = self.active()
+        emergency = ContraceptiveType.objects.create(
+            name='Emergency pill', category='emergency', typical_cycle_delay_days=7
+        )
+        ContraceptiveUse.objects.create(
+            user=self.user, contraceptive_type=emergency, reason='emergency',
+            date_taken=timezone.make_aware(datetime(2024, 3, 5, 12))
+        )
+        self.user.cycleprofile.refresh_from_db()
+        self.assertEqual(generate_predictions(self.user), 1)
+        after = self.active()
+        self.assertEqual(after['next_period'], (
+            before['next_period'][0], date(2024, 3, 25) + timedelta(days=7), 'low'
+        ))
+        self.assertEqual(after['ovulation'], before['ovulation'])
+        self.assertEqual(after['ovulation'][1], date(2024, 3, 11))
+        self.assertEqual(after['fertile_window'], before['fertile_window'])
+
+    def test_new_period_updates_rows_in_place(self):
+        generate_predictions(self.user)
+        before = self.active()
+        Period.objects.create(user=self.user, start_date=date(2024, 3, 27))
+        self.user.cycleprofile.refresh_from_db()
+        self.assertEqual(generate_predictions(self.user), 3)
+        after = self.active()
+        self.assertEqual(
+            {kind: pk for kind, (pk, _, _) in after.items()},
+            {kind: pk for kind, (pk, _, _) in before.items()}
+        )
+        self.assertEqual(after['next_period'][1], date(2024, 4, 24))
+        self.assertFalse(Prediction.objects.filter(is_active=False).exists())
+
+    def test_without_periods_predictions_are_kept(self):
+        generate_predictions(self.user)
+        before = self.active()
+        Period.objects.filter(user=self.user).delete()
+        self.user.cycleprofile.refresh_from_db()
+        self.assertEqual(generate_predictions(self.user), 0)
+        self.assertEqual(self.active(), before)
+
+
+class DashboardViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        CycleProfile.objects.create(user=self.user)
+        Period.objects.create(user=self.user, start_date=date.today() - timedelta(days=10))
+        Prediction.objects.create(
+            user=self.user, prediction_type='next_period',
+            predicted_date=date.today() + timedelta(days=18)
+        )
+        Notification.objects.create(
+            user=self.user, notification_type='general', title='Hello',
+            message='Welcome', scheduled_date=timezone.now() - timedelta(hours=1)
+        )
+        self.client.force_login(self.user)
+
+    def test_get_does_not_create_daily_log(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(DailyLog.objects.filter(user=self.user).exists())
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_warm_load_needs_at_most_one_query(self):
+        self.client.get(reverse('dashboard'))
+        # Only the authenticated user is loaded; session and bundle are cached
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, 'Welcome')
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_warm_load_without_a_shared_cache(self):
+        self.client.get(reverse('dashboard'))
+        # The session comes from the database, the bundle still from the cache
+        with self.assertNumQueries(2):
+            self.client.get(reverse('dashboard'))
+
+    def test_write_invalidates_bundle(self):
+        self.client.get(reverse('dashboard'))
+        DailyLog.objects.create(user=self.user, date=date.today(), mood='happy')
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['today_log'].mood, 'happy')
+
+
+class QueryPlanTests(TestCase):
+    """Hot per-user view queries must be index searches without sorts"""
+
+    # Small admin-managed catalogs; scanning them is expected
+    CATALOG_TABLES = ('myflo_symptom', 'myflo_contraceptivetype')
+    # Grouping by computed keys (the cycle phase summary) keeps one b-tree
+    # entry per group, not per row
+    GROUPING_STEP = 'USE TEMP B-TREE FOR GROUP BY'
+
+    URL_NAMES = [
+        'dashboard', 'calendar', 'calendar_grid', 'period_list',
+        'daily_log_history', 'contraceptive_list', 'health_provider_list',
+        'appointment_list', 'insights', 'analytics', 'notifications',
+        'api_periods', 'api_daily_logs', 'api_predictions', 'api_notifications',
+        'api_appointments', 'api_sync',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        today = date.today()
+        now = timezone.now()
+        emergency = ContraceptiveType.objects.create(
+            name='Emergency pill', category='emergency', typical_cycle_delay_days=7
+        )
+        for index in range(5):
+            user = User.objects.create_user(f'user{index}', password='secret-pass-123')
+            UserProfile.objects.create(user=user)
+            CycleProfile.objects.create(user=user)
+            Settings.objects.create(user=user)
+            provider = HealthProvider.objects.create(user=user, name='Dr. Who')
+            for cycle in range(24):
+                start = today - timedelta(days=28 * cycle)
+                Period.objects.create(user=user, start_date=start, end_date=start + timedelta(days=4))
+                Prediction.objects.create(
+                    user=user, prediction_type='next_period',
+                    predicted_date=start + timedelta(days=28), is_active=cycle == 0
+                )
+                CycleInsight.objects.create(
+                    user=user, insight_type='general', title='Insight',
+                    description='...', data_period_start=start, data_period_end=start,
+                    is_dismissed=cycle % 2 == 0
+                )
+                Notification.objects.create(
+                    user=user, notification_type='general', title='Note', message='...',
+                    scheduled_date=now - timedelta(days=cycle - 3), is_read=cycle % 3 == 0
+                )
+                ContraceptiveUse.objects.create(
+                    user=user, contraceptive_type=emergency, reason='emergency',
+                    date_taken=now - timedelta(days=28 * cycle)
+                )
+                Appointment.objects.create(
+                    user=user, health_provider=provider, appointment_type='gynecology',
+                    appointment_date=now + timedelta(days=cycle)
+                )
+            DailyLog.objects.bulk_create([
+                DailyLog(user=user, date=today - timedelta(days=day), mood='calm')
+                for day in range(365)
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = User.objects.get(username='user0')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_view_queries_use_indexes(self):
+        for url_name in self.URL_NAMES:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(url_name))
+            self.assertEqual(response.status_code, 200, url_name)
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or '"myflo_' not in sql:
+                    continue
+                if any(f'FROM "{table}"' in sql for table in self.CATALOG_TABLES):
+                    continue
+                for step in self.query_plan(sql):
+                    with self.subTest(view=url_name, sql=sql, step=step):
+                        # Reading back a materialized window subquery is fine
+                        table_scan = step.startswith('SCAN') and 'subquery' not in step
+                        self.assertFalse(table_scan, 'full table scan')
+                        if step != self.GROUPING_STEP:
+                            self.assertNotIn('TEMP B-TREE', step)
+
+    def test_later_pages_use_indexes(self):
+        for url_name, context_name in [
+            ('period_list', 'periods'), ('daily_log_history', 'logs'),
+            ('notifications', 'notifications'),
+        ]:
+            first_page = self.client.get(reverse(url_name)).context[context_name]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse(url_name), {'after': first_page.next_cursor})
+            selects = [query['sql'] for query in queries.captured_queries
+                       if query['sql'].startswith('SELECT') and f'"myflo_' in query['sql']]
+            self.assertTrue(selects)
+            for sql in selects:
+                for step in self.query_plan(sql):
+                    with self.subTest(view=url_name, sql=sql, step=step):
+                        self.assertFalse(step.startswith('SCAN'), 'full table scan')
+                        self.assertNotIn('TEMP B-TREE', step)
+
+
+class SymptomPersistenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        self.symptoms = Symptom.objects.bulk_create([
+            Symptom(name=f'Symptom {index}', category='physical') for index in range(12)
+        ])
+        self.daily_log = DailyLog.objects.create(user=self.user, date=date(2024, 1, 2))
+        catalogs.symptoms.invalidate()
+        catalogs.symptoms.all()
+
+    def save(self, selected):
+        with CaptureQueriesContext(connection) as queries:
+            result = save_daily_symptoms(self.daily_log, selected)
+        return result, len(queries)
+
+    def test_only_the_difference_is_written(self):
+        first, second, third = (symptom.pk for symptom in self.symptoms[:3])
+        save_daily_symptoms(self.daily_log, {first: 1, second: 2})
+        kept = DailySymptom.objects.get(daily_log=self.daily_log, symptom_id=first)
+
+        self.assertEqual(self.save({first: 1, second: 4, third: 3})[0], (1, 1, 0))
+        self.assertEqual(self.save({first: 1, third: 3})[0], (0, 0, 1))
+        # Nothing to write: the transaction and the read of the current rows
+        self.assertEqual(self.save({first: 1, third: 3}), ((0, 0, 0), 3))
+        self.assertEqual(symptom_severities(self.daily_log), {first: 1, third: 3})
+        # Unchanged rows are left in place
+        self.assertTrue(DailySymptom.objects.filter(pk=kept.pk).exists())
+        usage = dict(Symptom.objects.values_list('pk', 'usage_count'))
+        self.assertEqual([usage[first], usage[second], usage[third]], [1, 0, 1])
+
+    def test_query_count_does_not_grow_with_symptoms(self):
+        counts = set()
+        for size in (2, 12):
+            symptoms = [symptom.pk for symptom in self.symptoms[:size]]
+            self.daily_log = DailyLog.objects.create(
+                user=self.user, date=date(2024, 2, size)
+            )
+            _, added = self.save({pk: 1 for pk in symptoms})
+            _, changed = self.save({pk: 2 for pk in symptoms[:size // 2]})
+            counts.add((added, changed))
+        self.assertEqual(len(counts), 1)
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        self.cramps = Symptom.objects.create(name='Cramps', category='physical')
+        self.daily_log = DailyLog.objects.create(user=self.user, date=date(2024, 1, 2))
+
+    def test_symptom_added_in_another_process_is_saved(self):
+        catalogs.symptoms.all()
+        # bulk_create sends no signal, like a save in another process
+        headache, = Symptom.objects.bulk_create([Symptom(name='Headache', category='physical')])
+        self.assertIsNone(catalogs.symptoms.get(headache.pk))
+
+        save_daily_symptoms(self.daily_log, {self.cramps.pk: 2, headache.pk: 3, 9999: 1})
+        self.assertEqual(symptom_severities(self.daily_log), {self.cramps.pk: 2, headache.pk: 3})
+        self.assertIsNotNone(catalogs.symptoms.get(headache.pk))
+
+    def test_hits_misses_and_admin_invalidation(self):
+        catalogs.symptoms.invalidate()
+        before = catalogs.symptoms.stats()
+        self.assertEqual(catalogs.symptoms.all(), [self.cramps])
+        self.assertEqual(catalogs.symptoms.get(self.cramps.pk), self.cramps)
+        stats = catalogs.symptoms.stats()
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        self.assertEqual(stats['size'], 1)
+
+        # Saved through the admin (or any save()), so the signal invalidates
+        bloating = Symptom.objects.create(name='Bloating', category='digestive')
+        self.assertEqual(
+            [(category, [row.name for row in rows]) for category, rows in catalogs.symptoms.grouped()],
+            [('digestive', ['Bloating']), ('physical', ['Cramps'])]
+        )
+        self.assertEqual(catalogs.symptoms.stats()['misses'] - before['misses'], 2)
+        bloating.delete()
+        self.assertIsNone(catalogs.symptoms.get(bloating.pk))
+        self.assertIn('contraceptive_types', catalogs.catalog_stats())
+
+    def test_warm_daily_log_form_does_not_query_catalogs(self):
+        save_daily_symptoms(self.daily_log, {self.cramps.pk: 4})
+        self.client.force_login(self.user)
+        url = reverse('daily_log') + '?date=2024-01-02'
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Cramps')
+        self.assertContains(response, '<option value="4" selected>', html=False)
+        catalog_queries = [
+            query['sql'] for query in queries
+            if '"myflo_symptom"' in query['sql'] or '"myflo_contraceptivetype"' in query['sql']
+        ]
+        self.assertEqual(catalog_queries, [])
+
+    @override_settings(MYFLO_CACHE_VERSION_TIMEOUT=30)
+    def test_versions_of_a_local_cache_expire(self):
+        # Another process's bumps are seen once this process's counter expires
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            get_version('myflo:test:version')
+        self.assertEqual(add.call_args.args[2], 30)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            cache.delete('myflo:test:version')
+            bump_version('myflo:test:version')
+        self.assertEqual(cache_set.call_args.args[2], 30)
+
+
+class AdminChangelistQueryTests(TestCase):
+    """Changelist query counts must not grow with the rows on the page"""
+
+    CHANGELISTS = [
+        'auth_user', 'myflo_userprofile', 'myflo_period', 'myflo_dailylog',
+        'myflo_symptom', 'myflo_dailysymptom', 'myflo_contraceptiveuse',
+        'myflo_prediction', 'myflo_notification', 'myflo_healthprovider',
+        'myflo_appointment', 'myflo_cycleinsight',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='secret-pass-123')
+        cls.symptoms = [
+            Symptom.objects.create(name=f'Symptom {index}', category='physical')
+            for index in range(5)
+        ]
+        cls.contraceptive_type = ContraceptiveType.objects.create(name='Pill', category='pill')
+        cls.created = 0
+
+    def add_rows(self, count):
+        today = date.today()
+        now = timezone.now()
+        for index in range(self.created, self.created + count):
+            user = User.objects.create_user(f'user{index}')
+            UserProfile.objects.create(user=user)
+            provider = HealthProvider.objects.create(user=user, name=f'Dr. {index}')
+            Period.objects.create(user=user, start_date=today)
+            daily_log = DailyLog.objects.create(user=user, date=today)
+            save_daily_symptoms(daily_log, {symptom.pk: 2 for symptom in self.symptoms[:2]})
+            ContraceptiveUse.objects.create(
+                user=user, contraceptive_type=self.contraceptive_type,
+                date_taken=now, reason='regular'
+            )
+            Prediction.objects.create(user=user, prediction_type='ovulation', predicted_date=today)
+            Notification.objects.create(
+                user=user, notification_type='general', title='Hi', message='...',
+                scheduled_date=now
+            )
+            Appointment.objects.create(
+                user=user, health_provider=provider, appointment_type='other',
+                appointment_date=now
+            )
+            CycleInsight.objects.create(
+                user=user, insight_type='general', title='Insight', description='...',
+                data_period_start=today, data_period_end=today
+            )
+        self.created += count
+
+    def changelist_queries(self):
+        counts = {}
+        for changelist in self.CHANGELISTS:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(f'admin:{changelist}_changelist'))
+            self.assertEqual(response.status_code, 200, changelist)
+            counts[changelist] = len(queries)
+        return counts
+
+    def test_query_count_is_fixed_per_page(self):
+        self.client.force_login(self.admin)
+        self.add_rows(10)
+        small_page = self.changelist_queries()
+        self.add_rows(90)
+        full_page = self.changelist_queries()
+        self.assertEqual(small_page, full_page)
+
+    def test_symptom_usage_count_is_maintained(self):
+        self.add_rows(3)
+        daily_log = DailyLog.objects.first()
+        save_daily_symptoms(daily_log, {self.symptoms[2].pk: 4})
+        DailySymptom.objects.create(
+            daily_log=DailyLog.objects.last(), symptom=self.symptoms[3], severity=1
+        )
+        DailyLog.objects.last().delete()
+        for symptom in Symptom.objects.all():
+            self.assertEqual(
+                symptom.usage_count, symptom.dailysymptom_set.count(), symptom.name
+            )
+
+
+class CycleStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('flo')
+        self.gaps = [30, 28, 29, 27, 26, 25]
+        start = date(2024, 1, 1)
+        for index, gap in enumerate([None] + self.gaps):
+            start += timedelta(days=gap or 0)
+            Period.objects.create(
+                user=self.user, start_date=start,
+                end_date=start + timedelta(days=3 + index % 3)
+            )
+
+    def test_statistics_match_history(self):
+        stats = get_cycle_stats(self.user)
+        mean = sum(self.gaps) / len(self.gaps)
+        spread = (sum((gap - mean) ** 2 for gap in self.gaps) / len(self.gaps)) ** 0.5
+        self.assertEqual(stats['period_count'], 7)
+        self.assertEqual(stats['cycle_count'], 6)
+        self.assertEqual(stats['avg_cycle_length'], round(mean, 1))
+        self.assertEqual((stats['min_cycle_length'], stats['max_cycle_length']), (25, 30))
+        self.assertEqual(stats['cycle_variability'], round(spread, 1))
+        self.assertEqual(stats['cycle_trend_label'], 'shortening')
+        self.assertEqual((stats['min_period_duration'], stats['max_period_duration']), (4, 6))
+        self.assertEqual(stats['recent_cycle_lengths'], list(reversed(self.gaps)))
+
+    def test_cached_until_a_period_changes(self):
+        get_cycle_stats(self.user)
+        with self.assertNumQueries(0):
+            get_cycle_stats(self.user)
+        Period.objects.filter(user=self.user).first().delete()
+        self.assertEqual(get_cycle_stats(self.user)['cycle_count'], 5)
+
+
+class CyclePhaseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('flo')
+        self.cramps = Symptom.objects.create(name='Cramps', category='physical')
+        # Two 28-day cycles: menstrual days 1-5, ovulation around day 14
+        for start in (date(2024, 1, 1), date(2024, 1, 29)):
+            Period.objects.create(
+                user=self.user, start_date=start, end_date=start + timedelta(days=4)
+            )
+
+    def log(self, cycle_day, mood, **fields):
+        # Cycle days of the first cycle fall on the same January dates
+        return DailyLog.objects.create(
+            user=self.user, date=date(2024, 1, cycle_day), mood=mood, **fields
+        )
+
+    def test_logs_are_bucketed_by_phase_and_cycle_day(self):
+        cramps = self.log(2, 'tired', pain_level=6)
+        save_daily_symptoms(cramps, {self.cramps.pk: 4})
+        self.log(3, 'tired', pain_level=4, energy_level=3)
+        self.log(9, 'happy', energy_level=8)
+        self.log(14, 'energetic', energy_level=9)
+        self.log(22, 'irritable')
+        phases = {phase['phase']: phase for phase in get_cycle_phases(self.user)['phases']}
+
+        self.assertEqual(phases['menstrual']['days'], 2)
+        self.assertEqual(
+            phases['menstrual']['moods'], [{'mood': 'tired', 'label': 'Tired', 'count': 2}]
+        )
+        self.assertEqual(phases['menstrual']['avg_pain'], 5.0)
+        self.assertEqual(phases['follicular']['avg_energy'], 8.0)
+        self.assertEqual(phases['ovulatory']['moods'][0]['mood'], 'energetic')
+        self.assertEqual(phases['luteal']['days'], 1)
+
+        summary = get_cycle_phases(self.user)
+        self.assertEqual([day['day'] for day in summary['cycle_days']], [2, 3, 9, 14, 22])
+        self.assertEqual(summary['symptoms'][0]['name'], 'Cramps')
+        self.assertEqual(summary['symptoms'][0]['severity_by_phase'][0], [0, 0, 0, 1, 0])
+
+    def test_logs_long_after_the_last_period_are_unknown(self):
+        # The second cycle, started Jan 29, is still open: day 40 is luteal
+        # for a long cycle, day 60 can't be placed
+        DailyLog.objects.create(user=self.user, date=date(2024, 3, 8), mood='calm')
+        DailyLog.objects.create(user=self.user, date=date(2024, 3, 28), mood='sad')
+        # The periods, the profile, then the logs and the symptoms grouped
+        with self.assertNumQueries(4):
+            summary = get_cycle_phases(self.user)
+        phases = {phase['phase']: phase for phase in summary['phases']}
+        self.assertEqual(phases['luteal']['moods'], [{'mood': 'calm', 'label': 'Calm', 'count': 1}])
+        self.assertEqual(phases['unknown']['moods'], [{'mood': 'sad', 'label': 'Sad', 'count': 1}])
+        self.assertEqual([day['day'] for day in summary['cycle_days']], [40])
+        self.assertEqual(summary['logged_days'], 2)
+
+    def test_cached_until_logs_change(self):
+        self.log(2, 'tired')
+        get_cycle_phases(self.user)
+        with self.assertNumQueries(0):
+            get_cycle_phases(self.user)
+        self.log(9, 'happy')
+        self.assertEqual(get_cycle_phases(self.user)['logged_days'], 2)
+
+
+class FailingBackend(NotificationBackend):
+    async def send(self, notification):
+        raise ConnectionError('SMTP server unavailable')
+
+
+class NotificationDispatchTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.user = User.objects.create_user('flo', email='flo@example.com')
+        self.due = [
+            Notification.objects.create(
+                user=self.user, notification_type='general', title=f'Due {index}',
+                message='...', scheduled_date=now - timedelta(minutes=index)
+            )
+            for index in range(3)
+        ]
+        self.future = Notification.objects.create(
+            user=self.user, notification_type='general', title='Later', message='...',
+            scheduled_date=now + timedelta(days=1)
+        )
+
+    def test_due_notifications_are_sent_once(self):
+        no_email = User.objects.create_user('anon')
+        unreachable = Notification.objects.create(
+            user=no_email, notification_type='general', title='Lost', message='...',
+            scheduled_date=timezone.now()
+        )
+        call_command('dispatch_notifications', '--once', stdout=StringIO())
+        call_command('dispatch_notifications', '--once', stdout=StringIO())
+
+        self.assertEqual(sorted(message.subject for message in mail.outbox),
+                         ['Due 0', 'Due 1', 'Due 2'])
+        self.assertEqual(Notification.objects.filter(is_sent=True).count(), 3)
+        self.future.refresh_from_db()
+        self.assertFalse(self.future.is_sent)
+        unreachable.refresh_from_db()
+        self.assertFalse(unreachable.is_sent)
+        self.assertEqual(unreachable.delivery_attempts, MAX_DELIVERY_ATTEMPTS)
+
+    def test_users_with_notifications_off_are_not_sent(self):
+        UserProfile.objects.create(user=self.user, notifications_enabled=False)
+        self.assertEqual(dispatch_backlog()['due'], 0)
+        call_command('dispatch_notifications', '--once', stdout=StringIO())
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(Notification.objects.filter(is_sent=True).exists())
+
+        UserProfile.objects.filter(user=self.user).update(notifications_enabled=True)
+        self.assertEqual(dispatch_backlog()['due'], 3)
+
+    def test_parallel_workers_claim_disjoint_batches(self):
+        _, first = claim_batch('worker-a', 2, 60)
+        _, second = claim_batch('worker-b', 10, 60)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(
+            sorted(notification.pk for notification in first + second),
+            sorted(notification.pk for notification in self.due)
+        )
+
+    def test_failed_delivery_is_retried_after_backoff(self):
+        token, claimed = claim_batch('worker', 10, 60)
+        results = asyncio.run(deliver_batch(FailingBackend(), claimed, 2, 5))
+        self.assertEqual(record_results(token, results), (0, 3, 0))
+
+        failed = Notification.objects.get(pk=self.due[0].pk)
+        self.assertEqual(failed.delivery_attempts, 1)
+        self.assertEqual(failed.last_error, 'SMTP server unavailable')
+        self.assertFalse(claimable_notifications(timezone.now()).exists())
+        self.assertTrue(
+            claimable_notifications(failed.claimed_until + timedelta(seconds=1)).exists()
+        )
+
+
+class ReminderGenerationTests(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        self.users = []
+        for index, ovulation in enumerate([True, False]):
+            user = User.objects.create_user(f'user{index}')
+            UserProfile.objects.create(user=user, timezone='Africa/Nairobi')
+            Settings.objects.create(
+                user=user, period_reminder_days=2, ovulation_reminder_enabled=ovulation
+            )
+            Prediction.objects.create(
+                user=user, prediction_type='next_period',
+                predicted_date=self.today + timedelta(days=20)
+            )
+            Prediction.objects.create(
+                user=user, prediction_type='ovulation',
+                predicted_date=self.today + timedelta(days=6)
+            )
+            self.users.append(user)
+        self.bounds = (self.users[0].pk, self.users[-1].pk)
+
+    def test_reminders_follow_settings_and_are_idempotent(self):
+        self.assertEqual(generate_reminder_chunk(*self.bounds), (3, 0))
+        self.assertEqual(generate_reminder_chunk(*self.bounds), (0, 0))
+
+        period_reminder = Notification.objects.get(
+            user=self.users[0], notification_type='period_reminder'
+        )
+        local = timezone.localtime(period_reminder.scheduled_date, ZoneInfo('Africa/Nairobi'))
+        self.assertEqual(local.date(), self.today + timedelta(days=18))
+        self.assertEqual(local.hour, 9)
+        self.assertFalse(Notification.objects.filter(
+            user=self.users[1], notification_type='ovulation_reminder'
+        ).exists())
+
+    def test_moved_prediction_replaces_unsent_reminder(self):
+        generate_reminder_chunk(*self.bounds)
+        Prediction.objects.filter(prediction_type='next_period').update(
+            predicted_date=self.today + timedelta(days=23)
+        )
+        self.assertEqual(generate_reminder_chunk(*self.bounds), (2, 2))
+        self.assertEqual(
+            set(Notification.objects.filter(notification_type='period_reminder')
+                .values_list('reminder_for', flat=True)),
+            {self.today + timedelta(days=23)}
+        )
+
+
+class ReminderScheduleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo')
+        self.profile = UserProfile.objects.create(user=self.user, timezone='America/New_York')
+        self.settings = Settings.objects.create(
+            user=self.user, daily_log_reminder_time='21:00',
+            pill_reminder_times=['08:00', 'not a time']
+        )
+
+    def test_schedule_follows_settings_and_timezone(self):
+        schedule = {
+            row.kind: row for row in ReminderSchedule.objects.filter(user=self.user)
+        }
+        self.assertEqual(set(schedule), {'log_reminder', 'pill_reminder'})
+        local = timezone.localtime(
+            schedule['pill_reminder'].next_fire_at, ZoneInfo('America/New_York')
+        )
+        self.assertEqual((local.hour, local.minute), (8, 0))
+
+        self.profile.timezone = 'Asia/Tokyo'
+        self.profile.save()
+        self.settings.daily_log_reminder_time = None
+        self.settings.save()
+        row = ReminderSchedule.objects.get(user=self.user)
+        local = timezone.localtime(row.next_fire_at, ZoneInfo('Asia/Tokyo'))
+        self.assertEqual((row.kind, local.hour), ('pill_reminder', 8))
+
+    def test_firing_creates_notifications_and_advances(self):
+        row = ReminderSchedule.objects.order_by('next_fire_at').first()
+        fire_at = row.next_fire_at
+        self.assertEqual(fire_due_reminders(now=fire_at - timedelta(seconds=1)), 0)
+        self.assertEqual(fire_due_reminders(now=fire_at), 1)
+
+        notification = Notification.objects.get(user=self.user)
+        self.assertEqual(notification.notification_type, row.kind)
+        self.assertEqual(notification.scheduled_date, fire_at)
+        row.refresh_from_db()
+        self.assertEqual(row.next_fire_at, fire_at + timedelta(days=1))
+        self.assertEqual(fire_due_reminders(now=fire_at), 0)
+
+
+class DataExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        self.settings = Settings.objects.create(user=self.user)
+        cramps = Symptom.objects.create(name='Cramps', category='physical')
+        Period.objects.create(
+            user=self.user, start_date=date(2024, 1, 1), end_date=date(2024, 1, 5)
+        )
+        for day in range(3):
+            daily_log = DailyLog.objects.create(
+                user=self.user, date=date(2024, 1, 1 + day), mood='calm'
+            )
+            save_daily_symptoms(daily_log, {cramps.pk: day + 1})
+        self.client.force_login(self.user)
+
+    def export(self, export_format):
+        response = self.client.get(reverse('export_data'), {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_export(self):
+        records = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        self.assertEqual(records[0]['type'], 'export')
+        logs = [record for record in records if record['type'] == 'daily_logs']
+        self.assertEqual(
+            [log['date'] for log in logs], ['2024-01-01', '2024-01-02', '2024-01-03']
+        )
+        self.assertEqual(logs[2]['symptoms'], [{'symptom': 'Cramps', 'severity': 3}])
+        self.assertEqual(sum(record['type'] == 'periods' for record in records), 1)
+
+    def test_csv_zip_export(self):
+        archive = zipfile.ZipFile(io.BytesIO(self.export('csv')))
+        self.assertIn('appointments.csv', archive.namelist())
+        with archive.open('daily_logs.csv') as member:
+            rows = list(csv.DictReader(io.TextIOWrapper(member, encoding='utf-8')))
+        self.assertEqual([row['symptoms'] for row in rows], ['Cramps:1', 'Cramps:2', 'Cramps:3'])
+
+    def test_export_respects_privacy_setting(self):
+        self.settings.allow_data_export = False
+        self.settings.save()
+        response = self.client.get(reverse('export_data'))
+        self.assertRedirects(response, reverse('settings'))
+
+
+class HistoryImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        CycleProfile.objects.create(user=self.user)
+        self.cramps = Symptom.objects.create(name='Cramps', category='physical')
+        self.headache = Symptom.objects.create(name='Headache', category='physical')
+
+    def test_export_round_trip(self):
+        source = User.objects.create_user('source')
+        for month in (1, 2, 3):
+            Period.objects.create(
+                user=source, start_date=date(2024, month, 1), end_date=date(2024, month, 5)
+            )
+        daily_log = DailyLog.objects.create(user=source, date=date(2024, 1, 2), mood='calm')
+        save_daily_symptoms(daily_log, {self.cramps.pk: 4, self.headache.pk: 2})
+
+        for stream, import_format in ((iter_ndjson, 'ndjson'), (iter_csv_zip, 'zip')):
+            data = io.BytesIO(b''.join(stream(source)))
+            report = import_history(self.user, data, import_format)
+            self.assertEqual(report['invalid'], 0)
+
+        self.assertEqual(report['periods_updated'], 3)
+        self.assertEqual(Period.objects.filter(user=self.user).count(), 3)
+        imported = DailyLog.objects.get(user=self.user)
+        self.assertEqual(imported.mood, 'calm')
+        self.assertEqual(
+            dict(DailySymptom.objects.filter(daily_log=imported).values_list('symptom__name', 'severity')),
+            {'Cramps': 4, 'Headache': 2}
+        )
+        self.cramps.refresh_from_db()
+        self.assertEqual(self.cramps.usage_count, 2)
+        self.assertEqual(
+            CycleProfile.objects.get(user=self.user).first_period_date, date(2024, 1, 1)
+        )
+        self.assertTrue(Prediction.objects.filter(user=self.user, is_active=True).exists())
+
+    def test_csv_rows_are_validated(self):
+        data = (
+            'type,start_date,end_date,date,mood,pain_level,symptoms\n'
+            'periods,2024-03-10,2024-03-05,,,,\n'
+            'periods,2024-03-01,2024-03-05,,,,\n'
+            'daily_logs,,,2024-03-02,grumpy,,\n'
+            'daily_logs,,,2024-03-03,sad,11,\n'
+            'daily_logs,,,2024-03-04,sad,3,Cramps:2;Dizziness:1\n'
+        )
+        report = import_history(self.user, io.BytesIO(data.encode()), 'csv')
+        self.assertEqual(report['rows'], 5)
+        self.assertEqual(report['invalid'], 3)
+        self.assertEqual([number for number, _ in report['errors']], [2, 4, 5])
+        self.assertIn('End date cannot be before start date.', report['errors'][0][1])
+        self.assertEqual(report['unknown_symptoms'], 1)
+        self.assertEqual(DailyLog.objects.get(user=self.user).pain_level, 3)
+
+    def test_overlapping_periods_are_rejected(self):
+        Period.objects.create(user=self.user, start_date=date(2024, 3, 1), end_date=date(2024, 3, 5))
+        data = (
+            'type,start_date,end_date,date,mood,pain_level,symptoms\n'
+            'periods,2024-03-01,2024-03-06,,,,\n'
+            'periods,2024-03-04,2024-03-08,,,,\n'
+            'periods,2024-03-29,,,,,\n'
+            'periods,2024-03-26,2024-03-29,,,,\n'
+            'periods,2024-03-30,2024-04-02,,,,\n'
+        )
+        report = import_history(self.user, io.BytesIO(data.encode()), 'csv')
+        self.assertEqual(report['invalid'], 2)
+        self.assertEqual([number for number, _ in report['errors']], [3, 5])
+        self.assertIn('overlaps the period starting 2024-03-01', report['errors'][0][1])
+        self.assertEqual(
+            list(Period.objects.filter(user=self.user).order_by('start_date').values_list(
+                'start_date', 'end_date'
+            )),
+            [
+                (date(2024, 3, 1), date(2024, 3, 6)),
+                (date(2024, 3, 29), None),
+                (date(2024, 3, 30), date(2024, 4, 2)),
+            ]
+        )
+
+    def test_upload_view(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile(
+            'history.json', json.dumps({'periods': [{'start_date': '2024-05-01'}]}).encode()
+        )
+        response = self.client.post(reverse('import_history'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report']['periods_created'], 1)
+        self.assertTrue(Period.objects.filter(user=self.user, start_date=date(2024, 5, 1)).exists())
+
+        upload = SimpleUploadedFile('history.txt', b'nothing')
+        response = self.client.post(reverse('import_history'), {'file': upload})
+        self.assertFormError(response.context['form'], 'file', 'Upload a .ndjson, .json, .csv or .zip file.')
+
+
+@override_settings(MYFLO_RESEARCH_PSEUDONYM_KEY='research-test-key')
+class ResearchExportTests(TestCase):
+    def setUp(self):
+        self.cramps = Symptom.objects.create(name='Cramps', category='physical')
+        self.sharing = User.objects.create_user('sharing')
+        Settings.objects.create(user=self.sharing, share_data_for_research=True)
+        private = User.objects.create_user('private')
+        Settings.objects.create(user=private)
+        for user in (self.sharing, private):
+            Period.objects.create(user=user, start_date=date(2024, 1, 1), notes='private note')
+            daily_log = DailyLog.objects.create(user=user, date=date(2024, 1, 2), pain_level=4)
+            save_daily_symptoms(daily_log, {self.cramps.pk: 3})
+        self.output_dir = tempfile.mkdtemp()
+
+    def load(self, part):
+        import numpy as np
+        with np.load(os.path.join(self.output_dir, part)) as data:
+            return dict(data)
+
+    def test_only_consenting_users_are_exported(self):
+        report = export_research_data(self.output_dir)
+        self.assertEqual(report['rows'], {'periods': 1, 'daily_logs': 1, 'symptoms': 1})
+        data = self.load(report['parts'][0])
+        pseudonym = data['periods_user'][0].decode()
+        self.assertNotIn('sharing', pseudonym)
+        self.assertEqual(data['daily_logs_user'][0].decode(), pseudonym)
+        self.assertEqual(data['daily_logs_pain_level'].tolist(), [4])
+        self.assertEqual(data['symptoms_symptom'].tolist(), [self.cramps.pk])
+        # Dates move together, so intervals survive
+        self.assertEqual(
+            (data['daily_logs_date'] - data['periods_start_date']).astype(int).tolist(), [1]
+        )
+        self.assertNotIn('periods_notes', data)
+
+    def test_incremental_run(self):
+        export_research_data(self.output_dir)
+        report = export_research_data(self.output_dir)
+        self.assertEqual(report['parts'], [])
+
+        DailyLog.objects.create(user=self.sharing, date=date(2024, 1, 3), mood='calm')
+        newcomer = User.objects.get(username='private')
+        newcomer.settings.share_data_for_research = True
+        newcomer.settings.save()
+        report = export_research_data(self.output_dir)
+        # The new log, plus the whole history of the newly consenting user
+        self.assertEqual(report['rows'], {'periods': 1, 'daily_logs': 2, 'symptoms': 1})
+        manifest = read_manifest(self.output_dir)
+        self.assertEqual(len(manifest['users']), 2)
+        self.assertEqual(len(manifest['runs']), 3)
+
+    def test_refused_without_a_dedicated_key(self):
+        for key in ('', settings.SECRET_KEY):
+            with override_settings(MYFLO_RESEARCH_PSEUDONYM_KEY=key):
+                with self.assertRaisesMessage(CommandError, 'MYFLO_RESEARCH_PSEUDONYM_KEY'):
+                    call_command('export_research_data', self.output_dir, stdout=StringIO())
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        CycleProfile.objects.create(user=self.user)
+        cramps = Symptom.objects.create(name='Cramps', category='physical')
+        Period.objects.create(user=self.user, start_date=date(2024, 1, 1), end_date=date(2024, 1, 5))
+        daily_log = DailyLog.objects.create(user=self.user, date=date(2024, 1, 2), mood='calm')
+        save_daily_symptoms(daily_log, {cramps.pk: 2})
+        self.notification = Notification.objects.create(
+            user=self.user, notification_type='general', title='Hi', message='...',
+            scheduled_date=timezone.now()
+        )
+        self.client.force_login(self.user)
+
+    def test_field_projection(self):
+        response = self.client.get(reverse('api_daily_logs'), {'fields': 'symptoms,date'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'date': '2024-01-02', 'symptoms': [{'symptom': 'Cramps', 'severity': 2}]}
+        ])
+        response = self.client.get(reverse('api_periods'), {'fields': 'start_date,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        url = reverse('api_periods')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(response.json()['count'], 1)
+        # Deletions don't move any timestamp, so only the ETag validates
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # The session, its user, then the aggregate; no rows are read
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # A projection is a different representation
+        response = self.client.get(url, {'fields': 'start_date'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        Period.objects.create(user=self.user, start_date=date(2024, 2, 1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_etag_follows_changes_without_timestamps(self):
+        url = reverse('api_notifications')
+        etag = self.client.get(url)['ETag']
+        Notification.objects.filter(pk=self.notification.pk).update(is_read=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['results'][0]['is_read'])
+
+    def test_etag_follows_edits(self):
+        appointment = Appointment.objects.create(
+            user=self.user, appointment_date=timezone.now(), appointment_type='other'
+        )
+        url = reverse('api_appointments')
+        etag = self.client.get(url)['ETag']
+        appointment.notes = 'Moved to the afternoon'
+        appointment.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = reverse('api_notifications')
+        etag = self.client.get(url)['ETag']
+        self.notification.title = 'Hello'
+        self.notification.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_periods')).status_code, 401)
+
+
+@override_settings(MYFLO_SYNC_SETTLE_SECONDS=0)
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        CycleProfile.objects.create(user=self.user)
+        self.cramps = Symptom.objects.create(name='Cramps', category='physical')
+        self.periods = [
+            Period.objects.create(user=self.user, start_date=date(2024, month, 1))
+            for month in (1, 2, 3)
+        ]
+        self.daily_log = DailyLog.objects.create(user=self.user, date=date(2024, 1, 2))
+        save_daily_symptoms(self.daily_log, {self.cramps.pk: 2})
+        self.client.force_login(self.user)
+
+    def pull(self, cursor=None, limit=2):
+        """Every page of one sync session: (changes, deleted, cursor)"""
+        changes, deleted = defaultdict(list), []
+        while True:
+            params = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+            page = self.client.get(reverse('api_sync'), params).json()
+            for resource, rows in page['changes'].items():
+                changes[resource].extend(rows)
+            deleted.extend(page['deleted'])
+            cursor = page['cursor']
+            if not page['has_more']:
+                return changes, deleted, cursor
+
+    def push(self, *changes):
+        return self.client.post(
+            reverse('api_sync'), json.dumps({'changes': changes}), content_type='application/json'
+        )
+
+    def test_pull_pages_and_deltas(self):
+        changes, deleted, cursor = self.pull()
+        self.assertEqual(len(changes['periods']), 3)
+        self.assertEqual(changes['daily_logs'][0]['symptoms'][0]['severity'], 2)
+        self.assertEqual(deleted, [])
+
+        # Nothing changed, nothing sent
+        changes, deleted, cursor = self.pull(cursor)
+        self.assertFalse(any(changes.values()) or deleted)
+
+        save_daily_symptoms(self.daily_log, {self.cramps.pk: 4})
+        deleted_id = self.periods[0].pk
+        self.periods[0].delete()
+        changes, deleted, cursor = self.pull(cursor)
+        self.assertEqual([row['id'] for row in changes['daily_logs']], [self.daily_log.pk])
+        self.assertEqual(changes['daily_logs'][0]['symptoms'][0]['severity'], 4)
+        self.assertEqual(changes['periods'], [])
+        self.assertEqual(deleted[0]['resource'], 'periods')
+        self.assertEqual(deleted[0]['id'], deleted_id)
+
+        response = self.client.get(reverse('api_sync'), {'cursor': cursor[:-2] + 'xx'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_push_applies_changes_and_reports_conflicts(self):
+        changes, _, _ = self.pull(limit=100)
+        first, second = changes['periods'][:2]
+        Period.objects.filter(pk=second['id']).update(notes='edited on the web', updated_at=timezone.now())
+
+        response = self.push(
+            {'resource': 'periods', 'id': first['id'], 'updated_at': first['updated_at'],
+             'data': {'end_date': '2024-01-05'}},
+            {'resource': 'periods', 'id': second['id'], 'updated_at': second['updated_at'],
+             'data': {'notes': 'edited offline'}},
+            {'resource': 'periods', 'data': {'start_date': '2024-03-01'}, 'ref': 'dup'},
+            {'resource': 'daily_logs', 'data': {'date': '2024-01-03', 'mood': 'calm',
+             'symptoms': [{'symptom': self.cramps.pk, 'severity': 3}]}, 'ref': 'new-log'},
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([entry['reason'] for entry in body['conflicts']], ['changed', 'exists'])
+        self.assertEqual(body['conflicts'][0]['current']['notes'], 'edited on the web')
+        self.assertEqual([entry['ref'] for entry in body['applied']], [None, 'new-log'])
+
+        self.assertEqual(Period.objects.get(pk=first['id']).end_date, date(2024, 1, 5))
+        self.assertEqual(Period.objects.get(pk=second['id']).notes, 'edited on the web')
+        new_log = DailyLog.objects.get(user=self.user, date=date(2024, 1, 3))
+        self.assertEqual(symptom_severities(new_log), {self.cramps.pk: 3})
+
+    def test_invalid_push_is_rolled_back(self):
+        response = self.push(
+            {'resource': 'daily_logs', 'data': {'date': '2024-02-03'}},
+            {'resource': 'periods', 'data': {'start_date': '2024-05-10', 'end_date': '2024-05-01'}},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('change 1', response.json()['error'])
+        self.assertFalse(DailyLog.objects.filter(date=date(2024, 2, 3)).exists())
+
+    def test_invalid_ids_are_rejected(self):
+        updated_at = self.periods[0].updated_at.isoformat()
+        for row_id in ('abc', '1', 1.5, True, [1], 2 ** 63, 0):
+            response = self.push({
+                'resource': 'periods', 'op': 'delete', 'id': row_id, 'updated_at': updated_at,
+            })
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('change 0: id:', response.json()['error'])
+        self.assertEqual(Period.objects.count(), 3)
+
+    def test_deleting_the_account_leaves_no_tombstones(self):
+        self.daily_log.delete()
+        self.user.delete()
+        self.assertFalse(SyncTombstone.objects.exists())
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        DailyLog.objects.bulk_create([
+            DailyLog(user=self.user, date=date(2024, 1, 1) + timedelta(days=day)) for day in range(70)
+        ])
+        now = timezone.now()
+        # Equal timestamps: the id breaks the tie
+        Notification.objects.bulk_create([
+            Notification(user=self.user, notification_type='general', title=f'N{index}',
+                         message='...', scheduled_date=now)
+            for index in range(45)
+        ])
+        Notification.objects.update(created_at=now)
+        self.client.force_login(self.user)
+
+    def walk(self, url_name, context_name):
+        """Follow the Older links from the first page; returns every page"""
+        pages, params = [], {}
+        while True:
+            page = self.client.get(reverse(url_name), params).context[context_name]
+            pages.append(page)
+            if not page.has_next:
+                return pages
+            params = {'after': page.next_cursor}
+
+    def test_pages_cover_every_row_once(self):
+        pages = self.walk('daily_log_history', 'logs')
+        self.assertEqual([len(page) for page in pages], [30, 30, 10])
+        dates = [log.date for page in pages for log in page]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertEqual(len(set(dates)), 70)
+        self.assertIsNone(pages[0].previous_cursor)
+
+        pages = self.walk('notifications', 'notifications')
+        ids = [notification.pk for page in pages for notification in page]
+        self.assertEqual(ids, sorted(Notification.objects.values_list('id', flat=True), reverse=True))
+
+    def test_previous_page_and_count(self):
+        first, second, _ = self.walk('daily_log_history', 'logs')
+        back = self.client.get(
+            reverse('daily_log_history'), {'before': second.previous_cursor}
+        ).context['logs']
+        self.assertEqual([log.pk for log in back], [log.pk for log in first])
+        self.assertFalse(back.has_previous)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('daily_log_history'), {'after': second.next_cursor})
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        page = self.client.get(reverse('daily_log_history'), {'count': '1'}).context['logs']
+        self.assertEqual(page.count, 70)
+
+    def test_bad_cursor_shows_first_page(self):
+        page = self.client.get(reverse('period_list'), {'after': 'not-a-cursor'}).context['periods']
+        self.assertFalse(page.has_previous)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        CycleProfile.objects.create(user=self.user)
+        today = date.today()
+        for months_ago in range(4):
+            Period.objects.create(
+                user=self.user, start_date=today - timedelta(days=28 * months_ago + 3),
+                end_date=today - timedelta(days=28 * months_ago)
+            )
+        DailyLog.objects.create(user=self.user, date=today, mood='happy', energy_level=4)
+        Prediction.objects.create(
+            user=self.user, prediction_type='next_period', predicted_date=today + timedelta(days=25)
+        )
+        Notification.objects.bulk_create([
+            Notification(user=self.user, notification_type='general', title=f'N{index}',
+                         message='Welcome', scheduled_date=timezone.now() - timedelta(hours=1))
+            for index in range(25)
+        ])
+        self.client.force_login(self.user)
+
+    def async_get(self, view, path, params=None, user=None):
+        request = AsyncRequestFactory().get(path, params or {})
+        request.session = self.client.session
+        user = user or self.user
+
+        async def auser():
+            return user
+        request.auser = auser
+        return async_to_sync(view)(request)
+
+    def page(self, response):
+        return re.sub(rb'name="csrfmiddlewaretoken" value="[^"]*"', b'', response.content)
+
+    def test_same_pages_as_sync_views(self):
+        notification = Notification.objects.filter(user=self.user).order_by('-created_at', '-id')[19]
+        cursor = self.client.get(reverse('notifications')).context['notifications'].next_cursor
+        for url_name, view, params in [
+            ('dashboard', async_views.dashboard_view, {}),
+            ('calendar', async_views.calendar_view, {}),
+            ('calendar_grid', async_views.calendar_grid_view, {'year': 2024, 'month': 2}),
+            ('analytics', async_views.analytics_view, {}),
+            ('notifications', async_views.notifications_view, {}),
+            ('notifications', async_views.notifications_view, {'after': cursor, 'count': '1'}),
+        ]:
+            with self.subTest(view=url_name, params=params):
+                cache.clear()
+                expected = self.client.get(reverse(url_name), params)
+                cache.clear()
+                response = self.async_get(view, reverse(url_name), params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.page(response), self.page(expected))
+        self.assertContains(response, '25 notifications')
+        self.assertNotContains(response, f'>{notification.title}<')
+
+    def test_cached_dashboard_is_shared_with_sync_view(self):
+        self.client.get(reverse('dashboard'))
+        # User and session come with the request; the bundle from the cache
+        with self.assertNumQueries(0):
+            response = self.async_get(async_views.dashboard_view, reverse('dashboard'))
+        self.assertContains(response, 'Welcome')
+
+    def test_anonymous_user_is_redirected(self):
+        response = self.async_get(async_views.analytics_view, reverse('analytics'), user=AnonymousUser())
+        self.assertEqual(response.status_code, 302)
+
+
+@skipUnless(READ_DATABASE in settings.DATABASES, 'needs the production SQLite profile')
+class DatabaseProfileTests(TransactionTestCase):
+    databases = {'default', READ_DATABASE} if READ_DATABASE in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        CycleProfile.objects.create(user=self.user)
+        Period.objects.create(user=self.user, start_date=date.today() - timedelta(days=3))
+        self.client.force_login(self.user)
+
+    def queries(self, method, url_name, data=None):
+        """Queries a request runs on each connection"""
+        with CaptureQueriesContext(connections['default']) as default_queries, \
+                CaptureQueriesContext(connections[READ_DATABASE]) as read_queries:
+            response = getattr(self.client, method)(reverse(url_name), data or {})
+        self.assertIn(response.status_code, (200, 302))
+        return default_queries.captured_queries, read_queries.captured_queries
+
+    def test_read_only_views_use_read_connection(self):
+        for url_name in ['dashboard', 'period_list', 'analytics', 'api_periods']:
+            with self.subTest(view=url_name):
+                cache.clear()
+                default_queries, read_queries = self.queries('get', url_name)
+                self.assertEqual(default_queries, [])
+                self.assertTrue(read_queries)
+
+    def test_writes_and_transactions_stay_on_default(self):
+        default_queries, read_queries = self.queries(
+            'post', 'daily_log', {'date': date.today(), 'flow': 'light', 'mood': 'calm'}
+        )
+        self.assertTrue(any(query['sql'].startswith('INSERT') for query in default_queries))
+        self.assertEqual(read_queries, [])
+
+        with CaptureQueriesContext(connections[READ_DATABASE]) as read_queries:
+            with read_only_queries():
+                self.assertEqual(Period.objects.count(), 1)
+                with transaction.atomic():
+                    # Must see the transaction's own writes
+                    Period.objects.create(user=self.user, start_date=date.today() - timedelta(days=30))
+                    self.assertEqual(Period.objects.count(), 2)
+        self.assertEqual(len(read_queries), 1)
+
+    def test_connection_pragmas(self):
+        with connections['default'].cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+        with self.assertRaises(OperationalError):
+            with connections[READ_DATABASE].cursor() as cursor:
+                cursor.execute('DELETE FROM myflo_period')
+
+
+@override_settings(MYFLO_SHARDS=settings.MYFLO_TEST_SHARDS)
+class ShardRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ShardRouter()
+
+    def test_users_are_spread_over_the_shards(self):
+        placements = [hash_shard(user_id) for user_id in range(1, 201)]
+        self.assertEqual(placements, [hash_shard(user_id) for user_id in range(1, 201)])
+        self.assertEqual(set(placements), {'shard_0', 'shard_1'})
+        self.assertGreater(placements.count('shard_0'), 60)
+        self.assertGreater(placements.count('shard_1'), 60)
+
+    def test_shard_of_id(self):
+        self.assertEqual(shard_of_id(5), 'default')
+        self.assertEqual(shard_of_id((1 << SHARD_ID_BITS) + 5), 'shard_0')
+        self.assertEqual(shard_of_id(2 << SHARD_ID_BITS), 'shard_1')
+
+    def test_queries_are_routed_by_instance_or_context(self):
+        cache.set(shard_map_key(7), 'shard_1')
+        self.assertEqual(self.router.db_for_write(Period, instance=Period(user_id=7)), 'shard_1')
+        daily_symptom = DailySymptom(daily_log_id=(1 << SHARD_ID_BITS) + 3)
+        self.assertEqual(self.router.db_for_write(DailySymptom, instance=daily_symptom), 'shard_0')
+        with use_shard('shard_0'):
+            self.assertEqual(Period.objects.all().db, 'shard_0')
+            # Users and catalogs are written once, to the default database
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            self.assertEqual(self.router.db_for_write(Symptom), 'default')
+        with self.assertRaises(ShardNotSelected):
+            Period.objects.count()
+
+    @override_settings(MYFLO_SHARDS=[])
+    def test_nothing_changes_without_shards(self):
+        self.assertIsNone(self.router.db_for_read(Period))
+        self.assertEqual(shard_for_user(7), 'default')
+        self.assertEqual(Period.objects.count(), 0)
+
+
+@override_settings(MYFLO_SHARDS=settings.MYFLO_TEST_SHARDS)
+class ShardingTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        # The test databases were migrated before the shards were turned on
+        for alias in shard_aliases():
+            seed_id_range(alias)
+            copy_catalogs(alias)
+        self.symptom = Symptom.objects.create(name='Cramps', category='physical')
+        self.user = User.objects.create_user('flo', password='secret-pass-123')
+        self.shard = shard_for_user(self.user.pk)
+        with use_user_shard(self.user):
+            CycleProfile.objects.create(user=self.user)
+            self.period = Period.objects.create(user=self.user, start_date=date(2024, 1, 1))
+            self.daily_log = DailyLog.objects.create(user=self.user, date=date(2024, 1, 2), flow='light')
+            DailySymptom.objects.create(daily_log=self.daily_log, symptom=self.symptom, severity=3)
+
+    def test_rows_live_on_the_users_shard(self):
+        self.assertEqual(self.shard, hash_shard(self.user.pk))
+        index = shard_aliases().index(self.shard) + 1
+        self.assertEqual(self.period.pk >> SHARD_ID_BITS, index)
+        self.assertEqual(Period.objects.using(self.shard).count(), 1)
+        self.assertEqual(Period.objects.using('default').count(), 0)
+        self.assertTrue(User.objects.using(self.shard).filter(pk=self.user.pk).exists())
+        for alias in shard_aliases():
+            self.assertTrue(Symptom.objects.using(alias).filter(name='Cramps').exists())
+
+    def test_requests_run_on_the_users_shard(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('dashboard')).status_code, 200)
+        response = self.client.post(
+            reverse('daily_log') + '?date=2024-01-03', {'flow': 'medium', 'mood': 'calm'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(DailyLog.objects.using(self.shard).filter(date=date(2024, 1, 3)).exists())
+
+    def test_move_user(self):
+        target = next(alias for alias in shard_aliases() if alias != self.shard)
+        counts = move_user(self.user.pk, target)
+        self.assertEqual(counts['period'], 1)
+        self.assertEqual(shard_for_user(self.user.pk), target)
+        self.assertEqual(Period.objects.using(self.shard).count(), 0)
+        self.assertFalse(User.objects.using(self.shard).filter(pk=self.user.pk).exists())
+
+        with use_shard(target):
+            period = Period.objects.get(user=self.user)
+            daily_symptom = DailySymptom.objects.select_related('daily_log').get()
+            tombstones = set(SyncTombstone.objects.values_list('resource', 'object_id'))
+        self.assertEqual(shard_of_id(period.pk), target)
+        self.assertEqual(period.created_at, self.period.created_at)
+        self.assertEqual(daily_symptom.daily_log.date, self.daily_log.date)
+        self.assertIn(('periods', self.period.pk), tombstones)
+        self.assertIn(('daily_logs', self.daily_log.pk), tombstones)
+
+    def test_rebalance_moves_users_to_their_hash_shard(self):
+        move_user(self.user.pk, 'default')
+        self.assertEqual(Period.objects.using('default').count(), 1)
+        call_command('rebalance_shards', settle=0, stdout=StringIO())
+        self.assertEqual(shard_for_user(self.user.pk), self.shard)
+        self.assertEqual(Period.objects.using('default').count(), 0)
+        self.assertEqual(Period.objects.using(self.shard).count(), 1)
+
+    def test_fan_out(self):
+        other = User.objects.create_user('ebb', password='secret-pass-123')
+        with use_user_shard(other):
+            Period.objects.create(user=other, start_date=date(2024, 2, 1))
+        for workers in (1, 2):
+            counts = fan_out(Period.objects.count, workers=workers)
+            self.assertEqual(sum(counts.values()), 2)
+            self.assertEqual(counts['default'], 0)
+
+    def test_deleting_a_user_deletes_their_shard_rows(self):
+        self.user.delete()
+        self.assertEqual(Period.objects.using(self.shard).count(), 0)
+        self.assertEqual(DailySymptom.objects.using(self.shard).count(), 0)
+        self.assertFalse(User.objects.using(self.shard).exists())
+
+    def test_admin_lists_one_shard_at_a_time(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-123')
+        self.client.force_login(admin_user)
+        url = reverse('admin:myflo_period_changelist')
+        self.assertContains(self.client.get(url, {'shard': self.shard}), '1 period')
+        self.assertContains(self.client.get(url), '0 periods')
+        change_url = reverse('admin:myflo_period_change', args=[self.period.pk])
+        self.assertContains(self.client.get(change_url), '2024-01-01')
+
+
+class SyntheticDataTests(TestCase):
+    def history(self, prefix):
+        """Everything generated for the users named prefix*, without ids or the prefix"""
+        users = {'user__username__startswith': prefix}
+        return [
+            [(name[len(prefix):], *row) for name, *row in rows] for rows in (
+                Period.objects.filter(**users).order_by('user__username', 'start_date')
+                .values_list('user__username', 'start_date', 'end_date', 'flow_intensity'),
+                DailyLog.objects.filter(**users).order_by('user__username', 'date')
+                .values_list('user__username', 'date', 'flow', 'mood', 'pain_level', 'sleep_hours'),
+                DailySymptom.objects.filter(daily_log__user__username__startswith=prefix)
+                .order_by('daily_log__user__username', 'daily_log__date', 'symptom__name')
+                .values_list('daily_log__user__username', 'daily_log__date', 'symptom__name', 'severity'),
+                ContraceptiveUse.objects.filter(**users).order_by('user__username', 'date_taken')
+                .values_list('user__username', 'date_taken', 'reason'),
+                Appointment.objects.filter(**users).order_by('user__username', 'appointment_date')
+                .values_list('user__username', 'appointment_date', 'health_provider__name'),
+                Notification.objects.filter(**users).order_by('user__username', 'scheduled_date')
+                .values_list('user__username', 'scheduled_date', 'notification_type', 'is_read'),
+            )
+        ]
+
+    def test_same_seed_gives_the_same_data_in_any_chunking(self):
+        end = date(2025, 6, 30)
+        counts = seed_synthetic_data(5, end, seed=7, years=1, prefix='a', chunk_size=1)
+        seed_synthetic_data(5, end, seed=7, years=1, prefix='b', chunk_size=3)
+        seed_synthetic_data(5, end, seed=8, years=1, prefix='c')
+        self.assertEqual(self.history('a'), self.history('b'))
+        self.assertNotEqual(self.history('a'), self.history('c'))
+
+        self.assertEqual(counts['users'], 5)
+        self.assertEqual(counts['daily_logs'], DailyLog.objects.filter(user__username__startswith='a').count())
+        self.assertGreater(counts['periods'], 5)
+        self.assertTrue(Symptom.objects.exists())
+        self.assertEqual(
+            sum(Symptom.objects.values_list('usage_count', flat=True)), DailySymptom.objects.count()
+        )
+        self.assertFalse(DailyLog.objects.filter(date__gt=end).exists())
+
+    def test_command_replaces_only_when_asked(self):
+        call_command('seed_synthetic', users=2, years=0.5, workers=1, stdout=StringIO())
+        logs = DailyLog.objects.count()
+        with self.assertRaises(CommandError):
+            call_command('seed_synthetic', users=2, years=0.5, workers=1, stdout=StringIO())
+        call_command('seed_synthetic', users=2, years=0.5, workers=1, replace=True, stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='synthetic').count(), 2)
+        self.assertEqual(DailyLog.objects.count(), logs)
+        self.assertEqual(
+            sum(Symptom.objects.values_list('usage_count', flat=True)), DailySymptom.objects.count()
+        )
+        self.assertFalse(SyncTombstone.objects.exists())
+
+
+class ViewBenchmarkTests(TransactionTestCase):
+    databases = {'default', READ_DATABASE} if READ_DATABASE in settings.DATABASES else {'default'}
+
+    def test_find_regressions(self):
+        view = {'status': 200, 'median_ms': 10, 'min_ms': 10, 'queries': 4, 'peak_kib': 100}
+        baseline = {'profiles': {'small': {'views': {'dashboard': view}}}}
+
+        def results(**changes):
+            return {'profiles': {'small': {'views': {
+                'dashboard': dict(view, **changes), 'new_page': view,
+            }}}}
+
+        self.assertEqual(find_regressions(results(queries=3, min_ms=14, peak_kib=300), baseline), [])
+        self.assertEqual(
+            find_regressions(results(status=500, queries=5, min_ms=20, peak_kib=1000), baseline), [
+                'small dashboard: status 500',
+                'small dashboard: 5 queries, budget 4',
+                'small dashboard: 20.0 ms, was 10.0',
+                'small dashboard: 1000 KiB peak, was 100',
+            ]
+        )
+        self.assertEqual(
+            find_regressions(results(min_ms=20, peak_kib=1000), baseline, None, None), []
+        )
+        self.assertEqual(
+            find_regressions(results(status=404), baseline, None, None),
+            ['small dashboard: status 404, was 200']
+        )
+        # A server error fails even when the baseline recorded it
+        broken = {'profiles': {'small': {'views': {'dashboard': dict(view, status=500)}}}}
+        self.assertEqual(
+            find_regressions(broken, broken, None, None), ['small dashboard: status 500']
+        )
+
+    def test_query_budgets_of_the_baseline(self):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+        results = run_view_benchmark(repeat=1, profiles=['small'])
+        views = results['profiles']['small']['views']
+        self.assertEqual(list(views), [name for name, _ in benchmark_urls()])
+        self.assertEqual(server_errors(results), [])
+        self.assertGreater(views['dashboard']['queries'], 0)
+        self.assertEqual(find_regressions(results, baseline, None, None), [])
@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, sync, views
+
+# Read-heavy pages can be served from their async versions under ASGI
+read_views = async_views if settings.MYFLO_ASYNC_VIEWS else views
 
 urlpatterns = [
     # Authentication URLs
@@ -8,7 +12,7 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     
     # Dashboard
-    path('dashboard/', views.dashboard_view, name='dashboard'),
+    path('dashboard/', read_views.dashboard_view, name='dashboard'),
     
     # Profile URLs
     path('profile/', views.profile_view, name='profile'),
@@ -26,7 +30,8 @@ urlpatterns = [
     path('log/history/', views.daily_log_history_view, name='daily_log_history'),
     
     # Calendar URLs
-    path('calendar/', views.calendar_view, name='calendar'),
+    path('calendar/', read_views.calendar_view, name='calendar'),
+    path('calendar/grid/', read_views.calendar_grid_view, name='calendar_grid'),
     
     # Contraceptive URLs
     path('contraceptives/', views.contraceptive_list_view, name='contraceptive_list'),
@@ -42,12 +47,22 @@ urlpatterns = [
     
     # Settings URLs
     path('settings/', views.settings_view, name='settings'),
+    path('settings/export/', views.export_data_view, name='export_data'),
+    path('settings/import/', views.import_history_view, name='import_history'),
     
     # Analytics and Insights URLs
     path('insights/', views.insights_view, name='insights'),
-    path('analytics/', views.analytics_view, name='analytics'),
+    path('analytics/', read_views.analytics_view, name='analytics'),
     
     # Notifications URLs
-    path('notifications/', views.notifications_view, name='notifications'),
+    path('notifications/', read_views.notifications_view, name='notifications'),
     path('notifications/<int:notification_id>/read/', views.mark_notification_read_view, name='mark_notification_read'),
-]
\ No newline at end of file
+
+    # JSON API
+    path('api/v1/periods/', api.collection_view, {'resource_name': 'periods'}, name='api_periods'),
+    path('api/v1/daily-logs/', api.collection_view, {'resource_name': 'daily_logs'}, name='api_daily_logs'),
+    path('api/v1/predictions/', api.collection_view, {'resource_name': 'predictions'}, name='api_predictions'),
+    path('api/v1/notifications/', api.collection_view, {'resource_name': 'notifications'}, name='api_notifications'),
+    path('api/v1/appointments/', api.collection_view, {'resource_name': 'appointments'}, name='api_appointments'),
+    path('api/v1/sync/', sync.sync_view, name='api_sync'),
+]
@@ -0,0 +1,204 @@
+import os
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .benchmarking import invalidate_read_caches, percentile
+from .models import Notification, Period
+from .predictions import generate_predictions
+from .routers import READ_DATABASE
+from .sharding import data_aliases, shard_aliases, use_user_shard
+from .synthetic import seed_synthetic_data
+
+# Profile: (days of history, share of days logged) of its synthetic user
+VIEW_BENCHMARK_PROFILES = {
+    'small': (120, 0.3),
+    'medium': (365, 0.6),
+    'large': (5 * 365, 1.0),
+}
+VIEW_BENCHMARK_SEED = 0
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'view_benchmark_baseline.json')
+
+# Smaller differences are noise, whatever the threshold
+MIN_TIME_DELTA_MS = 5
+MIN_MEMORY_DELTA_KIB = 256
+
+# Settings recorded with the results, since they change the numbers
+CONFIGURATION = ['sqlite_profile', 'async_views', 'shards']
+
+# URL keyword argument: the user's row it points at
+URL_ARGUMENTS = {
+    'period_id': lambda user: Period.objects.filter(user=user).latest('start_date').pk,
+    'notification_id': lambda user: Notification.objects.filter(user=user).latest('created_at').pk,
+}
+
+
+def benchmark_urls():
+    """(name, keyword argument names) of every pattern in myflo.urls"""
+    from . import urls
+    return [(pattern.name, list(pattern.pattern.converters)) for pattern in urls.urlpatterns]
+
+
+def seed_profile_users(end_date, profiles=None):
+    """{profile: (user, rows)}: one synthetic user per profile, with predictions"""
+    users = {}
+    for profile in profiles or VIEW_BENCHMARK_PROFILES:
+        history_days, engagement = VIEW_BENCHMARK_PROFILES[profile]
+        prefix = f'viewbench-{profile}-'
+        counts = seed_synthetic_data(
+            1, end_date, seed=VIEW_BENCHMARK_SEED, years=history_days / 365, prefix=prefix,
+            history_days=history_days, engagement=engagement,
+        )
+        user = User.objects.get(username__startswith=prefix)
+        with use_user_shard(user):
+            generate_predictions(user)
+        users[profile] = (user, sum(counts.values()))
+    return users
+
+
+@contextmanager
+def count_queries():
+    """
+    Yields a callable returning the number of queries the block ran, on
+    every database the app uses. Call it before the next request, which
+    resets the query logs.
+    """
+    aliases = data_aliases() + [READ_DATABASE] if READ_DATABASE in settings.DATABASES else data_aliases()
+    with ExitStack() as stack:
+        contexts = [
+            stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in aliases
+        ]
+        yield lambda: sum(len(context) for context in contexts)
+
+
+def get(client, path):
+    response = client.get(path)
+    # Streamed responses do their work while being read
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    response.close()
+    return response.status_code
+
+
+def measure_view(client, user, path, repeat):
+    """
+    Status, median and fastest wall time of `repeat` requests, SQL
+    queries and peak traced memory of GET path, each request with cold
+    page caches. The queries and memory are measured on requests of
+    their own, since capturing them slows the request down.
+    """
+    def cold_get():
+        invalidate_read_caches(user.pk)
+        started = time.perf_counter()
+        status = get(client, path)
+        elapsed = time.perf_counter() - started
+        # Logging out is measured like any other page
+        if client.session.get('_auth_user_id') is None:
+            client.force_login(user)
+        return status, elapsed
+
+    # The first request warms up imports and templates
+    cold_get()
+    timings = sorted(cold_get()[1] * 1000 for _ in range(repeat))
+    with count_queries() as queries:
+        status, _ = cold_get()
+    query_count = queries()
+    tracemalloc.start()
+    try:
+        cold_get()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': status,
+        'median_ms': round(percentile(timings, 0.5), 2),
+        'min_ms': round(timings[0], 2),
+        'queries': query_count,
+        'peak_kib': round(peak / 1024),
+    }
+
+
+def run_view_benchmark(repeat=5, end_date=None, profiles=None):
+    """
+    Seed a user per profile and measure every page of myflo.urls for
+    each. Views that fail are recorded with their 500 status, which
+    find_regressions always reports.
+    """
+    users = seed_profile_users(end_date or date.today(), profiles)
+    client = Client(raise_request_exception=False)
+    results = {
+        'repeat': repeat,
+        'sqlite_profile': settings.SQLITE_PROFILE,
+        'async_views': settings.MYFLO_ASYNC_VIEWS,
+        'shards': len(shard_aliases()),
+        'profiles': {},
+    }
+    for profile, (user, rows) in users.items():
+        client.force_login(user)
+        with use_user_shard(user):
+            arguments = {name: row(user) for name, row in URL_ARGUMENTS.items()}
+        views = {}
+        for name, keywords in benchmark_urls():
+            path = reverse(name, kwargs={keyword: arguments[keyword] for keyword in keywords})
+            views[name] = measure_view(client, user, path, repeat)
+        results['profiles'][profile] = {'rows': rows, 'views': views}
+    return results
+
+
+def configuration_changes(results, baseline):
+    """Settings the results and the baseline were measured under that differ"""
+    return [
+        f'{setting}: {baseline.get(setting)!r} in the baseline, {results[setting]!r} now'
+        for setting in CONFIGURATION if baseline.get(setting) != results[setting]
+    ]
+
+
+def server_errors(results):
+    """Views of the results that answered with a 5xx status"""
+    return [
+        f"{profile} {name}: status {view['status']}"
+        for profile, measured in results['profiles'].items()
+        for name, view in measured['views'].items() if view['status'] >= 500
+    ]
+
+
+def exceeds(value, budget, threshold, min_delta):
+    return threshold is not None and value > budget * (1 + threshold) and value - budget > min_delta
+
+
+def find_regressions(results, baseline, time_threshold=0.5, memory_threshold=0.5):
+    """
+    Differences from the baseline results that fail the benchmark: any
+    server error, even one the baseline has too, a changed status, any
+    query over the baseline count, and wall time or peak memory more than
+    the threshold (a fraction) over the baseline.
+    Wall time compares the fastest requests, the least noisy of them.
+    A threshold of None skips that check. Views missing from the
+    baseline are not compared.
+    """
+    regressions = server_errors(results)
+    for profile, measured in results['profiles'].items():
+        expected = baseline.get('profiles', {}).get(profile, {}).get('views', {})
+        for name, view in measured['views'].items():
+            budget = expected.get(name)
+            if budget is None:
+                continue
+            where = f'{profile} {name}'
+            if view['status'] != budget['status'] and view['status'] < 500:
+                regressions.append(f"{where}: status {view['status']}, was {budget['status']}")
+            if view['queries'] > budget['queries']:
+                regressions.append(f"{where}: {view['queries']} queries, budget {budget['queries']}")
+            if exceeds(view['min_ms'], budget['min_ms'], time_threshold, MIN_TIME_DELTA_MS):
+                regressions.append(f"{where}: {view['min_ms']:.1f} ms, was {budget['min_ms']:.1f}")
+            if exceeds(view['peak_kib'], budget['peak_kib'], memory_threshold, MIN_MEMORY_DELTA_KIB):
+                regressions.append(f"{where}: {view['peak_kib']} KiB peak, was {budget['peak_kib']}")
+    return regressions
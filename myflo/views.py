@@ -4,26 +4,44 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
-from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models import Q, Avg
 from django.utils import timezone
-from datetime import date, datetime, timedelta
-from calendar import monthrange
+from datetime import MAXYEAR, MINYEAR, date, datetime, timedelta
 import json
+import zipfile
 
 from .models import (
     UserProfile, CycleProfile, Period, DailyLog, Symptom, DailySymptom,
     ContraceptiveType, ContraceptiveUse, Prediction, Notification,
     HealthProvider, Appointment, CycleInsight, Settings
 )
+from . import catalogs
+from .calendar_grid import month_span, render_month_fragment
+from .cycle_phases import get_cycle_phases
+from .cycle_stats import get_cycle_stats
+from .dashboard import get_dashboard_bundle
+from .export import EXPORT_FORMATS, export_allowed, export_filename
+from .history_import import import_format_for, import_history
+from .pagination import keyset_page
+from .predictions import generate_predictions
+from .routers import read_only_view
+from .sharding import shard_for_user, use_user_shard
+from .symptoms import (
+    SEVERITY_LABELS, parse_symptom_severities, save_daily_symptoms, symptom_severities
+)
 from .forms import (
     UserProfileForm, CycleProfileForm, PeriodForm, DailyLogForm,
-    ContraceptiveUseForm, HealthProviderForm, AppointmentForm, SettingsForm
+    ContraceptiveUseForm, HealthProviderForm, AppointmentForm, SettingsForm,
+    HistoryImportForm
 )
 
 
+NOTIFICATION_PAGE_KEYS = ['created_at', 'id']
+NOTIFICATIONS_PER_PAGE = 20
+
 
 # Authentication Views
 def register_view(request):
@@ -31,10 +49,11 @@ def register_view(request):
         form = UserCreationForm(request.POST)
         if form.is_valid():
             user = form.save()
-            # Create associated profiles
-            UserProfile.objects.create(user=user)
-            CycleProfile.objects.create(user=user)
-            Settings.objects.create(user=user)
+            # Create associated profiles, on the shard the new user was given
+            with use_user_shard(user):
+                UserProfile.objects.create(user=user)
+                CycleProfile.objects.create(user=user)
+                Settings.objects.create(user=user)
             
             username = form.cleaned_data.get('username')
             messages.success(request, f'Account created for {username}!')
@@ -64,53 +83,19 @@ def logout_view(request):
 
 
 # Dashboard and Main Views
+@read_only_view
 @login_required
 def dashboard_view(request):
-    user = request.user
     today = date.today()
     
-    # Get recent period
-    recent_period = Period.objects.filter(user=user).first()
-    
-    # Get today's log
-    today_log, created = DailyLog.objects.get_or_create(
-        user=user, 
-        date=today,
-        defaults={'flow': 'none'}
-    )
-    
-    # Get predictions
-    predictions = Prediction.objects.filter(
-        user=user,
-        is_active=True,
-        predicted_date__gte=today
-    ).order_by('predicted_date')
-    
-    # Get recent insights
-    insights = CycleInsight.objects.filter(
-        user=user,
-        is_dismissed=False
-    )[:3]
-    
-    # Get unread notifications
-    notifications = Notification.objects.filter(
-        user=user,
-        is_read=False,
-        scheduled_date__lte=timezone.now()
-    )[:5]
-    
-    context = {
-        'recent_period': recent_period,
-        'today_log': today_log,
-        'predictions': predictions,
-        'insights': insights,
-        'notifications': notifications,
-        'today': today,
-    }
+    # Recent period, today's log, predictions, insights and notifications
+    context = dict(get_dashboard_bundle(request.user, today=today))
+    context['today'] = today
     return render(request, 'dashboard.html', context)
 
 
 # Profile Views
+@read_only_view
 @login_required
 def profile_view(request):
     user_profile = get_object_or_404(UserProfile, user=request.user)
@@ -149,7 +134,7 @@ def edit_cycle_profile_view(request):
             form.save()
             messages.success(request, 'Cycle profile updated successfully!')
             # Regenerate predictions after profile update
-            generate_predictions(request.user)
+            report_prediction_changes(request, generate_predictions(request.user))
             return redirect('profile')
     else:
         form = CycleProfileForm(instance=cycle_profile)
@@ -158,12 +143,10 @@ def edit_cycle_profile_view(request):
 
 
 # Period Tracking Views
+@read_only_view
 @login_required
 def period_list_view(request):
-    periods = Period.objects.filter(user=request.user)
-    paginator = Paginator(periods, 10)
-    page_number = request.GET.get('page')
-    periods = paginator.get_page(page_number)
+    periods = keyset_page(Period.objects.filter(user=request.user), ['start_date'], request, 10)
     
     return render(request, 'period_list.html', {'periods': periods})
 
@@ -183,10 +166,10 @@ def add_period_view(request):
                 cycle_profile.first_period_date = period.start_date
                 cycle_profile.save()
             
-            # Generate new predictions
-            generate_predictions(request.user)
-            
             messages.success(request, 'Period added successfully!')
+            
+            # Generate new predictions
+            report_prediction_changes(request, generate_predictions(request.user))
             return redirect('period_list')
     else:
         form = PeriodForm()
@@ -202,8 +185,8 @@ def edit_period_view(request, period_id):
         form = PeriodForm(request.POST, instance=period)
         if form.is_valid():
             form.save()
-            generate_predictions(request.user)
             messages.success(request, 'Period updated successfully!')
+            report_prediction_changes(request, generate_predictions(request.user))
             return redirect('period_list')
     else:
         form = PeriodForm(instance=period)
@@ -217,8 +200,8 @@ def delete_period_view(request, period_id):
     
     if request.method == 'POST':
         period.delete()
-        generate_predictions(request.user)
         messages.success(request, 'Period deleted successfully!')
+        report_prediction_changes(request, generate_predictions(request.user))
         return redirect('period_list')
     
     return render(request, 'delete_period.html', {'period': period})
@@ -238,126 +221,91 @@ def daily_log_view(request):
     else:
         log_date = today
     
-    daily_log, created = DailyLog.objects.get_or_create(
-        user=request.user,
-        date=log_date,
-        defaults={'flow': 'none'}
-    )
+    # Only create the log once something is actually saved
+    daily_log = DailyLog.objects.filter(user=request.user, date=log_date).first()
+    if daily_log is None:
+        daily_log = DailyLog(user=request.user, date=log_date, flow='none')
     
     if request.method == 'POST':
         form = DailyLogForm(request.POST, instance=daily_log)
         if form.is_valid():
-            form.save()
-            
-            # Handle symptoms
-            symptom_ids = request.POST.getlist('symptoms')
-            severities = request.POST.getlist('severities')
-            
-            # Clear existing symptoms
-            DailySymptom.objects.filter(daily_log=daily_log).delete()
-            
-            # Add new symptoms
-            for i, symptom_id in enumerate(symptom_ids):
-                if symptom_id and i < len(severities) and severities[i]:
-                    DailySymptom.objects.create(
-                        daily_log=daily_log,
-                        symptom_id=symptom_id,
-                        severity=int(severities[i])
-                    )
+            with transaction.atomic(using=shard_for_user(request.user.pk)):
+                form.save()
+                
+                # Handle symptoms; quick-log forms (e.g. on the dashboard)
+                # don't carry the symptom list and must not clear it
+                if 'symptoms_submitted' in request.POST:
+                    save_daily_symptoms(daily_log, parse_symptom_severities(request.POST))
             
             messages.success(request, f'Daily log for {log_date} saved successfully!')
             return redirect('daily_log')
     else:
         form = DailyLogForm(instance=daily_log)
     
-    # Get all symptoms for the form
-    symptoms = Symptom.objects.all().order_by('category', 'name')
-    existing_symptoms = DailySymptom.objects.filter(daily_log=daily_log)
+    # Get all symptoms for the form, grouped by category, each with its
+    # recorded severity
+    severities = symptom_severities(daily_log)
+    symptom_groups = [
+        (category, [
+            {'symptom': symptom, 'severity': severities.get(symptom.id)}
+            for symptom in symptoms_in_category
+        ])
+        for category, symptoms_in_category in catalogs.symptoms.grouped()
+    ]
     
     context = {
         'form': form,
         'daily_log': daily_log,
         'log_date': log_date,
-        'symptoms': symptoms,
-        'existing_symptoms': existing_symptoms,
+        'prev_date': log_date - timedelta(days=1),
+        'next_date': log_date + timedelta(days=1),
+        'symptom_groups': symptom_groups,
+        'severity_labels': SEVERITY_LABELS,
         'today': today,
     }
     return render(request, 'daily_log.html', context)
 
 
+@read_only_view
 @login_required
 def daily_log_history_view(request):
-    logs = DailyLog.objects.filter(user=request.user).order_by('-date')
-    paginator = Paginator(logs, 30)
-    page_number = request.GET.get('page')
-    logs = paginator.get_page(page_number)
+    logs = keyset_page(DailyLog.objects.filter(user=request.user), ['date'], request, 30)
     
     return render(request, 'daily_log_history.html', {'logs': logs})
 
 
 # Calendar Views
+@read_only_view
 @login_required
 def calendar_view(request):
-    year = int(request.GET.get('year', date.today().year))
-    month = int(request.GET.get('month', date.today().month))
+    year, month = requested_month(request)
     
-    # Get the first and last day of the month
-    first_day = date(year, month, 1)
-    last_day = date(year, month, monthrange(year, month)[1])
-    
-    # Get periods for this month
-    periods = Period.objects.filter(
-        user=request.user,
-        start_date__lte=last_day,
-        end_date__gte=first_day
-    )
+    # Render (or reuse) the month grid
+    calendar_grid_html = render_month_fragment(request.user, year, month)
     
-    # Get daily logs for this month
-    daily_logs = DailyLog.objects.filter(
-        user=request.user,
-        date__range=[first_day, last_day]
-    )
-    
-    # Get predictions for this month
-    predictions = Prediction.objects.filter(
-        user=request.user,
-        is_active=True,
-        predicted_date__range=[first_day, last_day]
-    )
-    
-    # Create calendar data
-    calendar_data = []
-    current_date = first_day
-    while current_date <= last_day:
-        day_data = {
-            'date': current_date,
-            'periods': [p for p in periods if p.start_date <= current_date <= (p.end_date or p.start_date)],
-            'daily_log': next((log for log in daily_logs if log.date == current_date), None),
-            'predictions': [p for p in predictions if p.predicted_date == current_date],
-        }
-        calendar_data.append(day_data)
-        current_date += timedelta(days=1)
-    
-    # Navigation dates
-    prev_month = first_day - timedelta(days=1)
-    next_month = last_day + timedelta(days=1)
+    return render(request, 'calendar.html', calendar_context(year, month, calendar_grid_html))
+
+
+@read_only_view
+@login_required
+def calendar_grid_view(request):
+    year, month = requested_month(request)
     
-    context = {
-        'calendar_data': calendar_data,
-        'current_month': first_day,
-        'prev_month': prev_month,
-        'next_month': next_month,
-        'year': year,
-        'month': month,
-    }
-    return render(request, 'calendar.html', context)
+    # Only the month grid, for in-page prev/next navigation
+    return HttpResponse(render_month_fragment(request.user, year, month))
 
 
 # Contraceptive Views
+@read_only_view
 @login_required
 def contraceptive_list_view(request):
-    contraceptive_uses = ContraceptiveUse.objects.filter(user=request.user)
-    contraceptive_types = ContraceptiveType.objects.all()
+    contraceptive_uses = list(ContraceptiveUse.objects.filter(user=request.user))
+    types_by_id = catalogs.contraceptive_types.by_id()
+    for use in contraceptive_uses:
+        # Attach the cached type so the template doesn't query it per row
+        if use.contraceptive_type_id in types_by_id:
+            use.contraceptive_type = types_by_id[use.contraceptive_type_id]
+    contraceptive_types = catalogs.contraceptive_types.all()
     
     context = {
         'contraceptive_uses': contraceptive_uses,
@@ -375,11 +323,14 @@ def add_contraceptive_use_view(request):
             contraceptive_use.user = request.user
             contraceptive_use.save()
             
+            messages.success(request, 'Contraceptive use recorded successfully!')
+            
             # If it's emergency contraception, update predictions
             if contraceptive_use.reason == 'emergency':
-                update_predictions_for_emergency_contraception(request.user, contraceptive_use)
-            
-            messages.success(request, 'Contraceptive use recorded successfully!')
+                report_prediction_changes(
+                    request,
+                    update_predictions_for_emergency_contraception(request.user, contraceptive_use)
+                )
             return redirect('contraceptive_list')
     else:
         form = ContraceptiveUseForm()
@@ -388,6 +339,7 @@ def add_contraceptive_use_view(request):
 
 
 # Health Provider Views
+@read_only_view
 @login_required
 def health_provider_list_view(request):
     providers = HealthProvider.objects.filter(user=request.user)
@@ -411,6 +363,7 @@ def add_health_provider_view(request):
 
 
 # Appointment Views
+@read_only_view
 @login_required
 def appointment_list_view(request):
     appointments = Appointment.objects.filter(user=request.user)
@@ -450,53 +403,74 @@ def settings_view(request):
     return render(request, 'settings.html', {'form': form})
 
 
+@login_required
+def export_data_view(request):
+    if not export_allowed(request.user):
+        messages.error(request, 'Data export is turned off in your privacy settings.')
+        return redirect('settings')
+
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unknown export format.')
+    stream, content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(stream(request.user), content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename="{export_filename(request.user, extension)}"'
+    )
+    return response
+
+
+@login_required
+def import_history_view(request):
+    report = None
+    if request.method == 'POST':
+        form = HistoryImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            import_format = import_format_for(upload.name)
+            if import_format is None:
+                form.add_error('file', 'Upload a .ndjson, .json, .csv or .zip file.')
+            else:
+                try:
+                    report = import_history(request.user, upload, import_format)
+                except (ValueError, zipfile.BadZipFile) as exc:
+                    form.add_error('file', f'Could not read the file: {exc}')
+                else:
+                    messages.success(
+                        request,
+                        f"Imported {report['rows']} rows in {report['seconds']}s."
+                    )
+    else:
+        form = HistoryImportForm()
+
+    return render(request, 'import_history.html', {'form': form, 'report': report})
+
+
 # Insights and Analytics Views
+@read_only_view
 @login_required
 def insights_view(request):
     insights = CycleInsight.objects.filter(user=request.user, is_dismissed=False)
     return render(request, 'insights.html', {'insights': insights})
 
 
+@read_only_view
 @login_required
 def analytics_view(request):
     user = request.user
     
-    # Get cycle statistics
-    periods = Period.objects.filter(user=user).order_by('-start_date')
-    recent_periods = periods[:6]  # Last 6 periods
-    
-    cycle_lengths = []
-    for i in range(len(recent_periods) - 1):
-        current_period = recent_periods[i]
-        next_period = recent_periods[i + 1]
-        cycle_length = (current_period.start_date - next_period.start_date).days
-        cycle_lengths.append(cycle_length)
-    
-    avg_cycle_length = sum(cycle_lengths) / len(cycle_lengths) if cycle_lengths else 0
-    
-    # Get mood patterns
-    mood_logs = DailyLog.objects.filter(
-        user=user,
-        mood__isnull=False,
-        date__gte=date.today() - timedelta(days=90)
-    )
-    
-    context = {
-        'periods': recent_periods,
-        'cycle_lengths': cycle_lengths,
-        'avg_cycle_length': round(avg_cycle_length, 1),
-        'mood_logs': mood_logs,
-    }
+    context = analytics_context(get_cycle_stats(user), get_cycle_phases(user))
     return render(request, 'analytics.html', context)
 
 
 # Notifications Views
+@read_only_view
 @login_required
 def notifications_view(request):
-    notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-    paginator = Paginator(notifications, 20)
-    page_number = request.GET.get('page')
-    notifications = paginator.get_page(page_number)
+    notifications = keyset_page(
+        Notification.objects.filter(user=request.user), NOTIFICATION_PAGE_KEYS, request,
+        NOTIFICATIONS_PER_PAGE
+    )
     
     return render(request, 'notifications.html', {'notifications': notifications})
 
@@ -510,46 +484,51 @@ def mark_notification_read_view(request, notification_id):
 
 
 # Utility Functions
-def generate_predictions(user):
-    """Generate cycle predictions based on user's cycle history"""
-    cycle_profile = user.cycleprofile
-    recent_periods = Period.objects.filter(user=user).order_by('-start_date')[:3]
-    
-    if not recent_periods:
-        return
-    
-    last_period = recent_periods[0]
-    avg_cycle_length = cycle_profile.average_cycle_length
-    
-    # Clear old predictions
-    Prediction.objects.filter(user=user).update(is_active=False)
-    
-    # Predict next period
-    next_period_date = last_period.start_date + timedelta(days=avg_cycle_length)
-    Prediction.objects.create(
-        user=user,
-        prediction_type='next_period',
-        predicted_date=next_period_date,
-        confidence_level='medium' if len(recent_periods) >= 3 else 'low'
-    )
-    
-    # Predict ovulation (typically 14 days before next period)
-    ovulation_date = next_period_date - timedelta(days=14)
-    Prediction.objects.create(
-        user=user,
-        prediction_type='ovulation',
-        predicted_date=ovulation_date,
-        confidence_level='medium'
-    )
+def requested_month(request):
+    """(year, month) of the ?year= and ?month= parameters, this month by default"""
+    today = date.today()
+    try:
+        year = int(request.GET.get('year', today.year))
+        month = int(request.GET.get('month', today.month))
+    except ValueError:
+        return today.year, today.month
+    # Out of range months fall back too; the first and last years are
+    # excluded so the previous and next months still exist
+    if not (1 <= month <= 12 and MINYEAR < year < MAXYEAR):
+        return today.year, today.month
+    return year, month
+
+
+def calendar_context(year, month, calendar_grid_html):
+    # Get the first and last day of the month
+    first_day, last_day = month_span(year, month)
     
-    # Predict fertile window (5 days before and 1 day after ovulation)
-    fertile_start = ovulation_date - timedelta(days=5)
-    Prediction.objects.create(
-        user=user,
-        prediction_type='fertile_window',
-        predicted_date=fertile_start,
-        confidence_level='medium'
-    )
+    # Navigation dates
+    return {
+        'calendar_grid_html': calendar_grid_html,
+        'current_month': first_day,
+        'prev_month': first_day - timedelta(days=1),
+        'next_month': last_day + timedelta(days=1),
+        'year': year,
+        'month': month,
+    }
+
+
+def analytics_context(stats, phases):
+    return {
+        'stats': stats,
+        'periods': stats['recent_periods'],
+        'cycle_lengths': stats['recent_cycle_lengths'],
+        'phases': phases,
+    }
+
+
+def report_prediction_changes(request, touched):
+    """Tell the user how many prediction rows a regeneration wrote"""
+    if touched:
+        messages.info(request, f'Predictions updated ({touched} row{"s" if touched != 1 else ""} changed).')
+    else:
+        messages.info(request, 'Predictions unchanged.')
 
 
 def update_predictions_for_emergency_contraception(user, contraceptive_use):
@@ -557,22 +536,10 @@ def update_predictions_for_emergency_contraception(user, contraceptive_use):
     contraceptive_type = contraceptive_use.contraceptive_type
     
     if contraceptive_type.typical_cycle_delay_days:
-        # Get current next period prediction
-        next_period_prediction = Prediction.objects.filter(
-            user=user,
-            prediction_type='next_period',
-            is_active=True
-        ).first()
+        # The delay is one of the prediction inputs, so regenerating picks it up
+        touched = generate_predictions(user)
         
-        if next_period_prediction:
-            # Delay the prediction
-            new_date = next_period_prediction.predicted_date + timedelta(
-                days=contraceptive_type.typical_cycle_delay_days
-            )
-            next_period_prediction.predicted_date = new_date
-            next_period_prediction.confidence_level = 'low'
-            next_period_prediction.save()
-            
+        if touched:
             # Create insight about potential delay
             CycleInsight.objects.create(
                 user=user,
@@ -581,4 +548,6 @@ def update_predictions_for_emergency_contraception(user, contraceptive_use):
                 description=f'Due to taking {contraceptive_type.name}, your next period may be delayed by up to {contraceptive_type.typical_cycle_delay_days} days.',
                 data_period_start=date.today(),
                 data_period_end=date.today()
-            )
\ No newline at end of file
+            )
+        return touched
+    return 0